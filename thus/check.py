@@ -26,12 +26,12 @@
 
 """ Check screen (detects if Manjaro prerequisites are meet) """
 
-from gi.repository import GLib
 import subprocess
 import os
 import logging
 
 import misc.misc as misc
+import misc.hotplug as hotplug
 
 from gtkbasebox import GtkBaseBox
 
@@ -52,14 +52,14 @@ class Check(GtkBaseBox):
         """ Init class ui """
         super().__init__(self, params, "check", prev_page, next_page)
 
-        self.remove_timer = False
+        # Signal handlers connected to the system monitor
+        self.monitor_handlers = []
 
         self.thread = None
 
         self.prepare_power_source = None
         self.prepare_network_connection = None
         self.prepare_enough_space = None
-        self.timeout_id = None
         self.prepare_best_results = None
 
         self.label_space = self.ui.get_object("label_space")
@@ -153,16 +153,44 @@ class Check(GtkBaseBox):
 
         return False
 
-    def on_timer(self):
-        """ If all requirements are meet, enable forward button """
-        if not self.remove_timer:
-            self.forward_button.set_sensitive(self.check_all())
-        return not self.remove_timer
+    def start_monitoring(self):
+        """ Update requirements when the system tells us they have changed (no polling) """
+        if self.monitor_handlers:
+            return
+        monitor = hotplug.get_monitor()
+        self.monitor_handlers = [
+            monitor.connect('block-changed', self.on_block_changed),
+            monitor.connect('power-changed', self.on_power_changed),
+            monitor.connect('network-changed', self.on_network_changed)]
+
+    def stop_monitoring(self):
+        """ Disconnect from the system monitor """
+        monitor = hotplug.get_monitor()
+        for handler in self.monitor_handlers:
+            monitor.disconnect(handler)
+        self.monitor_handlers = []
+
+    def release(self):
+        self.stop_monitoring()
+        super().release()
+
+    def on_block_changed(self, monitor):
+        """ A disk has been plugged in or removed. If there's enough space, enable forward button """
+        space = self.has_enough_space()
+        self.prepare_enough_space.set_state(space)
+        self.forward_button.set_sensitive(space)
+
+    def on_power_changed(self, monitor):
+        """ Power source has changed """
+        self.prepare_power_source.set_state(not self.on_battery())
+
+    def on_network_changed(self, monitor, connected):
+        """ Network connection has changed """
+        self.prepare_network_connection.set_state(connected)
 
     def store_values(self):
         """ Continue """
-        # Remove timer
-        self.remove_timer = True
+        self.stop_monitoring()
         has_internet = misc.has_connection()
 
         if has_internet:
@@ -187,8 +215,7 @@ class Check(GtkBaseBox):
 
         self.forward_button.set_sensitive(self.check_all())
 
-        # Set timer
-        self.timeout_id = GLib.timeout_add(5000, self.on_timer)
+        self.start_monitoring()
 
 # When testing, no _() is available
 try:
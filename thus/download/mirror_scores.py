@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  mirror_scores.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Scores of package mirrors, measured while downloading (time to first
+    byte, throughput and failures) and kept between runs """
+
+import os
+import json
+import logging
+import threading
+import urllib.parse
+
+SCORES_PATH = "/var/cache/thus/mirror_scores.json"
+
+# Weight of a new measure in the moving averages
+ALPHA = 0.3
+
+# Package size used to compare mirrors (time to first byte matters more for
+# small packages, throughput for big ones)
+TYPICAL_SIZE = 512 * 1024
+
+# Transfers smaller than this don't measure throughput
+MIN_THROUGHPUT_LENGTH = 64 * 1024
+
+# Bytes per second under which a mirror is too slow
+THROUGHPUT_FLOOR = 32 * 1024
+
+
+def get_mirror(url):
+    """ http://mirror.example.org/manjaro/stable/... -> http://mirror.example.org """
+    parts = urllib.parse.urlsplit(url.strip())
+    return "{0}://{1}".format(parts.scheme, parts.netloc)
+
+
+class MirrorScores(object):
+    """ Moving averages of each mirror. Lower scores (the expected seconds
+        to download a TYPICAL_SIZE package) are better """
+
+    def __init__(self, path=SCORES_PATH):
+        self.path = path
+        # mirror: {'ttfb': seconds, 'throughput': bytes/s, 'failures': rate}
+        self.mirrors = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as scores_file:
+                mirrors = json.load(scores_file)
+        except (OSError, ValueError):
+            return
+        if isinstance(mirrors, dict):
+            with self.lock:
+                self.mirrors = mirrors
+
+    def save(self):
+        """ Stores the scores (atomically, a reader never sees half of them) """
+        tmp_path = "{0}.{1}".format(self.path, os.getpid())
+        with self.lock:
+            mirrors = dict(self.mirrors)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w') as scores_file:
+                json.dump(mirrors, scores_file)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            logging.debug("Can't store mirror scores in %s: %s", self.path, err)
+
+    @staticmethod
+    def average(old, new):
+        if old is None:
+            return new
+        return old + ALPHA * (new - old)
+
+    def record(self, mirror, ttfb=None, length=0, seconds=0):
+        """ Records a request answered after ttfb seconds and length bytes
+            read in seconds (after the first byte) """
+        with self.lock:
+            stats = self.mirrors.setdefault(mirror, {})
+            if ttfb is not None:
+                stats['ttfb'] = self.average(stats.get('ttfb'), ttfb)
+                # It has answered
+                stats['failures'] = self.average(stats.get('failures'), 0.0)
+            if length >= MIN_THROUGHPUT_LENGTH and seconds > 0:
+                stats['throughput'] = self.average(stats.get('throughput'), length / seconds)
+
+    def record_failure(self, mirror):
+        with self.lock:
+            stats = self.mirrors.setdefault(mirror, {})
+            stats['failures'] = self.average(stats.get('failures'), 1.0)
+
+    def get_score(self, mirror):
+        """ Returns the score of a mirror (None if we don't know its throughput) """
+        with self.lock:
+            stats = self.mirrors.get(mirror)
+            if not stats:
+                return None
+            ttfb = stats.get('ttfb') or 0
+            throughput = stats.get('throughput')
+            failures = stats.get('failures') or 0
+
+        if throughput is None:
+            if ttfb == 0 and failures > 0:
+                # It has only failed
+                return float('inf')
+            # A fast answer says nothing about how long a package takes
+            return None
+
+        seconds = ttfb
+        if throughput:
+            seconds += TYPICAL_SIZE / throughput
+        # A mirror that fails half of the times costs about twice
+        return seconds / max(1.0 - failures, 0.1)
+
+    def is_too_slow(self, mirror):
+        """ Whether the mirror has been under the throughput floor """
+        with self.lock:
+            throughput = self.mirrors.get(mirror, {}).get('throughput')
+        return throughput is not None and throughput < THROUGHPUT_FLOOR
+
+    def sort_urls(self, urls):
+        """ Returns urls, best mirrors first. Unknown mirrors get the median
+            score (after the known ones with that score), so they are tried
+            too. Otherwise metalink order is kept """
+        scores = [self.get_score(get_mirror(url)) if url else float('inf') for url in urls]
+        known = sorted(score for score in scores if score is not None)
+        neutral = known[len(known) // 2] if known else 0
+
+        def get_key(index):
+            if scores[index] is None:
+                return neutral, 1
+            return scores[index], 0
+
+        order = sorted(range(len(urls)), key=get_key)
+        return [urls[index] for index in order]
@@ -30,6 +30,44 @@ from gi.repository import Gtk
 
 import os
 import logging
+import threading
+
+import misc.profiler as profiler
+
+# ui file path: its contents. GTK can't copy the widgets of a Gtk.Builder, so
+# each page still builds its own, but no page has to wait for the live media
+_ui_definitions = {}
+_ui_definitions_lock = threading.Lock()
+
+
+def get_ui_definition(path):
+    """ Returns the contents of a ui file, reading it if it is not cached """
+    with _ui_definitions_lock:
+        definition = _ui_definitions.get(path)
+    if definition is None:
+        with open(path, encoding='utf-8') as ui_file:
+            definition = ui_file.read()
+        with _ui_definitions_lock:
+            _ui_definitions[path] = definition
+    return definition
+
+
+def preload_ui_definitions(ui_dir):
+    """ Reads all ui files of ui_dir in a background thread """
+    def preload():
+        try:
+            file_names = os.listdir(ui_dir)
+        except OSError as err:
+            logging.debug("Can't preload ui files: %s", err)
+            return
+        for file_name in file_names:
+            if file_name.endswith(".ui"):
+                try:
+                    get_ui_definition(os.path.join(ui_dir, file_name))
+                except (OSError, UnicodeDecodeError) as err:
+                    logging.debug("Can't preload %s: %s", file_name, err)
+
+    threading.Thread(target=preload, daemon=True).start()
 
 
 class GtkBaseBox(Gtk.Box):
@@ -59,7 +97,8 @@ class GtkBaseBox(Gtk.Box):
 
         self.ui = Gtk.Builder()
         self.ui_file = os.path.join(self.ui_dir, "{}.ui".format(name))
-        self.ui.add_from_file(self.ui_file)
+        with profiler.span(self.ui_file, "builder"):
+            self.ui.add_from_string(get_ui_definition(self.ui_file))
 
         # Connect UI signals
         self.ui.connect_signals(child)
@@ -81,5 +120,11 @@ class GtkBaseBox(Gtk.Box):
     def store_values(self):
         raise NotImplementedError
 
+    def release(self):
+        """ Called before the page is destroyed for good. Pages connected to
+            objects that outlive them (the system monitor, for instance)
+            must disconnect here, or they will never be freed """
+        self.ui = None
+
     def get_name(self):
         return self.name
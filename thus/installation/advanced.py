@@ -31,10 +31,13 @@ from gi.repository import Gtk, Gdk
 import subprocess
 import os
 import logging
+from functools import partial
 
 import misc.misc as misc
 import misc.gtkwidgets as gtkwidgets
 import misc.validation as validation
+import misc.hotplug as hotplug
+from misc.misc import InstallError
 
 import parted3.partition_module as pm
 import parted3.fs_module as fs
@@ -42,6 +45,9 @@ import parted3.lvm as lvm
 import parted3.used_space as used_space
 
 from installation import process as installation_process
+from installation.partition_model import PartitionModel
+from installation.format_stage import FormatStage
+from installation import luks
 import show_message as show
 
 from gtkbasebox import GtkBaseBox
@@ -63,6 +69,9 @@ COL_SSD_VISIBLE = 13
 COL_SSD_SENSITIVE = 14
 COL_ENCRYPTED = 15
 
+# How many changes can be undone
+MAX_UNDO_LEVELS = 100
+
 class InstallationAdvanced(GtkBaseBox):
     """ Installation advanced class. Custom partitioning. """
 
@@ -104,9 +113,27 @@ class InstallationAdvanced(GtkBaseBox):
         # Holds partitions that exist now but are going to be deleted
         self.to_be_deleted = []
 
+        # Snapshots of the staged partition plan (see get_plan_snapshot)
+        self.undo_stack = []
+        self.redo_stack = []
+
         # We will store our devices here
         self.disks = None
 
+        # Probes devices once and tells us which disk has changed
+        self.partition_model = PartitionModel()
+        self.partition_model.connect('disk-changed', self.on_partition_model_disk_changed)
+        self.partition_model.connect('volume-group-changed', self.on_partition_model_volume_group_changed)
+        self.partition_model.connect('reset', self.on_partition_model_reset)
+        self.partition_model.watch(hotplug.get_monitor())
+
+        # Treeview rows of each disk and volume group
+        self.tree_iters = {}
+
+        # Partitions and used mount points of each disk and volume group
+        self.disk_partitions = {}
+        self.mounts = {}
+
         # We will store if our device is SSD or not
         self.ssd = {}
 
@@ -190,6 +217,7 @@ class InstallationAdvanced(GtkBaseBox):
         # Assign images to buttons
         btns = [
             ("partition_button_undo", "edit-undo"),
+            ("partition_button_redo", "edit-redo"),
             ("partition_button_new", "list-add"),
             ("partition_button_delete", "list-remove"),
             ("partition_button_edit", "system-run"),
@@ -249,8 +277,7 @@ class InstallationAdvanced(GtkBaseBox):
             path = model[tree_iter][COL_PATH]
 
         if path is not None:
-            button = {"undo": self.ui.get_object('partition_button_undo'),
-                      "new": self.ui.get_object('partition_button_new'),
+            button = {"new": self.ui.get_object('partition_button_new'),
                       "delete": self.ui.get_object('partition_button_delete'),
                       "edit": self.ui.get_object('partition_button_edit'),
                       "new_label": self.ui.get_object('partition_button_new_label')}
@@ -258,13 +285,12 @@ class InstallationAdvanced(GtkBaseBox):
             for key in button:
                 button[key].set_sensitive(False)
 
-            if self.stage_opts:
-                button["undo"].set_sensitive(True)
+            self.update_undo_buttons()
 
             if path == _("free space"):
                 button["new"].set_sensitive(True)
             else:
-                disks = pm.get_devices()
+                disks = self.partition_model.get_disks()
                 if (path not in disks and 'dev/mapper' not in path) or ('dev/mapper' in path and '-' in path):
                     # A partition is selected
                     diskobj = None
@@ -293,9 +319,7 @@ class InstallationAdvanced(GtkBaseBox):
         self.bootloader_device_entry.remove_all()
         self.bootloader_devices.clear()
 
-        # Just call get_devices once
-        if self.disks is None:
-            self.disks = pm.get_devices()
+        self.disks = self.partition_model.get_disks()
 
         for path in sorted(self.disks):
             (disk, result) = self.disks[path]
@@ -431,224 +455,299 @@ class InstallationAdvanced(GtkBaseBox):
         self.partition_list_store = Gtk.TreeStore(
             str, str, str, str, bool, bool, str, str, str, str, int, bool, bool, bool, bool, bool)
 
-        # Be sure to call get_devices once
-        if self.disks is None:
-            self.disks = pm.get_devices()
+        self.disks = self.partition_model.get_disks()
 
         self.diskdic = {}
-        self.all_partitions = []
-        self.lv_partitions = []
         self.diskdic['mounts'] = []
+        self.mounts = {}
+        self.disk_partitions = {}
+        self.lv_partitions = []
+        self.tree_iters = {}
 
         # Put all volumes (lvm) info in our model
-        volume_groups = lvm.get_volume_groups()
-        if volume_groups:
-            for volume_group in volume_groups:
-                is_ssd = False
-                logical_volumes = lvm.get_logical_volumes(volume_group)
-                if not logical_volumes:
-                    continue
-                row = [volume_group, "", "", "", False, False, "", "", "", "", 0, False, is_ssd, False, False, False]
-                lvparent = self.partition_list_store.append(None, row)
-                for logical_volume in logical_volumes:
-                    fmt_enable = True
-                    fmt_active = False
-                    label = ""
-                    mount_point = ""
-                    formatable = True
-
-                    partition_path = "/dev/mapper/{0}-{1}".format(volume_group, logical_volume)
-                    self.all_partitions.append(partition_path)
-                    self.lv_partitions.append(partition_path)
+        volume_groups = self.partition_model.get_volume_groups()
+        for volume_group in sorted(volume_groups):
+            is_ssd = False
+            row = [volume_group, "", "", "", False, False, "", "", "", "", 0, False, is_ssd, False, False, False]
+            self.tree_iters[volume_group] = self.partition_list_store.append(None, row)
+            self.fill_volume_group_rows(volume_group)
 
-                    uid = self.gen_partition_uid(path=partition_path)
+        # Fill our model with the rest of devices (non LVM)
+        for disk_path in sorted(self.disks):
+            if '/dev/mapper/arch_' in disk_path:
+                # Already added
+                continue
 
-                    if fs.get_type(partition_path):
-                        fs_type = fs.get_type(partition_path)
-                    elif used_space.is_btrfs(partition_path):
-                        # kludge, btrfs not being detected...
-                        fs_type = 'btrfs'
-                    else:
-                        # Say unknown if we can't detect fs type instead of assumming btrfs
-                        fs_type = 'unknown'
+            (disk, result) = self.disks[disk_path]
 
-                    if uid in self.stage_opts:
-                        (is_new, label, mount_point, fs_type, fmt_active) = self.stage_opts[uid]
+            if disk is None or '/dev/mapper/' not in disk_path:
+                row = self.get_disk_row(disk_path)
+                self.tree_iters[disk_path] = self.partition_list_store.append(None, row)
 
-                    info = fs.get_info(partition_path)
-                    if 'LABEL' in info:
-                        label = info['LABEL']
+            self.fill_disk_rows(disk_path)
 
-                    if mount_point:
-                        self.diskdic['mounts'].append(mount_point)
+        self.first_time_in_fill_partition_list = False
 
-                    # Do not show swap version, only the 'swap' word
-                    if 'swap' in fs_type:
-                        fs_type = 'swap'
+        self.update_partitions_and_mounts()
 
-                    row = [partition_path, fs_type, mount_point, label, fmt_active, formatable, '', '',
-                           partition_path, "", 0, fmt_enable, is_ssd, False, False, False]
+        # Assign our new model to our treeview
+        self.partition_list.set_model(self.partition_list_store)
+        self.partition_list.expand_all()
 
-                    self.partition_list_store.append(lvparent, row)
+        # Check if correct mount points are already defined, so we can proceed with installation
+        self.check_mount_points()
 
-                    if self.first_time_in_fill_partition_list:
-                        self.orig_part_dic[partition_path] = uid
-                        self.orig_label_dic[partition_path] = label
+    def get_disk_row(self, disk_path):
+        """ Returns the treeview row of a disk (without its partitions) """
+        if disk_path not in self.ssd:
+            self.ssd[disk_path] = fs.is_ssd(disk_path)
 
-        # Fill our model with the rest of devices (non LVM)
-        for disk_path in sorted(self.disks):
-            if '/dev/mapper/arch_' in disk_path:
-                # Already added
-                continue
+        is_ssd = self.ssd[disk_path]
+
+        (disk, result) = self.disks[disk_path]
 
-            self.diskdic[disk_path] = {}
-            self.diskdic[disk_path]['has_logical'] = False
-            self.diskdic[disk_path]['has_extended'] = False
+        if disk is None:
+            # Disk without a partition table
+            return [disk_path, "", "", "", False, False, "", "", "", "", 0, False, is_ssd, False, False, False]
 
-            if disk_path not in self.ssd:
-                self.ssd[disk_path] = fs.is_ssd(disk_path)
+        dev = disk.device
 
-            is_ssd = self.ssd[disk_path]
+        # Get device size
+        size_txt = self.get_size(dev.length, dev.sectorSize)
 
-            (disk, result) = self.disks[disk_path]
+        return [dev.path, "", "", "", False, False, size_txt, "", "", "", 0, False, is_ssd, True, True, False]
 
-            if disk is None:
-                # Disk without a partition table
-                row = [disk_path, "", "", "", False, False, "", "", "", "", 0, False, is_ssd, False, False, False]
-                self.partition_list_store.append(None, row)
-            elif '/dev/mapper/' in disk_path:
-                # Already added
+    def fill_volume_group_rows(self, volume_group):
+        """ Appends the logical volumes of volume_group to its row in the treeview """
+        lvparent = self.tree_iters[volume_group]
+        self.mounts[volume_group] = []
+        is_ssd = False
+
+        for logical_volume in self.partition_model.get_volume_groups()[volume_group]:
+            fmt_enable = True
+            fmt_active = False
+            label = ""
+            mount_point = ""
+            formatable = True
+
+            partition_path = "/dev/mapper/{0}-{1}".format(volume_group, logical_volume)
+            self.lv_partitions.append(partition_path)
+
+            uid = self.gen_partition_uid(path=partition_path)
+
+            fs_type = self.partition_model.get_lv_fs_type(partition_path)
+
+            if uid in self.stage_opts:
+                (is_new, label, mount_point, fs_type, fmt_active) = self.stage_opts[uid]
+
+            if self.partition_model.get_label(partition_path):
+                label = self.partition_model.get_label(partition_path)
+
+            if mount_point:
+                self.mounts[volume_group].append(mount_point)
+
+            # Do not show swap version, only the 'swap' word
+            if 'swap' in fs_type:
+                fs_type = 'swap'
+
+            row = [partition_path, fs_type, mount_point, label, fmt_active, formatable, '', '',
+                   partition_path, "", 0, fmt_enable, is_ssd, False, False, False]
+
+            self.partition_list_store.append(lvparent, row)
+
+            if self.first_time_in_fill_partition_list:
+                self.orig_part_dic[partition_path] = uid
+                self.orig_label_dic[partition_path] = label
+
+    def fill_disk_rows(self, disk_path):
+        """ Appends the partitions of disk_path to its row in the treeview """
+        self.diskdic[disk_path] = {}
+        self.diskdic[disk_path]['has_logical'] = False
+        self.diskdic[disk_path]['has_extended'] = False
+
+        self.mounts[disk_path] = []
+
+        if disk_path in self.disk_partitions:
+            del self.disk_partitions[disk_path]
+
+        (disk, result) = self.disks[disk_path]
+
+        if disk is None or '/dev/mapper/' in disk_path:
+            return
+
+        dev = disk.device
+        disk_parent = self.tree_iters[disk_path]
+        extended_parent = None
+
+        # Create a list of partitions for this device (/dev/sda for example)
+        partitions = pm.get_partitions(disk)
+        self.disk_partitions[disk_path] = partitions
+        partition_list = pm.order_partitions(partitions)
+
+        # Append all partitions to our model
+        for partition_path in partition_list:
+            # Get partition size
+            partition = partitions[partition_path]
+            size_txt = self.get_size(partition.geometry.length, dev.sectorSize)
+            fmt_active = False
+            label = ""
+            mount_point = ""
+            used = ""
+            formatable = True
+
+            path = partition.path
+
+            # Skip lvm, LUKS, cdrom, ...
+            if '/dev/mapper' in path or 'sr0' in path:
                 continue
+
+            # Get filesystem
+            if partition.fileSystem and partition.fileSystem.type:
+                fs_type = partition.fileSystem.type
+            # Check if its free space before trying to get the filesystem with blkid.
+            elif 'free' in partition_path:
+                fs_type = _("none")
+            elif self.partition_model.get_fs_type(path):
+                fs_type = self.partition_model.get_fs_type(path)
             else:
-                dev = disk.device
+                # Unknown filesystem
+                fs_type = '?'
+
+            # Nothing should be mounted at this point
+
+            if partition.type == pm.PARTITION_EXTENDED:
+                formatable = False
+                self.diskdic[disk_path]['has_extended'] = True
+            elif partition.type == pm.PARTITION_LOGICAL:
+                formatable = True
+                self.diskdic[disk_path]['has_logical'] = True
+
+            if partition.type in (pm.PARTITION_FREESPACE, pm.PARTITION_FREESPACE_EXTENDED):
+                # Show 'free space' instead of /dev/sda-1
+                path = _("free space")
+                formatable = False
+            # else:
+            #    # Get partition flags
+            #    flags = pm.get_flags(partition)
+
+            uid = self.gen_partition_uid(partition=partition)
+            if uid in self.stage_opts:
+                (is_new, label, mount_point, fs_type, fmt_active) = self.stage_opts[uid]
+                fmt_enable = not is_new
+            else:
+                fmt_enable = True
+                if _("free space") not in path:
+                    if self.first_time_in_fill_partition_list:
+                        if mount_point:
+                            used = pm.get_used_space(partition)
+                        else:
+                            used = used_space.get_used_space(partition_path,
+                                                             fs_type) * partition.geometry.length
+                            used = self.get_size(used, dev.sectorSize)
+                        self.used_dic[(disk_path, partition.geometry.start)] = used
+                    else:
+                        if (disk_path, partition.geometry.start) in self.used_dic:
+                            used = self.used_dic[(disk_path, partition.geometry.start)]
+                        else:
+                            used = '0b'
+                    if self.partition_model.get_label(partition_path):
+                        label = self.partition_model.get_label(partition_path)
 
-                # Get device size
-                size_txt = self.get_size(dev.length, dev.sectorSize)
+            if mount_point:
+                self.mounts[disk_path].append(mount_point)
 
-                # Append the device info to our model
-                row = [dev.path, "", "", "", False, False, size_txt, "", "", "", 0, False, is_ssd, True, True, False]
-                disk_parent = self.partition_list_store.append(None, row)
+            if partition.type == pm.PARTITION_EXTENDED:
+                # Show 'extended' in file system type column
+                fs_type = 'extended'
 
-                extended_parent = None
+            # Do not show swap version, only the 'swap' word
+            if 'swap' in fs_type:
+                fs_type = 'swap'
 
-                # Create a list of partitions for this device (/dev/sda for example)
-                partitions = pm.get_partitions(disk)
-                self.all_partitions.append(partitions)
-                partition_list = pm.order_partitions(partitions)
-
-                # Append all partitions to our model
-                for partition_path in partition_list:
-                    # Get partition size
-                    partition = partitions[partition_path]
-                    size_txt = self.get_size(partition.geometry.length, dev.sectorSize)
-                    fmt_active = False
-                    label = ""
-                    mount_point = ""
-                    used = ""
-                    formatable = True
-
-                    path = partition.path
-
-                    # Skip lvm, LUKS, cdrom, ...
-                    if '/dev/mapper' in path or 'sr0' in path:
-                        continue
+            row = [path, fs_type, mount_point, label, fmt_active, formatable, size_txt, used,
+                   partition_path, "", partition.type, fmt_enable, False, False, False, False]
 
-                    # Get filesystem
-                    if partition.fileSystem and partition.fileSystem.type:
-                        fs_type = partition.fileSystem.type
-                    # Check if its free space before trying to get the filesystem with blkid.
-                    elif 'free' in partition_path:
-                        fs_type = _("none")
-                    elif fs.get_type(path):
-                        fs_type = fs.get_type(path)
-                    else:
-                        # Unknown filesystem
-                        fs_type = '?'
-
-                    # Nothing should be mounted at this point
-
-                    if partition.type == pm.PARTITION_EXTENDED:
-                        formatable = False
-                        self.diskdic[disk_path]['has_extended'] = True
-                    elif partition.type == pm.PARTITION_LOGICAL:
-                        formatable = True
-                        self.diskdic[disk_path]['has_logical'] = True
-
-                    if partition.type in (pm.PARTITION_FREESPACE, pm.PARTITION_FREESPACE_EXTENDED):
-                        # Show 'free space' instead of /dev/sda-1
-                        path = _("free space")
-                        formatable = False
-                    # else:
-                    #    # Get partition flags
-                    #    flags = pm.get_flags(partition)
-
-                    uid = self.gen_partition_uid(partition=partition)
-                    if uid in self.stage_opts:
-                        (is_new, label, mount_point, fs_type, fmt_active) = self.stage_opts[uid]
-                        fmt_enable = not is_new
-                    else:
-                        fmt_enable = True
-                        if _("free space") not in path:
-                            if self.first_time_in_fill_partition_list:
-                                if mount_point:
-                                    used = pm.get_used_space(partition)
-                                else:
-                                    used = used_space.get_used_space(partition_path,
-                                                                     fs_type) * partition.geometry.length
-                                    used = self.get_size(used, dev.sectorSize)
-                                self.used_dic[(disk_path, partition.geometry.start)] = used
-                            else:
-                                if (disk_path, partition.geometry.start) in self.used_dic:
-                                    used = self.used_dic[(disk_path, partition.geometry.start)]
-                                else:
-                                    used = '0b'
-                            info = fs.get_info(partition_path)
-                            if 'LABEL' in info:
-                                label = info['LABEL']
+            if partition.type in (pm.PARTITION_LOGICAL, pm.PARTITION_FREESPACE_EXTENDED):
+                # Our parent (in the treeview) will be the extended partition we're in, not the disk
+                parent = extended_parent
+            else:
+                # Our parent (in the treeview) will be the disk we're in
+                parent = disk_parent
 
-                    if mount_point:
-                        self.diskdic['mounts'].append(mount_point)
+            tree_iter = self.partition_list_store.append(parent, row)
 
-                    if partition.type == pm.PARTITION_EXTENDED:
-                        # Show 'extended' in file system type column
-                        fs_type = 'extended'
+            # If we're an extended partition, all the logical partitions
+            # that follow will be shown as children of this one
+            if partition.type == pm.PARTITION_EXTENDED:
+                extended_parent = tree_iter
 
-                    # Do not show swap version, only the 'swap' word
-                    if 'swap' in fs_type:
-                        fs_type = 'swap'
+            if self.first_time_in_fill_partition_list:
+                self.orig_part_dic[partition.path] = self.gen_partition_uid(partition=partition)
+                self.orig_label_dic[partition.path] = label
 
-                    row = [path, fs_type, mount_point, label, fmt_active, formatable, size_txt, used,
-                           partition_path, "", partition.type, fmt_enable, False, False, False, False]
+    def update_partitions_and_mounts(self):
+        """ Rebuilds all_partitions and the used mount points list
+            from the per disk (and per volume group) data """
+        self.all_partitions = list(self.lv_partitions)
+        for disk_path in sorted(self.disk_partitions):
+            self.all_partitions.append(self.disk_partitions[disk_path])
 
-                    if partition.type in (pm.PARTITION_LOGICAL, pm.PARTITION_FREESPACE_EXTENDED):
-                        # Our parent (in the treeview) will be the extended partition we're in, not the disk
-                        parent = extended_parent
-                    else:
-                        # Our parent (in the treeview) will be the disk we're in
-                        parent = disk_parent
+        self.diskdic['mounts'] = []
+        for mounts in self.mounts.values():
+            self.diskdic['mounts'].extend(mounts)
+
+    def remove_child_rows(self, tree_iter):
+        """ Removes all rows under tree_iter """
+        child_iter = self.partition_list_store.iter_children(tree_iter)
+        while child_iter is not None:
+            if not self.partition_list_store.remove(child_iter):
+                child_iter = None
+
+    def on_partition_model_disk_changed(self, partition_model, disk_path):
+        """ Only refresh the rows of the disk that has changed """
+        if self.partition_list_store is None or disk_path not in self.tree_iters:
+            self.update_view()
+            return
 
-                    tree_iter = self.partition_list_store.append(parent, row)
+        disk_iter = self.tree_iters[disk_path]
+        self.partition_list_store[disk_iter] = self.get_disk_row(disk_path)
+        self.remove_child_rows(disk_iter)
+        self.fill_disk_rows(disk_path)
+        self.update_partitions_and_mounts()
 
-                    # If we're an extended partition, all the logical partitions
-                    # that follow will be shown as children of this one
-                    if partition.type == pm.PARTITION_EXTENDED:
-                        extended_parent = tree_iter
+        tree_path = self.partition_list_store.get_path(disk_iter)
+        self.partition_list.expand_row(tree_path, True)
 
-                    if self.first_time_in_fill_partition_list:
-                        self.orig_part_dic[partition.path] = self.gen_partition_uid(partition=partition)
-                        self.orig_label_dic[partition.path] = label
+        self.check_mount_points()
 
-        self.first_time_in_fill_partition_list = False
+    def on_partition_model_volume_group_changed(self, partition_model, volume_group):
+        """ Only refresh the rows of the volume group that has changed """
+        if self.partition_list_store is None or volume_group not in self.tree_iters:
+            self.update_view()
+            return
 
-        # Assign our new model to our treeview
-        self.partition_list.set_model(self.partition_list_store)
-        self.partition_list.expand_all()
+        vg_prefix = "/dev/mapper/{0}-".format(volume_group)
+        self.lv_partitions = [lv for lv in self.lv_partitions if not lv.startswith(vg_prefix)]
+
+        vg_iter = self.tree_iters[volume_group]
+        self.remove_child_rows(vg_iter)
+        self.fill_volume_group_rows(volume_group)
+        self.update_partitions_and_mounts()
+
+        tree_path = self.partition_list_store.get_path(vg_iter)
+        self.partition_list.expand_row(tree_path, True)
 
-        # Check if correct mount points are already defined, so we can proceed with installation
         self.check_mount_points()
 
+    def on_partition_model_reset(self, partition_model):
+        """ Disks have been probed again, plugged in or removed """
+        self.update_view()
+
     def on_format_cell_toggled(self, widget, path):
         """ Mark a partition to be formatted """
+        tree_iter = self.partition_list_store.get_iter(path)
+        self.save_undo_state(self.get_disk_path_from_selection(self.partition_list_store, tree_iter))
+
         self.partition_list_store[path][COL_FORMAT_ACTIVE] = not self.partition_list_store[path][COL_FORMAT_ACTIVE]
 
         partition_path = self.partition_list_store[path][COL_PATH]
@@ -728,9 +827,7 @@ class InstallationAdvanced(GtkBaseBox):
         format_check.set_active(row[COL_FORMAT_ACTIVE])
         format_check.set_sensitive(row[COL_FORMAT_SENSITIVE])
 
-        # Be sure to just call get_devices once
-        if self.disks is None:
-            self.disks = pm.get_devices()
+        self.disks = self.partition_model.get_disks()
 
         # Get disk path
         disk_path = self.get_disk_path_from_selection(model, tree_iter)
@@ -755,6 +852,8 @@ class InstallationAdvanced(GtkBaseBox):
             if new_mount in self.diskdic['mounts'] and new_mount != row[COL_MOUNT_POINT]:
                 show.warning(self.get_toplevel(), _("Can't use same mount point twice."))
             else:
+                self.save_undo_state(disk_path)
+
                 if row[COL_MOUNT_POINT]:
                     self.diskdic['mounts'].remove(row[COL_MOUNT_POINT])
 
@@ -781,7 +880,11 @@ class InstallationAdvanced(GtkBaseBox):
         self.edit_partition_dialog.hide()
 
         # Update the partition list treeview
-        self.update_view()
+        if disk_path in self.disks:
+            self.partition_model.disk_changed(disk_path)
+        else:
+            # It's a logical volume, its parent is a volume group
+            self.partition_model.volume_group_changed(disk_path)
 
     def update_view(self):
         """ Reloads widgets contents """
@@ -831,6 +934,10 @@ class InstallationAdvanced(GtkBaseBox):
         # size_available = row[COL_SIZE]
         partition_path = row[COL_PARTITION_PATH]
 
+        disk_path = self.get_disk_path_from_selection(model, tree_iter)
+
+        self.save_undo_state(disk_path)
+
         if mount_point in self.diskdic['mounts']:
             self.diskdic['mounts'].remove(mount_point)
 
@@ -848,14 +955,11 @@ class InstallationAdvanced(GtkBaseBox):
                 if uid == self.orig_part_dic[orig_part]:
                     self.to_be_deleted.append(orig_part)
 
-        disk_path = self.get_disk_path_from_selection(model, tree_iter)
         self.disks_changed.append(disk_path)
 
         logging.info(_("You will delete the partition {0} from disk {1}".format(partition_path, disk_path)))
 
-        # Be sure to just call get_devices once
-        if self.disks is None:
-            self.disks = pm.get_devices()
+        self.disks = self.partition_model.get_disks()
 
         (disk, result) = self.disks[disk_path]
 
@@ -880,7 +984,7 @@ class InstallationAdvanced(GtkBaseBox):
         pm.delete_partition(disk, part)
 
         # Update the partition list treeview
-        self.update_view()
+        self.partition_model.disk_changed(disk_path)
 
     @staticmethod
     def get_mount_point(partition_path):
@@ -952,9 +1056,7 @@ class InstallationAdvanced(GtkBaseBox):
         disk_path = model[parent_iter][COL_PATH]
         self.disks_changed.append(disk_path)
 
-        # Be sure to just call get_devices once
-        if self.disks is None:
-            self.disks = pm.get_devices()
+        self.disks = self.partition_model.get_disks()
 
         (disk, result) = self.disks[disk_path]
 
@@ -1055,6 +1157,8 @@ class InstallationAdvanced(GtkBaseBox):
             if mymount in self.diskdic['mounts']:
                 show.warning(self.get_toplevel(), _("Can't use same mount point twice..."))
             else:
+                self.save_undo_state(disk_path)
+
                 if mymount:
                     self.diskdic['mounts'].append(mymount)
 
@@ -1116,7 +1220,7 @@ class InstallationAdvanced(GtkBaseBox):
                             self.settings.set('luks_root_volume', self.tmp_luks_options[1])
 
                 # Update partition list treeview
-                self.update_view()
+                self.partition_model.disk_changed(disk_path)
 
         self.create_partition_dialog.hide()
 
@@ -1228,21 +1332,80 @@ class InstallationAdvanced(GtkBaseBox):
             p_mount_combo.show()
             p_mount_label.show()
 
-    def on_partition_list_undo_activate(self, button):
-        """ Undo all user changes """
-        # To undo user changes, we simply reload all devices
-        self.disks = pm.get_devices()
-        self.disks_changed = []
+    def get_plan_snapshot(self, owner):
+        """ Copies the staged partition plan. If owner is a disk (and not
+            a volume group) a copy of its partition table is stored too.
+            parted's duplicate works in memory, hardware is not touched """
+        disk_snapshot = None
+        if owner in self.disks:
+            (disk, result) = self.disks[owner]
+            if disk is not None:
+                disk = disk.duplicate()
+            disk_snapshot = (disk, result)
+
+        return {
+            'owner': owner,
+            'disk': disk_snapshot,
+            'stage_opts': dict(self.stage_opts),
+            'luks_options': dict(self.luks_options),
+            'to_be_deleted': list(self.to_be_deleted),
+            'disks_changed': list(self.disks_changed),
+            'used_dic': dict(self.used_dic),
+            'use_luks_in_root': self.settings.get('use_luks_in_root'),
+            'luks_root_volume': self.settings.get('luks_root_volume')}
+
+    def restore_plan_snapshot(self, snapshot):
+        """ Restores a snapshot taken with get_plan_snapshot """
+        self.stage_opts = snapshot['stage_opts']
+        self.luks_options = snapshot['luks_options']
+        self.to_be_deleted = snapshot['to_be_deleted']
+        self.disks_changed = snapshot['disks_changed']
+        self.used_dic = snapshot['used_dic']
+        self.settings.set('use_luks_in_root', snapshot['use_luks_in_root'])
+        self.settings.set('luks_root_volume', snapshot['luks_root_volume'])
 
-        # Empty stage partitions' options
-        self.stage_opts = {}
-        self.luks_options = {}
+        # Refresh our partition treeview
+        owner = snapshot['owner']
+        if snapshot['disk'] is not None:
+            (disk, result) = snapshot['disk']
+            self.partition_model.set_disk(owner, disk, result)
+        elif owner in self.tree_iters:
+            self.partition_model.volume_group_changed(owner)
+        else:
+            self.update_view()
 
-        # Empty to be deleted partitions list
-        self.to_be_deleted = []
+        self.update_undo_buttons()
 
-        # Refresh our partition treeview
-        self.update_view()
+    def save_undo_state(self, owner):
+        """ Called before changing the partition plan of owner (a disk or a volume group) """
+        self.undo_stack.append(self.get_plan_snapshot(owner))
+        if len(self.undo_stack) > MAX_UNDO_LEVELS:
+            del self.undo_stack[0]
+        self.redo_stack = []
+        self.update_undo_buttons()
+
+    def update_undo_buttons(self):
+        """ Undo and redo buttons are only sensitive if there is something to undo/redo """
+        button = self.ui.get_object('partition_button_undo')
+        button.set_sensitive(len(self.undo_stack) > 0)
+        button = self.ui.get_object('partition_button_redo')
+        button.set_sensitive(len(self.redo_stack) > 0)
+
+    def on_partition_list_undo_activate(self, button):
+        """ Undo last user change """
+        if not self.undo_stack:
+            return
+        snapshot = self.undo_stack.pop()
+        self.redo_stack.append(self.get_plan_snapshot(snapshot['owner']))
+        self.restore_plan_snapshot(snapshot)
+
+    def on_partition_list_redo_activate(self, button):
+        """ Redo last undone user change """
+        if not self.redo_stack:
+            return
+        snapshot = self.redo_stack.pop()
+        self.undo_stack.append(self.get_plan_snapshot(snapshot['owner']))
+        self.restore_plan_snapshot(snapshot)
 
     def on_partition_list_treeview_selection_changed(self, selection):
         """ Selection in treeview changed, call check_buttons to update them """
@@ -1329,6 +1492,9 @@ class InstallationAdvanced(GtkBaseBox):
         btn = self.ui.get_object("partition_button_undo")
         btn.set_label(_("Undo"))
 
+        btn = self.ui.get_object("partition_button_redo")
+        btn.set_label(_("Redo"))
+
         btn = self.ui.get_object("partition_button_new")
         btn.set_label(_("New"))
 
@@ -1476,12 +1642,14 @@ class InstallationAdvanced(GtkBaseBox):
 
         widget_ids = [
             'partition_button_new', 'partition_button_delete', 'partition_button_edit',
-            'partition_button_new_label', 'partition_button_undo']
+            'partition_button_new_label']
 
         for widget_id in widget_ids:
             button = self.ui.get_object(widget_id)
             button.set_sensitive(False)
 
+        self.update_undo_buttons()
+
     def on_partition_list_new_label_activate(self, button):
         """ Create a new partition table """
         # TODO: We should check first if there's any mounted partition (including swap)
@@ -1498,9 +1666,7 @@ class InstallationAdvanced(GtkBaseBox):
 
         disk_path = model[tree_iter][0]
 
-        # Be sure to just call get_devices once
-        if self.disks is None:
-            self.disks = pm.get_devices()
+        self.disks = self.partition_model.get_disks()
 
         # disk_sel, result = self.disks[disk_path]
 
@@ -1522,10 +1688,10 @@ class InstallationAdvanced(GtkBaseBox):
 
                 logging.info(_("Creating a new {0} partition table for disk {1}".format(ptype, disk_path)))
 
-                new_disk = pm.make_new_disk(disk_path, ptype)
-                self.disks[disk_path] = (new_disk, pm.OK)
+                self.save_undo_state(disk_path)
 
-                self.update_view()
+                new_disk = pm.make_new_disk(disk_path, ptype)
+                self.partition_model.set_disk(disk_path, new_disk)
 
                 if ptype == 'gpt' and not os.path.exists('/sys/firmware/efi'):
                     # Show warning (see https://github.com/Antergos/Cnchi/issues/63)
@@ -1543,9 +1709,7 @@ class InstallationAdvanced(GtkBaseBox):
 
         self.disks_changed.append(disk_path)
 
-        # Be sure to just call get_devices once
-        if self.disks is None:
-            self.disks = pm.get_devices()
+        self.disks = self.partition_model.get_disks()
 
         (disk, result) = self.disks[disk_path]
 
@@ -1565,6 +1729,8 @@ class InstallationAdvanced(GtkBaseBox):
 
         # max_size_mb = int((p.geometry.length * dev.sectorSize) / 1000000) + 1
 
+        self.save_undo_state(disk_path)
+
         mylabel = ""
         mymount = ""
         myfmt = "bios-gpt-boot"
@@ -1605,7 +1771,7 @@ class InstallationAdvanced(GtkBaseBox):
                 self.stage_opts[uid] = (True, mylabel, mymount, myfmt, formatme)
 
         # Update partition list treeview
-        self.update_view()
+        self.partition_model.disk_changed(disk_path)
 
     def on_partition_list_lvm_activate(self, button):
         pass
@@ -1675,9 +1841,7 @@ class InstallationAdvanced(GtkBaseBox):
         if self.need_swap():
             part_label["swap"].show()
 
-        # Be sure to just call get_devices once
-        if self.disks is None:
-            self.disks = pm.get_devices()
+        self.disks = self.partition_model.get_disks()
 
         # Check if mount points exist and have the correct filesystem
         for part_path in self.stage_opts:
@@ -1840,7 +2004,7 @@ class InstallationAdvanced(GtkBaseBox):
                                  # Mark root partition to be formatted and check it in list.
                                  fmt = True
                                  self.stage_opts[uid] = (is_new, lbl, mnt, fsystem, fmt)
-                                 self.fill_partition_list()
+                                 self.partition_model.disk_changed(disk_path)
 
                         if fmt:
                             fmt = 'Yes'
@@ -1950,6 +2114,10 @@ class InstallationAdvanced(GtkBaseBox):
             if gdk_window is not None:
                 gdk_window.set_cursor(Gdk.Cursor(cursor_type))
 
+    def release(self):
+        self.partition_model.unwatch()
+        super().release()
+
     def store_values(self):
         """ The user clicks 'Install now!' """
         changelist = self.get_changes()
@@ -2025,6 +2193,12 @@ class InstallationAdvanced(GtkBaseBox):
 
             apartitions = list(partitions) + self.lv_partitions
 
+            format_stage = FormatStage()
+
+            # LUKS devices formatted at the same time share the RAM used by the key derivation function
+            luks_jobs = len([uid for uid in self.stage_opts if self.luks_options.get(uid, (False,))[0]])
+            kdf = luks.KdfOptions.from_config(jobs=min(luks_jobs, format_stage.max_jobs))
+
             # Checks if a boot partition exists
             for allopts in self.stage_opts:
                     if self.stage_opts[allopts][2] == '/boot':
@@ -2094,6 +2268,9 @@ class InstallationAdvanced(GtkBaseBox):
                             if not self.testing:
                                 pm.finalize_changes(partitions[ee].disk)
 
+                    # Steps needed to encrypt, format and/or label this partition (run in order)
+                    steps = []
+
                     if uid in self.luks_options:
                         (use_luks, vol_name, password) = self.luks_options[uid]
                         if use_luks and len(vol_name) > 0 and len(password) > 0:
@@ -2103,20 +2280,13 @@ class InstallationAdvanced(GtkBaseBox):
                             if not self.testing:
                                 # Do real encryption here!
                                 # TODO: Show a progress dialog here as setup_luks is slow
-                                with misc.raised_privileges():
-                                    ap.setup_luks(luks_device=partition_path, luks_name=vol_name,
-                                                  luks_pass=password)
+                                steps.append(partial(ap.setup_luks, luks_device=partition_path, luks_name=vol_name,
+                                                     luks_pass=password, kdf=kdf))
                                 self.settings.set("use_luks", True)
                                 luks_device = "/dev/mapper/" + vol_name
-                                error, msg = fs.create_fs(luks_device, fisy, lbl)
-                                if not error:
-                                    logging.info(msg)
-                                else:
-                                    txt = _("Couldn't format LUKS device '{0}' with label '{1}' as '{2}'")
-                                    txt = txt.format(luks_device, lbl, fisy)
-                                    logging.error(txt)
-                                    logging.error(msg)
-                                    show.error(self.get_toplevel(), txt)
+                                txt = _("Couldn't format LUKS device '{0}' with label '{1}' as '{2}'")
+                                txt = txt.format(luks_device, lbl, fisy)
+                                steps.append(partial(self.create_fs, luks_device, fisy, lbl, txt))
 
                                 # Do not format (already done)
                                 fmt = False
@@ -2132,24 +2302,46 @@ class InstallationAdvanced(GtkBaseBox):
                         # All of fs module takes paths, not partition objs
                         if not self.testing:
                             # Create filesystem using mkfs
-                            error, msg = fs.create_fs(partition_path, fisy, lbl)
-                            if not error:
-                                logging.info(msg)
-                            else:
-                                txt = _("Couldn't format partition '{0}' with label '{1}' as '{2}'")
-                                txt = txt.format(partition_path, lbl, fisy)
-                                logging.error(txt)
-                                logging.error(msg)
-                                show.error(self.get_toplevel(), txt)
+                            txt = _("Couldn't format partition '{0}' with label '{1}' as '{2}'")
+                            txt = txt.format(partition_path, lbl, fisy)
+                            steps.append(partial(self.create_fs, partition_path, fisy, lbl, txt))
                     elif partition_path in self.orig_label_dic:
                         if self.orig_label_dic[partition_path] != lbl:
                             if not self.testing:
-                                try:
-                                    fs.label_fs(fisy, partition_path, lbl)
-                                except Exception as label_error:
-                                    # Catch all exceptions because not being able to label
-                                    # a partition shouldn't be fatal
-                                    logging.error(label_error)
+                                steps.append(partial(self.label_fs, fisy, partition_path, lbl))
+
+                    if steps:
+                        format_stage.add_job(partition_path, *steps)
+
+            # Independent partitions are encrypted and formatted at the same time
+            errors = format_stage.run()
+            for partition_path in sorted(errors):
+                error = errors[partition_path]
+                if isinstance(error, InstallError):
+                    show.error(self.get_toplevel(), error.message)
+                else:
+                    show.error(self.get_toplevel(), str(error))
+
+    @staticmethod
+    def create_fs(device, fs_type, label, error_txt):
+        """ Create filesystem using mkfs (called from a FormatStage job) """
+        error, msg = fs.create_fs(device, fs_type, label)
+        if not error:
+            logging.info(msg)
+        else:
+            logging.error(error_txt)
+            logging.error(msg)
+            raise InstallError(error_txt)
+
+    @staticmethod
+    def label_fs(fs_type, device, label):
+        """ Relabel an existing filesystem (called from a FormatStage job) """
+        try:
+            fs.label_fs(fs_type, device, label)
+        except Exception as label_error:
+            # Catch all exceptions because not being able to label
+            # a partition shouldn't be fatal
+            logging.error(label_error)
 
     def start_installation(self):
         """ Start installation process """
@@ -42,6 +42,8 @@ except NameError as err:
         return message
 
 import misc.misc as misc
+import misc.mount_table as mount_table
+import misc.partition_index as partition_index
 import misc.gtkwidgets as gtkwidgets
 import show_message as show
 import bootinfo
@@ -52,49 +54,62 @@ from gtkbasebox import GtkBaseBox
 MIN_ROOT_SIZE = 6500
 
 
-def get_partition_size_info(partition_path, human=False):
-    """ Gets partition used and available space using df command """
-
-    min_size = "0"
-    part_size = "0"
-
-    already_mounted = False
-
-    with open("/proc/mounts") as mounts:
-        if partition_path in mounts.read():
-            already_mounted = True
-
-    tmp_dir = ""
-
-    try:
-        if not already_mounted:
-            tmp_dir = tempfile.mkdtemp()
-            subprocess.call(["mount", partition_path, tmp_dir])
-        if human:
-            cmd = ['df', '-h', partition_path]
-        else:
-            cmd = ['df', partition_path]
-        df_out = subprocess.check_output(cmd).decode()
-        if not already_mounted:
-            subprocess.call(['umount', '-l', tmp_dir])
-    except subprocess.CalledProcessError as process_error:
-        logging.error(process_error)
-        return
-
-    if os.path.exists(tmp_dir):
-        os.rmdir(tmp_dir)
-
-    if len(df_out) > 0:
-        df_out = df_out.split('\n')
-        df_out = df_out[1].split()
-        if human:
-            part_size = df_out[1]
-            min_size = df_out[2]
-        else:
-            part_size = float(df_out[1])
-            min_size = float(df_out[2])
-
-    return min_size, part_size
+class PartitionSizeInfo(object):
+    """ Gets partition used and total space (in bytes) using statvfs.
+        Partitions already mounted are measured where they are. The others
+        are mounted read only once and kept mounted until release() is called,
+        so changing the selected partition does not trigger a mount cycle """
+
+    def __init__(self):
+        self.probe_mounts = {}
+
+    def get_mount_point(self, partition_path):
+        """ Returns where partition_path is mounted (mounting it if needed) """
+        device = os.path.realpath(partition_path)
+
+        if device in self.probe_mounts:
+            return self.probe_mounts[device]
+
+        mount_point = mount_table.MountTable().get_mounted_devices().get(device)
+        if mount_point:
+            return mount_point
+
+        tmp_dir = tempfile.mkdtemp(prefix="thus-")
+        try:
+            subprocess.check_call(["mount", "-o", "ro", device, tmp_dir])
+        except subprocess.CalledProcessError as process_error:
+            logging.error(process_error)
+            os.rmdir(tmp_dir)
+            return None
+
+        self.probe_mounts[device] = tmp_dir
+        return tmp_dir
+
+    def get_size_info(self, partition_path):
+        """ Returns a (used, total) tuple in bytes or None on error """
+        mount_point = self.get_mount_point(partition_path)
+        if mount_point is None:
+            return None
+
+        try:
+            stat = os.statvfs(mount_point)
+        except OSError as os_error:
+            logging.error(os_error)
+            return None
+
+        total = stat.f_blocks * stat.f_frsize
+        used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+        return used, total
+
+    def release(self):
+        """ Unmounts all partitions mounted by us """
+        for device, tmp_dir in self.probe_mounts.items():
+            try:
+                subprocess.check_call(["umount", "-l", tmp_dir])
+                os.rmdir(tmp_dir)
+            except (subprocess.CalledProcessError, OSError) as err:
+                logging.warning(_("Can't unmount {0} from {1}: {2}").format(device, tmp_dir, err))
+        self.probe_mounts = {}
 
 
 class InstallationAlongside(GtkBaseBox):
@@ -111,19 +126,23 @@ class InstallationAlongside(GtkBaseBox):
         # print(self.oses)
         self.resize_widget = None
 
+        self.size_info = PartitionSizeInfo()
+        self.connect('destroy', self.on_destroy)
+
     @staticmethod
     def get_new_device(device_to_shrink):
         """ Get new device where Thus will install Manjaro
             returns an empty string if no device is available """
-        number = int(device_to_shrink[len("/dev/sdX"):])
-        disk = device_to_shrink[:len("/dev/sdX")]
+        partition = partition_index.get_index().get_partition(device_to_shrink)
+        if partition is None:
+            return None
 
-        new_number = number + 1
-        new_device = disk + str(new_number)
+        new_number = partition.number + 1
+        new_device = partition_index.get_partition_path(partition.disk, new_number)
 
         while misc.partition_exists(new_device):
             new_number += 1
-            new_device = '{0}{1}'.format(disk, new_number)
+            new_device = partition_index.get_partition_path(partition.disk, new_number)
 
         if new_number > 4:
             # No primary partitions left
@@ -143,8 +162,13 @@ class InstallationAlongside(GtkBaseBox):
         txt = txt.format(device_to_shrink, new_device)
         logging.debug(txt)
 
-        (min_size, part_size) = get_partition_size_info(device_to_shrink)
-        max_size = part_size - (MIN_ROOT_SIZE * 1000.0)
+        size_info = self.size_info.get_size_info(device_to_shrink)
+        if size_info is None:
+            logging.error(_("Can't get size information of device {0}").format(device_to_shrink))
+            return
+
+        (min_size, part_size) = size_info
+        max_size = part_size - (MIN_ROOT_SIZE * 1000 * 1000)
         if max_size < 0:
             # Full Manjaro does not fit but maybe base fits... ask user.
             txt = _("Thus recommends at least 6.5GB free to install Manjaro.") + "\n\n"
@@ -268,9 +292,14 @@ class InstallationAlongside(GtkBaseBox):
             logging.warning(_("Can't find any installed OS!"))
 
     def store_values(self):
+        self.size_info.release()
         self.start_installation()
         return True
 
+    def on_destroy(self, widget):
+        """ Do not leave our probe mounts behind """
+        self.size_info.release()
+
     # ######################################################################################################
 
     def start_installation(self):
@@ -28,13 +28,19 @@ import os
 import subprocess
 import logging
 import math
+from functools import partial
+
 import show_message as show
 import parted3.partition_module as pm
 import parted3.fs_module as fs
 import parted3.lvm as lvm
 import parted3.used_space as used_space
+import misc.mount_table as mount_table
 
 from misc.misc import InstallError
+from installation.format_stage import FormatStage
+import installation.format_profile as format_profile
+import installation.luks as luks
 
 '''
 NOTE: Exceptions in this file
@@ -53,6 +59,24 @@ MAX_ROOT_SIZE = 30000
 # KDE needs 4.5 GB for its files. Need to leave extra space also.
 MIN_ROOT_SIZE = 6500
 
+GPT_BIOS_GRUB_PART_SIZE = 2
+
+# GPT partition type GUIDs (sgdisk codes EF02, EF00, 8300, 8302, 8E00 and 8200)
+GPT_TYPES = {
+    'bios': "21686148-6449-6E6F-744E-656564454649",
+    'efi': "C12A7328-F81F-11D2-BA4B-00A0C93EC93B",
+    'linux': "0FC63DAF-8483-4772-8E79-3D69D8477DE4",
+    'home': "933AC7E1-2EB4-4F13-B844-0E14E2AEF915",
+    'lvm': "E6D6D379-F507-44C2-A23C-238F2A3DF928",
+    'swap': "0657FD6D-A4AB-43C4-84E5-0933C84B4F4F"}
+
+# MBR (DOS) partition types
+DOS_TYPES = {
+    'linux': "83",
+    'swap': "82",
+    'lvm': "8e",
+    'extended': "5"}
+
 
 def get_info(part):
     """ Get partition info using blkid """
@@ -83,52 +107,10 @@ def printk(enable):
             fpk.write("0")
 
 
-def unmount(directory):
-    logging.warning(_("Unmounting {0}".format(directory)))
-    try:
-        subprocess.call(["umount", directory])
-    except subprocess.CalledProcessError:
-        logging.warning(_("Unmounting {0} failed. Trying lazy arg.".format(directory)))
-        try:
-            subprocess.call(["umount", "-l", directory])
-        except subprocess.CalledProcessError:
-            logging.warning(_("Unmounting {0} failed.".format(directory)))
-
-
 def unmount_all(dest_dir):
-    """ Unmounts all devices that are mounted inside dest_dir """
-    try:
-        cmd = ["swapon", "--show=NAME", "--noheadings"]
-        swaps = subprocess.check_output(cmd).decode().split("\n")
-        for name in filter(None, swaps):
-            if "/dev/zram" not in name:
-                subprocess.check_call(["swapoff", name])
-    except subprocess.CalledProcessError as err:
-        logging.warning(_("Command {0} failed".format(err.cmd)))
-        logging.warning(_("Output: {0}".format(err.output)))
-
-    try:
-        mount_result = subprocess.check_output("mount").decode().split("\n")
-    except subprocess.CalledProcessError as err:
-        logging.warning(_("Command {0} failed".format(err.cmd)))
-        logging.warning(_("Output: {0}".format(err.output)))
-        return
-
-    # Umount all devices mounted inside dest_dir (if any)
-    dirs = []
-    for mount in mount_result:
-        if dest_dir in mount:
-            directory = mount.split()[0]
-            # Do not unmount dest_dir now (we will do it later)
-            if directory is not dest_dir:
-                dirs.append(directory)
-
-    for directory in dirs:
-        unmount(directory)
-
-    # Now is the time to unmount the device that is mounted in dest_dir (if any)
-    if dest_dir in mount_result:
-        unmount(dest_dir)
+    """ Unmounts all devices that are mounted inside dest_dir (dest_dir last) """
+    mount_table.swapoff_all()
+    mount_table.unmount_tree(dest_dir)
 
 
 def remove_lvm(device):
@@ -179,8 +161,8 @@ def close_luks_devices():
         logging.warning(_("Output: {0}".format(err.output)))
 
 
-def setup_luks(luks_device, luks_name, luks_pass=None, luks_key=None):
-    """ Setups a luks device """
+def setup_luks(luks_device, luks_name, luks_pass=None, luks_key=None, kdf=None):
+    """ Setups a luks device (kdf is a luks.KdfOptions object) """
 
     if (luks_pass is None or luks_pass == "") and luks_key is None:
         txt = _("Can't setup LUKS in device {0}. A password or a key file are needed")
@@ -191,148 +173,65 @@ def setup_luks(luks_device, luks_name, luks_pass=None, luks_key=None):
     # For now, we we'll use the same password for root and /home
     # If instead user wants to use a key file, we'll have two different key files.
 
-    logging.debug(_("Thus will setup LUKS on device {0}".format(luks_device)))
-
-    # Wipe LUKS header (just in case we're installing on a pre LUKS setup)
-    # For 512 bit key length the header is 2MiB
-    # If in doubt, just be generous and overwrite the first 10MiB or so
-    dd("/dev/zero", luks_device, bs=512, count=20480)
-
-    if luks_pass is None or luks_pass == "":
-        # No key password given, let's create a random keyfile
-        dd("/dev/urandom", luks_key, bs=1024, count=4)
-
-        # Set up luks with a keyfile
-        try:
-            cmd = ["cryptsetup", "luksFormat", "-q", "-c", "aes-xts-plain", "-s", "512", luks_device, luks_key]
-            subprocess.check_call(cmd)
-            cmd = ["cryptsetup", "luksOpen", luks_device, luks_name, "-q", "--key-file", luks_key]
-            subprocess.check_call(cmd)
-        except subprocess.CalledProcessError as err:
-            txt = _("Can't format and open the LUKS device {0}").format(luks_device)
-            logging.error(txt)
-            logging.error(_("Command {0} failed".format(err.cmd)))
-            logging.error(_("Output: {0}".format(err.output)))
-            raise InstallError(txt)
-
-    else:
-        # Set up luks with a password key
-
-        luks_pass_bytes = bytes(luks_pass, 'UTF-8')
-
-        # https://code.google.com/p/cryptsetup/wiki/Cryptsetup160
-        # aes-xts-plain
-        # aes-cbc-essiv:sha256
-        try:
-            cmd = ["cryptsetup", "luksFormat", "-q", "-c", "aes-xts-plain64", "-s", "512", "--key-file=-", luks_device]
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
-            proc.communicate(input=luks_pass_bytes)
-
-            cmd = ["cryptsetup", "luksOpen", luks_device, luks_name, "-q", "--key-file=-"]
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
-            proc.communicate(input=luks_pass_bytes)
-        except subprocess.CalledProcessError as err:
-            txt = _("Can't format and open the LUKS device {0}").format(luks_device)
-            logging.error(txt)
-            logging.error(_("Command {0} failed".format(err.cmd)))
-            logging.error(_("Output: {0}".format(err.output)))
-            raise InstallError(txt)
-
-
-def wipefs(device):
-    try:
-        subprocess.check_call(["wipefs", "-a", device])
-    except subprocess.CalledProcessError as err:
-        logging.warning(_("Can't wipe filesystem of device {0}".format(device)))
-        logging.warning(_("Command {0} failed".format(err.cmd)))
-        logging.warning(_("Output: {0}".format(err.output)))
-
-
-def dd(input_device, output_device, bs=512, count=2048):
-    """ Helper function to call dd """
-    cmd = ['dd', 'if={0}'.format(input_device), 'of={0}'.format(output_device), 'bs={0}'.format(bs),
-           'count={0}'.format(count), 'status=noxfer']
-    try:
-        subprocess.check_call(cmd)
-    except subprocess.CalledProcessError as err:
-        logging.warning(_("Can't run dd command"))
-        logging.warning(_("Command {0} failed".format(err.cmd)))
-        logging.warning(_("Output: {0}".format(err.output)))
-
-
-def sgdisk(command, device):
-    """ Helper function to call sgdisk (GPT) """
-    cmd = ['sgdisk', "--{0}".format(command), device]
-    subprocess.check_call(cmd)
-
-
-def sgdisk_new(device, part_num, label, size, hex_code):
-    """ Helper function to call sgdisk --new (GPT) """
-    cmd = ['sgdisk', '--new={0}:0:+{1}M'.format(part_num, size), '--typecode={0}:{1}'.format(part_num, hex_code),
-           '--change-name={0}:{1}'.format(part_num, label), device]
-    # --new: Create a new partition, numbered partnum, starting at sector start and ending at sector end.
-    # Parameters: partnum:start:end (zero in start or end means using default value)
-    # --typecode: Change a partition's GUID type code to the one specified by hexcode.
-    #             Note that hexcode is a gdisk/sgdisk internal two-byte hexadecimal code.
-    #             You can obtain a list of codes with the -L option.
-    # Parameters: partnum:hexcode
-    # --change-name: Change the name of the specified partition.
-    # Parameters: partnum:name
-    logging.debug(" ".join(cmd))
-
-    try:
-        subprocess.check_call(cmd)
-    except subprocess.CalledProcessError as err:
-        txt = _("Error creating a new partition on device {0}").format(device)
-        logging.error(txt)
-        logging.error(_("Command {0} failed".format(err.cmd)))
-        logging.error(_("Output: {0}".format(err.output)))
-        raise InstallError(txt)
-
-
-def parted_set(device, number, flag, state):
-    """ Helper function to call set parted command """
-    cmd = ['parted', '--align', 'optimal', '--script', device, 'set', number, flag, state]
-    subprocess.check_call(cmd)
-
-
-def parted_mkpart(device, ptype, start, end, filesystem=""):
-    """ Helper function to call mkpart parted command """
-    # If start is < 0 we assume we want to mkpart at the start of the disk
-    if start < 0:
-        start_str = "1"
-    else:
-        start_str = "{0}MiB".format(start)
-
-    # -1s means "end of disk"
-    if end == "-1s":
-        end_str = end
-    else:
-        end_str = "{0}MiB".format(end)
-
-    cmd = ['parted', '--align', 'optimal', '--script', device, "--", 'mkpart', ptype, filesystem, start_str, end_str]
-
-    try:
-        subprocess.check_call(cmd)
-    except subprocess.CalledProcessError as err:
-        txt = _("Error creating a new partition on device {0}").format(device)
+    if kdf is None:
+        kdf = luks.KdfOptions.from_config()
+
+    luks.setup(luks_device, luks_name, password=luks_pass, key_file=luks_key, kdf=kdf)
+
+
+def get_partition_path(device, number):
+    """ /dev/sda, 1 -> /dev/sda1 and /dev/nvme0n1, 1 -> /dev/nvme0n1p1 """
+    if device[-1].isdigit():
+        return "{0}p{1}".format(device, number)
+    return "{0}{1}".format(device, number)
+
+
+def sfdisk_script(device, plan):
+    """ Compiles a partition plan (see AutoPartition.get_partition_plan) into a sfdisk script """
+    lines = ["label: {0}".format(plan['label']), ""]
+    for partition in plan['partitions']:
+        fields = []
+        if partition['size'] > 0:
+            fields.append("size={0}MiB".format(partition['size']))
+        fields.append("type={0}".format(partition['type']))
+        if plan['label'] == "gpt":
+            fields.append('name="{0}"'.format(partition['name']))
+        elif partition.get('bootable', False):
+            fields.append("bootable")
+        line = ", ".join(fields)
+        if 'number' in partition:
+            # sfdisk takes the partition number from the name
+            line = "{0} : {1}".format(get_partition_path(device, partition['number']), line)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def apply_partition_plan(device, plan, dry_run=False):
+    """ Writes the whole partition table of device in one sfdisk transaction.
+        Old signatures (filesystems, raid, partition tables...) are wiped by sfdisk itself.
+        In dry run mode device can be a (sparse) image file, the kernel is not told about it. """
+    script = sfdisk_script(device, plan)
+    logging.debug(_("sfdisk script for device {0}:\n{1}").format(device, script))
+
+    cmd = ["sfdisk", "--wipe", "always", "--wipe-partitions", "always"]
+    if dry_run:
+        cmd.extend(["--no-reread", "--no-tell-kernel"])
+    cmd.append(device)
+
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate(input=script.encode())[0].decode()
+    if proc.returncode != 0:
+        txt = _("Error creating a new partition table on device {0}").format(device)
         logging.error(txt)
-        logging.error(_("Command {0} failed".format(err.cmd)))
-        logging.error(_("Output: {0}".format(err.output)))
+        logging.error(_("Command {0} failed".format(cmd)))
+        logging.error(_("Output: {0}".format(output)))
         raise InstallError(txt)
 
+    logging.debug(output)
 
-def parted_mktable(device, table_type="msdos"):
-    """ Helper function to call mktable parted command """
-    cmd = ["parted", "--align", "optimal", "--script", device, "mktable", table_type]
-    try:
-        subprocess.check_call(cmd)
-    except subprocess.CalledProcessError as err:
-        txt = _("Error creating a new partition table on device {0}").format(device)
-        logging.error(txt)
-        logging.error(_("Command {0} failed".format(err.cmd)))
-        logging.error(_("Output: {0}".format(err.output)))
-        raise InstallError(txt)
+    if not dry_run:
+        # Wait until /dev initialized correct devices
+        subprocess.check_call(["udevadm", "settle"])
 
 
 ''' AutoPartition Class '''
@@ -366,7 +265,14 @@ class AutoPartition(object):
             self.GPT = False
 
     def mkfs(self, device, fs_type, mount_point, label_name, fs_options="", btrfs_devices=""):
-        """ We have two main cases: "swap" and everything else. """
+        """ Formats and mounts device """
+        self.format_device(device, fs_type, label_name, fs_options, btrfs_devices)
+        self.mount_device(device, fs_type, mount_point)
+
+    @staticmethod
+    def format_device(device, fs_type, label_name, fs_options="", btrfs_devices=""):
+        """ We have two main cases: "swap" and everything else.
+            Filesystem buffers are not flushed here (see FormatStage) """
         logging.debug(_("Will format device {0} as {1}".format(device, fs_type)))
         if fs_type == "swap":
             try:
@@ -380,6 +286,13 @@ class AutoPartition(object):
                 logging.warning(_("Command {0} failed".format(err.cmd)))
                 logging.warning(_("Output: {0}".format(err.output)))
         else:
+            # Add the options that suit this device (SSD, thin LUN, hard drive...)
+            profile = format_profile.get_profile(device)
+            logging.debug(_("Format profile of {0}: {1}").format(device, profile))
+            profile_options = profile.get_mkfs_options(fs_type)
+            if profile_options:
+                fs_options = "{0} {1}".format(profile_options, fs_options).strip()
+
             mkfs = {"xfs": "mkfs.xfs {0} -L {1} -f {2}".format(fs_options, label_name, device),
                     "jfs": "yes | mkfs.jfs {0} -L {1} {2}".format(fs_options, label_name, device),
                     "reiserfs": "yes | mkreiserfs {0} -l {1} {2}".format(fs_options, label_name, device),
@@ -408,13 +321,9 @@ class AutoPartition(object):
                 logging.error(_("Output: {0}".format(err.output)))
                 raise InstallError(txt)
 
-            # Flush filesystem buffers
-            try:
-                subprocess.check_call(["sync"])
-            except subprocess.CalledProcessError as err:
-                logging.warning(_("Command {0} failed".format(err.cmd)))
-                logging.warning(_("Output: {0}".format(err.output)))
-
+    def mount_device(self, device, fs_type, mount_point):
+        """ Mounts an already formatted device in its mount point (swap is already active) """
+        if fs_type != "swap":
             # Create our mount directory
             path = self.dest_dir + mount_point
             if not os.path.exists(path):
@@ -449,6 +358,23 @@ class AutoPartition(object):
         fs_label = get_info(device)['LABEL']
         logging.debug(_("Device details: {0} UUID={1} LABEL={2}".format(device, fs_uuid, fs_label)))
 
+    def format_and_mount(self, formats):
+        """ Formats all devices in parallel and then mounts them.
+            formats is a list of (device, fs_type, mount_point, label_name, fs_options) tuples.
+            Make sure the root partition is listed first, as mounts are done in list order. """
+        stage = FormatStage()
+        for (device, fs_type, mount_point, label_name, fs_options) in formats:
+            stage.add_job(device, partial(self.format_device, device, fs_type, label_name, fs_options))
+
+        errors = stage.run()
+        if errors:
+            for device, fs_type, mount_point, label_name, fs_options in formats:
+                if device in errors:
+                    raise errors[device]
+
+        for (device, fs_type, mount_point, label_name, fs_options) in formats:
+            self.mount_device(device, fs_type, mount_point)
+
     @property
     def get_devices(self):
         """ Set (and return) all partitions on the device """
@@ -644,6 +570,72 @@ class AutoPartition(object):
         if self.home:
             logging.debug(_("Home partition size: %dMiB"), part_sizes['home'])
 
+    def get_partition_plan(self, part_sizes):
+        """ Returns the complete partition layout of our device.
+            Partitions are listed in the order they have to be created (so their
+            numbers match get_devices). Sizes are in MiB, 0 means use all free space left.
+            DOS partitions have explicit numbers (logical ones start at 5). """
+
+        # WARNING:
+        # Our computed sizes are all in mebibytes (MiB) i.e. powers of 1024, not metric megabytes.
+        # These are 'MiB' in sfdisk.
+
+        partitions = []
+
+        if self.GPT:
+            if not self.UEFI:
+                # We don't allow BIOS+GPT right now, so this code will be never executed
+                # We leave here just for future reference
+                # Create BIOS Boot Partition
+                # This partition is not required if the system is UEFI based,
+                # as there is no such embedding of the second-stage code in that case
+                partitions.append({'name': "BIOS_BOOT", 'size': GPT_BIOS_GRUB_PART_SIZE, 'type': GPT_TYPES['bios']})
+
+            # Create EFI System Partition (ESP)
+            if self.bootloader == "grub2":
+                partitions.append({'name': "UEFI_SYSTEM", 'size': part_sizes['efi'], 'type': GPT_TYPES['efi']})
+
+            # Create Boot partition
+            if self.bootloader == "systemd-boot":
+                boot_type = GPT_TYPES['efi']
+            else:
+                boot_type = GPT_TYPES['linux']
+            partitions.append({'name': "MANJARO_BOOT", 'size': part_sizes['boot'], 'type': boot_type})
+
+            if self.lvm:
+                # Create partition for lvm (will store root, swap and home (if desired) logical volumes)
+                partitions.append({'name': "MANJARO_LVM", 'size': 0, 'type': GPT_TYPES['lvm']})
+            else:
+                partitions.append({'name': "MANJARO_ROOT", 'size': part_sizes['root'], 'type': GPT_TYPES['linux']})
+                if self.home:
+                    partitions.append({'name': "MANJARO_HOME", 'size': part_sizes['home'], 'type': GPT_TYPES['home']})
+                partitions.append({'name': "MANJARO_SWAP", 'size': 0, 'type': GPT_TYPES['swap']})
+
+            return {'label': "gpt", 'partitions': partitions}
+
+        # DOS MBR partition table (first partition starts at 1MiB for 4k drive compatibility)
+
+        # Create boot partition (bootable)
+        partitions.append({'name': "boot", 'number': 1, 'size': part_sizes['boot'], 'type': DOS_TYPES['linux'],
+                           'bootable': True})
+
+        if self.lvm:
+            # Create partition for lvm (will store root, swap and home (if desired) logical volumes)
+            partitions.append({'name': "lvm", 'number': 2, 'size': 0, 'type': DOS_TYPES['lvm']})
+        else:
+            partitions.append({'name': "root", 'number': 2, 'size': part_sizes['root'], 'type': DOS_TYPES['linux']})
+            if self.home:
+                partitions.append({'name': "home", 'number': 3, 'size': part_sizes['home'],
+                                   'type': DOS_TYPES['linux']})
+
+            # Create an extended partition where we will put our (logical) swap partition
+            # (get_devices expects swap to be the first logical partition, number 5)
+            partitions.append({'name': "extended", 'number': len(partitions) + 1, 'size': 0,
+                               'type': DOS_TYPES['extended']})
+            partitions.append({'name': "swap", 'number': 5, 'size': 0, 'type': DOS_TYPES['swap']})
+
+        return {'label': "dos", 'partitions': partitions}
+
     def run(self):
         key_files = ["/tmp/.keyfile-root", "/tmp/.keyfile-home"]
 
@@ -679,6 +671,8 @@ class AutoPartition(object):
         part_sizes = self.get_part_sizes(disk_size, start_part_sizes)
         self.log_part_sizes(part_sizes)
 
+        plan = self.get_partition_plan(part_sizes)
+
         # Disable swap and all mounted partitions, umount / last!
         unmount_all(self.dest_dir)
         remove_lvm(device)
@@ -686,120 +680,11 @@ class AutoPartition(object):
 
         printk(False)
 
-        # WARNING:
-        # Our computed sizes are all in mebibytes (MiB) i.e. powers of 1024, not metric megabytes.
-        # These are 'M' in sgdisk and 'MiB' in parted.
-        # If you use 'M' in parted you'll get MB instead of MiB, and you're gonna have a bad time.
-
-        if self.GPT:
-            # Clean partition table to avoid issues!
-            sgdisk("zap-all", device)
-
-            # Clear all magic strings/signatures - mdadm, lvm, partition tables etc.
-            dd("/dev/zero", device, bs=512, count=2048)
-            wipefs(device)
-
-            # Create fresh GPT
-            sgdisk("clear", device)
-
-            # Inform the kernel of the partition change. Needed if the hard disk had a MBR partition table.
-            try:
-                subprocess.check_call(["partprobe", device])
-            except subprocess.CalledProcessError as err:
-                txt = _("Error informing the kernel of the partition change.")
-                logging.error(txt)
-                logging.error(_("Command {0} failed".format(err.cmd)))
-                logging.error(_("Output: {0}".format(err.output)))
-                raise InstallError(txt)
-
-            part_num = 1
-
-            if not self.UEFI:
-                # We don't allow BIOS+GPT right now, so this code will be never executed
-                # We leave here just for future reference
-                # Create BIOS Boot Partition
-                # GPT GUID: 21686148-6449-6E6F-744E-656564454649
-                # This partition is not required if the system is UEFI based,
-                # as there is no such embedding of the second-stage code in that case
-                sgdisk_new(device, part_num, "BIOS_BOOT", gpt_bios_grub_part_size, "EF02")
-                part_num += 1
-
-            # Create EFI System Partition (ESP)
-            # GPT GUID: C12A7328-F81F-11D2-BA4B-00A0C93EC93B
-            if self.bootloader == "grub2":
-                sgdisk_new(device, part_num, "UEFI_SYSTEM", part_sizes['efi'], "EF00")
-                part_num += 1
-
-            # Create Boot partition
-            if self.bootloader == "systemd-boot":
-                sgdisk_new(device, part_num, "MANJARO_BOOT", part_sizes['boot'], "EF00")
-            else:
-                sgdisk_new(device, part_num, "MANJARO_BOOT", part_sizes['boot'], "8300")
-            part_num += 1
-
-            if self.lvm:
-                # Create partition for lvm (will store root, swap and home (if desired) logical volumes)
-                sgdisk_new(device, part_num, "MANJARO_LVM", 0, "8E00")
-            else:
-                sgdisk_new(device, part_num, "MANJARO_ROOT", part_sizes['root'], "8300")
-                part_num += 1
-                if self.home:
-                    sgdisk_new(device, part_num, "MANJARO_HOME", part_sizes['home'], "8302")
-                    part_num += 1
-                sgdisk_new(device, part_num, "MANJARO_SWAP", 0, "8200")
-
-            logging.debug(check_output("sgdisk --print {0}".format(device)))
-        else:
-            # DOS MBR partition table
-            # Start at sector 1 for 4k drive compatibility and correct alignment
-            # Clean partitiontable to avoid issues!
-            dd("/dev/zero", device, bs=512, count=2048)
-            wipefs(device)
-
-            # Create DOS MBR
-            parted_mktable(device, "msdos")
-
-            # Create boot partition (all sizes are in MiB)
-            # if start is -1 parted_mkpart assumes that our partition starts at 1 (first partition in disk)
-            start = -1
-            end = part_sizes['boot']
-            parted_mkpart(device, "primary", start, end)
-
-            # Set boot partition as bootable
-            parted_set(device, "1", "boot", "on")
-
-            if self.lvm:
-                # Create partition for lvm (will store root, swap and home (if desired) logical volumes)
-                start = end
-                parted_mkpart(device, "primary", start, "-1s")
-
-                # Set lvm flag
-                parted_set(device, "2", "lvm", "on")
-            else:
-                # Create root partition
-                start = end
-                end = start + part_sizes['root']
-                parted_mkpart(device, "primary", start, end)
-
-                if self.home:
-                    # Create home partition
-                    start = end
-                    end = start + part_sizes['home']
-                    parted_mkpart(device, "primary", start, end)
-
-                # Create an extended partition where we will put our swap partition
-                start = end
-                parted_mkpart(device, "extended", start, "-1s")
-
-                # Now create a logical swap partition
-                start += 1
-                parted_mkpart(device, "logical", start, "-1s", "linux-swap")
+        # All partitions are created at once (only one partition table write and udev settle)
+        apply_partition_plan(device, plan)
 
         printk(True)
 
-        # Wait until /dev initialized correct devices
-        subprocess.check_call(["udevadm", "settle"])
-
         devices = self.get_devices
 
         if self.GPT and self.bootloader == "grub2":
@@ -813,9 +698,21 @@ class AutoPartition(object):
             logging.debug("Home: {0}".format(devices['home']))
 
         if self.luks:
-            setup_luks(devices['luks'], "cryptManjaro", self.luks_password, key_files[0])
+            # Root and home LUKS devices are formatted at the same time
+            luks_devices = [(devices['luks'], "cryptManjaro", key_files[0])]
             if self.home and not self.lvm:
-                setup_luks(devices['luks2'], "cryptManjaroHome", self.luks_password, key_files[1])
+                luks_devices.append((devices['luks2'], "cryptManjaroHome", key_files[1]))
+
+            kdf = luks.KdfOptions.from_config(jobs=len(luks_devices))
+            stage = FormatStage()
+            for (luks_device, luks_name, key_file) in luks_devices:
+                stage.add_job(luks_device, partial(setup_luks, luks_device, luks_name,
+                                                   self.luks_password, key_file, kdf))
+
+            errors = stage.run()
+            for (luks_device, luks_name, key_file) in luks_devices:
+                if luks_device in errors:
+                    raise errors[luks_device]
 
         if self.lvm:
             logging.debug(_("Thus will setup LVM on device {0}".format(devices['lvm'])))
@@ -891,22 +788,28 @@ class AutoPartition(object):
 
         fs_devices = self.get_fs_devices()
 
-        # Note: Make sure the "root" partition is defined first!
-        self.mkfs(devices['root'], fs_devices[devices['root']], mount_points['root'], labels['root'])
-        self.mkfs(devices['swap'], fs_devices[devices['swap']], mount_points['swap'], labels['swap'])
+        fs_options = {'root': "", 'swap': "", 'boot': "", 'efi': "-F 32", 'home': ""}
 
         if self.GPT and self.bootloader == "systemd-boot":
             # Format EFI System Partition (ESP) with vfat (fat32)
-            self.mkfs(devices['boot'], fs_devices[devices['boot']], mount_points['boot'], labels['boot'], "-F 32")
-        else:
-            self.mkfs(devices['boot'], fs_devices[devices['boot']], mount_points['boot'], labels['boot'])
+            fs_options['boot'] = "-F 32"
+
+        # Note: Make sure the "root" partition is defined first!
+        parts = ['root', 'swap', 'boot']
 
         if self.GPT and self.bootloader == "grub2":
-            # Format EFI System Partition (ESP) with vfat (fat32)
-            self.mkfs(devices['efi'], fs_devices[devices['efi']], mount_points['efi'], labels['efi'], "-F 32")
+            parts.append('efi')
 
         if self.home:
-            self.mkfs(devices['home'], fs_devices[devices['home']], mount_points['home'], labels['home'])
+            parts.append('home')
+
+        formats = []
+        for part in parts:
+            device = devices[part]
+            formats.append((device, fs_devices[device], mount_points[part], labels[part], fs_options[part]))
+
+        # All filesystems are created at the same time, then mounted
+        self.format_and_mount(formats)
 
         # NOTE: encrypted and/or lvm2 hooks will be added to mkinitcpio.conf in process.py if necessary
         # NOTE: /etc/default/grub, /etc/stab and /etc/crypttab will be modified in process.py, too.
@@ -936,6 +839,7 @@ class AutoPartition(object):
 
 if __name__ == '__main__':
     import gettext
+    import tempfile
 
     _ = gettext.gettext
 
@@ -948,5 +852,36 @@ if __name__ == '__main__':
         luks_password="luks",
         use_lvm=True,
         use_home=True,
+        bootloader="grub2",
+        callback_queue=None)
+
+    def dry_run(auto_partition, image_size=16 * 1024):
+        """ Writes our partition plan to a sparse image file instead of a real device.
+            Returns the sfdisk dump of the image and its name """
+        with tempfile.NamedTemporaryFile(suffix=".img") as image:
+            image.truncate(image_size * 1024 * 1024)
+            part_sizes = auto_partition.get_part_sizes(image_size - 1, 1)
+            auto_partition.log_part_sizes(part_sizes)
+            apply_partition_plan(image.name, auto_partition.get_partition_plan(part_sizes), dry_run=True)
+            return check_output("sfdisk --dump {0}".format(image.name)), image.name
+
+    print(dry_run(auto)[0])
+
+    # DOS layout without home: swap has to be the first logical partition (see get_devices)
+    auto = AutoPartition(
+        dest_dir="/install",
+        auto_device="/dev/sdb",
+        use_luks=False,
+        luks_password="",
+        use_lvm=False,
+        use_home=False,
+        bootloader="grub2",
         callback_queue=None)
-    auto.run()
+    auto.UEFI = False
+    auto.GPT = False
+    dump, image_name = dry_run(auto)
+    print(dump)
+    swap_type = "type={0}".format(DOS_TYPES['swap'])
+    swap_lines = [line for line in dump.splitlines() if swap_type in line]
+    swap_path = get_partition_path(image_name, 5)
+    assert len(swap_lines) == 1 and swap_lines[0].split(":")[0].strip() == swap_path, swap_lines
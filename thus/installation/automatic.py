@@ -37,6 +37,7 @@ if __name__ == '__main__':
     sys.path.insert(0, parent_dir)
 
 import misc.misc as misc
+import misc.hotplug as hotplug
 import parted3.fs_module as fs
 from installation import process as installation_process
 
@@ -71,6 +72,11 @@ class InstallationAutomatic(GtkBaseBox):
         self.bootloader_devices = {}
         self.bootloader_device = {}
 
+        monitor = hotplug.get_monitor()
+        self.monitor_handlers = [
+            monitor.connect('disk-added', self.on_disks_changed),
+            monitor.connect('disk-removed', self.on_disks_changed)]
+
     def translate_ui(self):
         txt = _("Automatic installation mode")
         txt = "<span weight='bold' size='large'>{0}</span>".format(txt)
@@ -153,6 +159,18 @@ class InstallationAutomatic(GtkBaseBox):
         self.select_first_combobox_item(self.device_store)
         self.select_first_combobox_item(self.bootloader_device_entry)
 
+    def on_disks_changed(self, monitor, disk_path):
+        """ A disk has been plugged in or removed. Update the list if we're being shown """
+        if self.get_parent() is not None:
+            self.populate_devices()
+
+    def release(self):
+        monitor = hotplug.get_monitor()
+        for handler in self.monitor_handlers:
+            monitor.disconnect(handler)
+        self.monitor_handlers = []
+        super().release()
+
     @staticmethod
     def select_first_combobox_item(combobox):
         tree_model = combobox.get_model()
@@ -30,6 +30,8 @@ import logging
 import os
 import subprocess
 
+import misc.mount_table as mount_table
+
 # When testing, no _() is available
 try:
     _("")
@@ -39,6 +41,10 @@ except NameError as err:
 
 _special_dirs_mounted = False
 
+# Only the last lines of a command output are logged (pacman, mkinitcpio...
+# can write thousands of lines)
+MAX_LOGGED_LINES = 100
+
 
 def get_special_dirs():
     """ Get special dirs to be mounted or unmounted """
@@ -97,19 +103,10 @@ def umount_special_dirs(dest_dir):
     special_dirs = []
     special_dirs = get_special_dirs()
 
-    for special_dir in reversed(special_dirs):
-        mountpoint = os.path.join(dest_dir, special_dir[1:])
-        logging.debug("Unmounting special dir '{0}'".format(mountpoint))
-        try:
-            subprocess.check_call(["umount", mountpoint])
-        except subprocess.CalledProcessError:
-            logging.debug("Can't unmount. Trying -l to force it.")
-            try:
-                subprocess.check_call(["umount", "-l", mountpoint])
-            except subprocess.CalledProcessError as process_error:
-                txt = "Unable to unmount {0}, command {1} failed: {2}".format(
-                    mountpoint, process_error.cmd, process_error.output)
-                logging.warning(txt)
+    # Deepest first (efivars before /sys, /dev/pts before /dev)
+    mountpoints = [os.path.join(dest_dir, special_dir[1:]) for special_dir in reversed(special_dirs)]
+    logging.debug("Unmounting special dirs {0}".format(mountpoints))
+    mount_table.unmount_trees(mountpoints)
 
     _special_dirs_mounted = False
 
@@ -128,9 +125,13 @@ def run(cmd, dest_dir, timeout=None, stdin=None):
                                 stdout=subprocess.PIPE,
                                 stderr=subprocess.STDOUT)
         outs, errs = proc.communicate(timeout=timeout)
-        txt = outs.decode().strip()
-        if len(txt) > 0:
-            logging.debug(txt)
+        txt = outs.decode(errors='replace').strip()
+        if len(txt) > 0 and logging.getLogger().isEnabledFor(logging.DEBUG):
+            lines = txt.split("\n")
+            if len(lines) > MAX_LOGGED_LINES:
+                skipped = len(lines) - MAX_LOGGED_LINES
+                lines = ["({0} lines skipped)".format(skipped)] + lines[-MAX_LOGGED_LINES:]
+            logging.debug("\n".join(lines))
     except subprocess.TimeoutExpired as timeout_error:
         if proc:
             proc.kill()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  format_profile.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Chooses mkfs and mount options from the properties of the target device """
+
+import os
+import logging
+
+# Rotational devices this big (in bytes) use the "large-hdd" profile
+LARGE_HDD_SIZE = 1024 ** 4
+
+# Bytes per inode in ext filesystems created in large hard drives
+# (mke2fs uses 16384 by default, which means a lot of inode tables to write)
+LARGE_HDD_INODE_RATIO = 65536
+
+# ext block size assumed when computing stride and stripe width
+EXT_BLOCK_SIZE = 4096
+
+
+def read_sysfs_value(path, default=0):
+    """ Reads an integer value from sysfs """
+    try:
+        with open(path) as sysfs_file:
+            return int(sysfs_file.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def get_sysfs_path(device):
+    """ Returns the sysfs directory of a block device (partitions included).
+        Device mapper devices (LUKS, LVM) are resolved to their dm-N node """
+    name = os.path.basename(os.path.realpath(device))
+    path = os.path.join("/sys/class/block", name)
+    if os.path.exists(path):
+        return os.path.realpath(path)
+    return None
+
+
+def get_queue_path(sysfs_path):
+    """ Partitions do not have a queue directory, their parent disk has it """
+    for path in [sysfs_path, os.path.dirname(sysfs_path)]:
+        queue_path = os.path.join(path, "queue")
+        if os.path.isdir(queue_path):
+            return queue_path
+    return None
+
+
+class FormatProfile(object):
+    """ Properties of a block device that change how it should be formatted.
+
+        name is one of "ssd" (SSD, NVMe, MMC), "thin" (a rotational device
+        that accepts discards, usually a thin-provisioned LUN or a virtual disk),
+        "hdd" and "large-hdd" (a hard drive bigger than LARGE_HDD_SIZE). """
+
+    def __init__(self, rotational=True, discard=False, size=0, min_io=0, optimal_io=0):
+        self.rotational = rotational
+        self.discard = discard
+        self.size = size
+        self.min_io = min_io
+        self.optimal_io = optimal_io
+
+        if not rotational:
+            self.name = "ssd"
+        elif discard:
+            self.name = "thin"
+        elif size >= LARGE_HDD_SIZE:
+            self.name = "large-hdd"
+        else:
+            self.name = "hdd"
+
+    def get_ext_extended_options(self, journal=True):
+        """ Returns the -E options for mke2fs """
+        # Inode tables (and journal) will be initialized by the kernel in the background
+        options = ["lazy_itable_init=1"]
+        if journal:
+            options.append("lazy_journal_init=1")
+
+        if not self.discard:
+            # Do not even try to discard blocks
+            options.append("nodiscard")
+
+        # RAID and some SAN devices report their chunk and stripe sizes
+        if self.min_io > EXT_BLOCK_SIZE and self.min_io % EXT_BLOCK_SIZE == 0:
+            stride = self.min_io // EXT_BLOCK_SIZE
+            options.append("stride={0}".format(stride))
+            if self.optimal_io > self.min_io and self.optimal_io % self.min_io == 0:
+                options.append("stripe_width={0}".format(self.optimal_io // EXT_BLOCK_SIZE))
+
+        return "-E " + ",".join(options)
+
+    def get_mkfs_options(self, fs_type):
+        """ Returns the extra options (a string) to pass to mkfs when formatting
+            a device with this profile as fs_type """
+        options = []
+        if fs_type in ["ext3", "ext4"]:
+            options.append(self.get_ext_extended_options())
+            if self.name == "large-hdd":
+                options.append("-i {0}".format(LARGE_HDD_INODE_RATIO))
+        elif fs_type == "ext2":
+            options.append(self.get_ext_extended_options(journal=False))
+        elif fs_type == "xfs":
+            # mkfs.xfs reads the stripe geometry from the device by itself
+            if not self.discard:
+                options.append("-K")
+        elif fs_type == "btrfs":
+            if not self.discard:
+                options.append("--nodiscard")
+        elif fs_type == "f2fs":
+            if not self.discard:
+                options.append("-t 0")
+        return " ".join(options)
+
+    def __str__(self):
+        return "{0} (rotational={1}, discard={2}, size={3}, min_io={4}, optimal_io={5})".format(
+            self.name, self.rotational, self.discard, self.size, self.min_io, self.optimal_io)
+
+
+def get_profile(device):
+    """ Reads the device properties from sysfs and returns its format profile """
+    sysfs_path = get_sysfs_path(device)
+    if sysfs_path is None:
+        logging.warning(_("Can't find {0} in sysfs, using the default format profile").format(device))
+        return FormatProfile()
+
+    queue_path = get_queue_path(sysfs_path)
+    if queue_path is None:
+        logging.warning(_("Can't read queue properties of {0}").format(device))
+        return FormatProfile(size=read_sysfs_value(os.path.join(sysfs_path, "size")) * 512)
+
+    return FormatProfile(
+        rotational=read_sysfs_value(os.path.join(queue_path, "rotational"), 1) == 1,
+        discard=read_sysfs_value(os.path.join(queue_path, "discard_max_bytes")) > 0,
+        size=read_sysfs_value(os.path.join(sysfs_path, "size")) * 512,
+        min_io=read_sysfs_value(os.path.join(queue_path, "minimum_io_size")),
+        optimal_io=read_sysfs_value(os.path.join(queue_path, "optimal_io_size")))
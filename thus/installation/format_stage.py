@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  format_stage.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Runs the formatting of independent block devices concurrently """
+
+import os
+import logging
+import threading
+
+import misc.misc as misc
+
+# Do not run more mkfs at once than this
+MAX_FORMAT_JOBS = 4
+
+
+class FormatStage(object):
+    """ Collects format jobs and runs them in parallel.
+
+        A job is a list of steps (callables) that will be run in order, one after
+        the other (setup LUKS, then create the filesystem on the mapped device,
+        for instance). Jobs must not share block devices, as they run concurrently.
+        Filesystem buffers are flushed just once, when all jobs have finished. """
+
+    def __init__(self, max_jobs=MAX_FORMAT_JOBS):
+        self.max_jobs = max_jobs
+        self.jobs = []
+        self.errors = {}
+        self.errors_lock = threading.Lock()
+
+    def add_job(self, name, *steps):
+        """ Adds a new job. name is used when logging (usually the device path) """
+        self.jobs.append((name, steps))
+
+    def run_job(self, name, steps, semaphore):
+        """ Runs all steps of a job (in a worker thread) """
+        with semaphore:
+            try:
+                for step in steps:
+                    step()
+            except Exception as err:
+                logging.error(_("Can't format {0}: {1}").format(name, err))
+                with self.errors_lock:
+                    self.errors[name] = err
+
+    def run(self):
+        """ Runs all jobs and waits for them. Returns a dict with the exception
+            raised by each failed job (an empty dict means everything went fine) """
+        self.errors = {}
+        semaphore = threading.BoundedSemaphore(max(1, self.max_jobs))
+        threads = []
+
+        # Raise privileges once for all workers (raise_privileges keeps a
+        # process wide counter, so workers won't drop them while others run)
+        with misc.raised_privileges():
+            for name, steps in self.jobs:
+                logging.debug(_("Formatting {0}...").format(name))
+                thread = threading.Thread(target=self.run_job, args=(name, steps, semaphore))
+                thread.start()
+                threads.append(thread)
+
+            for thread in threads:
+                thread.join()
+
+            # Flush filesystem buffers (just once)
+            os.sync()
+
+        self.jobs = []
+        return self.errors
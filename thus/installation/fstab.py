@@ -19,7 +19,8 @@
 #   along with Calamares. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import re
+
+import installation.format_profile as format_profile
 
 
 HEADER = """# /etc/fstab: static file system information.
@@ -38,32 +39,6 @@ FS_MAP = {
 }
 
 
-def is_ssd_disk(disk_name):
-    """ Checks if given disk is actually a ssd disk.
-
-    :param disk_name:
-    :return:
-    """
-    filename = os.path.join("/sys/block", disk_name, "queue/rotational")
-    if not os.path.exists(filename):
-        # Should not happen unless sysfs changes, but better safe than sorry
-        return False
-    with open(filename) as f:
-        return f.read() == "0\n"
-
-
-def disk_name_for_partition(partition):
-    """ Returns disk name for each found partition.
-
-    :param partition:
-    :return:
-    """
-    name = os.path.basename(partition["device"])
-    if name.startswith("/dev/mmcblk"):
-        return re.sub("p[0-9]+$", "", name)
-    return re.sub("[0-9]+$", "", name)
-
-
 class FstabGenerator(object):
     """ Class header
 
@@ -80,7 +55,7 @@ class FstabGenerator(object):
         self.root_mount_point = root_mount_point
         self.mount_options = mount_options
         self.ssd_extra_mount_options = ssd_extra_mount_options
-        self.ssd_disks = set()
+        self.profiles = {}
         self.root_is_ssd = False
         self.use_luks = use_luks
         self.use_lvm = use_lvm
@@ -92,15 +67,14 @@ class FstabGenerator(object):
 
         :return:
         """
-        self.find_ssd_disks()
+        self.find_profiles()
         self.generate_fstab()
         self.create_mount_points()
         return None
 
-    def find_ssd_disks(self):
-        """ Checks for ssd disks """
-        disks = {disk_name_for_partition(x) for x in self.partitions}
-        self.ssd_disks = {x for x in disks if is_ssd_disk(x)}
+    def find_profiles(self):
+        """ Gets the format profile of each partition (the same used by mkfs) """
+        self.profiles = {x["device"]: format_profile.get_profile(x["device"]) for x in self.partitions}
 
     def generate_fstab(self):
         """ Create fstab. """
@@ -134,8 +108,7 @@ class FstabGenerator(object):
         fs = partition["fs"]
         mount_point = partition["mountPoint"]
         uuid = partition["uuid"]
-        disk_name = disk_name_for_partition(partition)
-        is_ssd = disk_name in self.ssd_disks
+        profile = self.profiles[device]
 
         fs = FS_MAP.get(fs, fs)
 
@@ -185,7 +158,8 @@ class FstabGenerator(object):
                 check='0')
 
         options = self.mount_options.get(fs, self.mount_options["default"])
-        if is_ssd:
+        if profile.discard:
+            # SSDs and thin provisioned devices
             extra = self.ssd_extra_mount_options.get(fs)
             if extra:
                 options += "," + extra
@@ -198,7 +172,7 @@ class FstabGenerator(object):
             check = 0
 
         if mount_point == "/":
-            self.root_is_ssd = is_ssd
+            self.root_is_ssd = not profile.rotational
 
         return dict(
             device="UUID=" + uuid,
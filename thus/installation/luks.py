@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  luks.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" LUKS provisioning (header wipe, key files, luksFormat and luksOpen) """
+
+import os
+import fcntl
+import struct
+import logging
+import subprocess
+
+from configobj import ConfigObj
+
+from misc.misc import InstallError
+
+conf_file = '/etc/thus.conf'
+configuration = ConfigObj(conf_file)
+
+# For 512 bit key length the header is 2MiB (16MiB in LUKS2)
+# If in doubt, just be generous and wipe the first 16MiB or so
+WIPE_SIZE = 16 * 1024 * 1024
+
+# Zeros are written in chunks this big when BLKZEROOUT is not supported
+WIPE_CHUNK_SIZE = 1024 * 1024
+
+# Size of random key files (in bytes)
+KEY_FILE_SIZE = 4096
+
+# BLKZEROOUT ioctl (linux/fs.h), lets the device zero (or unmap) a range by itself
+BLKZEROOUT = 0x127f
+
+# Argon2 memory cost limits (KiB). cryptsetup never uses more than 1GiB by default
+MAX_PBKDF_MEMORY = 1024 * 1024
+MIN_PBKDF_MEMORY = 32 * 1024
+
+# cryptsetup default number of argon2 threads
+MAX_PBKDF_PARALLEL = 4
+
+CIPHER = "aes-xts-plain64"
+KEY_SIZE = "512"
+
+# GRUB can't unlock LUKS2 (argon2id) devices, so a system with /boot inside
+# a LUKS2 device doesn't boot. LUKS2 is only used if thus.conf asks for it
+LUKS_TYPES = ("luks1", "luks2")
+DEFAULT_LUKS_TYPE = "luks1"
+
+
+def get_available_memory():
+    """ Returns available RAM (in KiB) from /proc/meminfo (0 if unknown) """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+class KdfOptions(object):
+    """ LUKS format and cost of its key derivation function used by
+        luksFormat. LUKS1 (the default) uses pbkdf2, so only iter_time
+        applies. LUKS2 uses argon2id (memory in KiB, iter_time in
+        milliseconds, parallel threads). A value of 0 (or None) leaves that
+        parameter to cryptsetup """
+
+    def __init__(self, memory=0, iter_time=0, parallel=0, luks_type=DEFAULT_LUKS_TYPE):
+        self.memory = memory
+        self.iter_time = iter_time
+        self.parallel = parallel
+        self.luks_type = luks_type
+
+    @classmethod
+    def from_config(cls, jobs=1):
+        """ Reads the [luks] section of thus.conf. Values not set there are
+            computed from the live machine, taking into account that jobs
+            LUKS devices will be formatted at the same time """
+        section = configuration.get('luks', {})
+
+        def get_int(key):
+            try:
+                # An empty value is the same as a missing one
+                return int(section.get(key) or 0)
+            except ValueError:
+                logging.warning(_("Wrong value for {0} in {1}").format(key, conf_file))
+                return 0
+
+        luks_type = (section.get('LUKS_TYPE') or DEFAULT_LUKS_TYPE).strip().lower()
+        if luks_type not in LUKS_TYPES:
+            logging.warning(_("Wrong value for {0} in {1}").format('LUKS_TYPE', conf_file))
+            luks_type = DEFAULT_LUKS_TYPE
+
+        jobs = max(1, jobs)
+        memory = get_int('PBKDF_MEMORY')
+        iter_time = get_int('ITER_TIME')
+        parallel = get_int('PBKDF_PARALLEL')
+
+        if luks_type == "luks1":
+            # pbkdf2 has no memory or threads cost
+            return cls(0, iter_time, 0, luks_type)
+
+        if memory <= 0:
+            # Live media run from RAM. Leave at least half of it to the system
+            available = get_available_memory()
+            if available > 0:
+                memory = min(MAX_PBKDF_MEMORY, available // (2 * jobs))
+                memory = max(MIN_PBKDF_MEMORY, memory)
+
+        if parallel <= 0:
+            parallel = max(1, min(MAX_PBKDF_PARALLEL, (os.cpu_count() or 1) // jobs))
+
+        return cls(memory, iter_time, parallel, luks_type)
+
+    def get_cryptsetup_args(self):
+        """ Returns luksFormat arguments """
+        args = ["--type", self.luks_type]
+        if self.luks_type == "luks1":
+            if self.iter_time:
+                args += ["--iter-time", str(self.iter_time)]
+            return args
+
+        args += ["--pbkdf", "argon2id"]
+        if self.memory:
+            args += ["--pbkdf-memory", str(self.memory)]
+        if self.iter_time:
+            args += ["--iter-time", str(self.iter_time)]
+        if self.parallel:
+            args += ["--pbkdf-parallel", str(self.parallel)]
+        return args
+
+    def __str__(self):
+        values = [("type", self.luks_type, ""), ("memory", self.memory, "KiB"),
+                  ("iter_time", self.iter_time, "ms"), ("parallel", self.parallel, "")]
+        return ", ".join("{0}={1}".format(name, "{0}{1}".format(value, unit) if value else "default")
+                         for (name, value, unit) in values)
+
+
+def wipe_header(device, size=WIPE_SIZE):
+    """ Zeroes the beginning of device (just in case we're installing on a pre LUKS setup) """
+    fd = os.open(device, os.O_WRONLY)
+    try:
+        try:
+            fcntl.ioctl(fd, BLKZEROOUT, struct.pack("QQ", 0, size))
+        except OSError:
+            # Not a block device or BLKZEROOUT not supported. Write zeros in big chunks
+            zeros = bytes(WIPE_CHUNK_SIZE)
+            written = 0
+            while written < size:
+                written += os.write(fd, zeros[:size - written])
+        os.fsync(fd)
+    except OSError as err:
+        logging.warning(_("Can't wipe LUKS header of {0}: {1}").format(device, err))
+    finally:
+        os.close(fd)
+
+
+def create_key_file(path, size=KEY_FILE_SIZE):
+    """ Creates a random key file only readable by its owner """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.fchmod(fd, 0o600)
+        os.write(fd, os.urandom(size))
+    finally:
+        os.close(fd)
+
+
+def cryptsetup(args, key=None):
+    """ Runs cryptsetup. key (bytes) is passed through stdin """
+    cmd = ["cryptsetup"] + args
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate(input=key)[0]
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+
+
+def format_device(device, key=None, key_file=None, kdf=None):
+    """ Formats device as LUKS, using key (bytes) or key_file as passphrase """
+    args = ["luksFormat", "-q", "-c", CIPHER, "-s", KEY_SIZE]
+    if kdf is not None:
+        args += kdf.get_cryptsetup_args()
+    else:
+        args += ["--type", DEFAULT_LUKS_TYPE]
+    if key_file is not None:
+        args += [device, key_file]
+    else:
+        args += ["--key-file=-", device]
+    cryptsetup(args, key)
+
+
+def open_device(device, name, key=None, key_file=None):
+    """ Opens LUKS device as /dev/mapper/name """
+    args = ["luksOpen", device, name, "-q", "--key-file", key_file or "-"]
+    cryptsetup(args, key)
+
+
+def setup(device, name, password=None, key_file=None, kdf=None):
+    """ Wipes, formats and opens a LUKS device. If no password is given, a
+        new random key file is created in key_file """
+    logging.debug(_("Thus will setup LUKS on device {0}".format(device)))
+    if kdf is not None:
+        logging.debug(_("LUKS key derivation cost: {0}").format(kdf))
+
+    wipe_header(device)
+
+    try:
+        if password:
+            key = bytes(password, 'UTF-8')
+            format_device(device, key=key, kdf=kdf)
+            open_device(device, name, key=key)
+        else:
+            create_key_file(key_file)
+            format_device(device, key_file=key_file, kdf=kdf)
+            open_device(device, name, key_file=key_file)
+    except subprocess.CalledProcessError as err:
+        txt = _("Can't format and open the LUKS device {0}").format(device)
+        logging.error(txt)
+        logging.error(_("Command {0} failed".format(err.cmd)))
+        logging.error(_("Output: {0}".format(err.output)))
+        raise InstallError(txt)
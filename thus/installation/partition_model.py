@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  partition_model.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" In-memory partition model used by the advanced installation screen """
+
+from gi.repository import GObject
+
+import parted3.partition_module as pm
+import parted3.fs_module as fs
+import parted3.lvm as lvm
+import parted3.used_space as used_space
+
+
+class PartitionModel(GObject.GObject):
+    """ Holds the disks and LVM volumes shown in the advanced partitioner.
+        Hardware is probed only once (or when reload is called). Changes are
+        announced with fine-grained signals so the treeview only has to
+        refresh the rows of the disk (or volume group) that changed. """
+
+    __gsignals__ = {
+        'disk-changed': (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        'volume-group-changed': (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        # The list of disks has changed, the whole view must be refreshed
+        'reset': (GObject.SignalFlags.RUN_FIRST, None, ())
+    }
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+
+        self.disks = None
+        self.volume_groups = None
+
+        # blkid results, by device path
+        self.fs_types = {}
+        self.fs_labels = {}
+
+        # System monitor we're watching (see watch)
+        self.monitor = None
+        self.monitor_handlers = []
+
+    def get_disks(self):
+        """ Returns a dict with (disk, result) tuples (see pm.get_devices) """
+        if self.disks is None:
+            self.disks = pm.get_devices()
+        return self.disks
+
+    def get_volume_groups(self):
+        """ Returns a dict with the logical volumes of each volume group.
+            Volume groups without logical volumes are skipped """
+        if self.volume_groups is None:
+            self.volume_groups = {}
+            for volume_group in lvm.get_volume_groups():
+                logical_volumes = lvm.get_logical_volumes(volume_group)
+                if logical_volumes:
+                    self.volume_groups[volume_group] = logical_volumes
+        return self.volume_groups
+
+    def get_fs_type(self, path):
+        """ Gets (and caches) the filesystem type stored in path """
+        if path not in self.fs_types:
+            self.fs_types[path] = fs.get_type(path)
+        return self.fs_types[path]
+
+    def get_lv_fs_type(self, path):
+        """ Gets the filesystem type of a logical volume """
+        fs_type = self.get_fs_type(path)
+        if not fs_type:
+            if used_space.is_btrfs(path):
+                # kludge, btrfs not being detected...
+                fs_type = 'btrfs'
+            else:
+                # Say unknown if we can't detect fs type instead of assumming btrfs
+                fs_type = 'unknown'
+            self.fs_types[path] = fs_type
+        return fs_type
+
+    def get_label(self, path):
+        """ Gets (and caches) the filesystem label stored in path """
+        if path not in self.fs_labels:
+            info = fs.get_info(path)
+            self.fs_labels[path] = info.get('LABEL', "")
+        return self.fs_labels[path]
+
+    def set_disk(self, disk_path, disk, result=pm.OK):
+        """ Replaces the disk object of disk_path (a new partition table, for instance) """
+        self.get_disks()[disk_path] = (disk, result)
+        self.disk_changed(disk_path)
+
+    def disk_changed(self, disk_path):
+        """ Tell listeners that partitions in disk_path have changed """
+        self.emit('disk-changed', disk_path)
+
+    def volume_group_changed(self, volume_group):
+        """ Tell listeners that logical volumes in volume_group have changed """
+        self.emit('volume-group-changed', volume_group)
+
+    def watch(self, monitor):
+        """ Keep the disk list up to date when disks are plugged in or removed
+            (monitor is a hotplug.SystemMonitor) """
+        self.unwatch()
+        self.monitor = monitor
+        self.monitor_handlers = [
+            monitor.connect('disk-added', self.on_disk_added),
+            monitor.connect('disk-removed', self.on_disk_removed)]
+
+    def unwatch(self):
+        """ Stop listening to the monitor passed to watch """
+        for handler in self.monitor_handlers:
+            self.monitor.disconnect(handler)
+        self.monitor = None
+        self.monitor_handlers = []
+
+    def on_disk_added(self, monitor, disk_path):
+        """ Probe just the new disk (the others may have staged changes) """
+        if self.disks is None:
+            # Nothing probed yet
+            return
+        probed = pm.get_device(disk_path)
+        if probed is not None:
+            (disk, result) = probed
+            self.volume_groups = None
+            self.set_disk(disk_path, disk, result)
+
+    def on_disk_removed(self, monitor, disk_path):
+        """ Forget a removed disk """
+        if self.disks is None or disk_path not in self.disks:
+            return
+        del self.disks[disk_path]
+        self.volume_groups = None
+        for cache in [self.fs_types, self.fs_labels]:
+            for path in [path for path in cache if path.startswith(disk_path)]:
+                del cache[path]
+        self.emit('reset')
+
+    def reload(self):
+        """ Forget everything and probe all devices again """
+        self.disks = None
+        self.volume_groups = None
+        self.fs_types = {}
+        self.fs_labels = {}
+        self.emit('reset')
+
+GObject.type_register(PartitionModel)
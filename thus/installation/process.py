@@ -44,6 +44,9 @@ import yaml
 
 import parted3.fs_module as fs
 import misc.misc as misc
+import misc.log_queue as log_queue
+import misc.mount_table as mount_table
+import misc.profiler as profiler
 import encfs
 from installation import auto_partition
 from installation import chroot
@@ -243,6 +246,8 @@ class InstallationProcess(multiprocessing.Process):
         self.running = False
         self.queue_event('error', txt)
         self.callback_queue.join()
+        # Send our last log messages to the log writer
+        log_queue.shutdown()
         # Is this really necessary?
         os._exit(0)
 
@@ -324,7 +329,7 @@ class InstallationProcess(multiprocessing.Process):
                 bootloader=self.settings.get("bootloader"),
                 callback_queue=self.callback_queue
             )
-            auto.run()
+            profiler.run_phase("partitioning", auto.run)
 
             # used in modify_grub_default() and fstab
             self.mount_devices = auto.get_mount_devices()
@@ -370,10 +375,10 @@ class InstallationProcess(multiprocessing.Process):
 
         try:
             logging.debug(_('Install System ...'))
-            self.install_system()
+            profiler.run_phase("install_system", self.install_system)
             logging.debug(_('System installed.'))
             logging.debug(_('Configuring system ...'))
-            self.configure_system()
+            profiler.run_phase("configure_system", self.configure_system)
             logging.debug(_('System configured.'))
 
         except subprocess.CalledProcessError as err:
@@ -405,8 +410,9 @@ class InstallationProcess(multiprocessing.Process):
             datetime = time.strftime("%Y%m%d") + "-" + time.strftime("%H%M%S")
             dst = os.path.join(DEST_DIR,
                                "var/log/thus-{0}.log".format(datetime))
+            compress_log = configuration['install'].get('COMPRESS_LOG', 'no').lower() in ('yes', 'true', '1')
             try:
-                shutil.copy("/tmp/thus.log", dst)
+                log_queue.archive(dst, compress_log)
             except FileNotFoundError:
                 logging.warning(_("Can't copy Thus log to {0}".format(dst)))
             except FileExistsError:
@@ -414,32 +420,9 @@ class InstallationProcess(multiprocessing.Process):
             
             source_dirs = ["/source", "/source_desktop"]
 
-            partition_dirs = []
-            for path in sorted(self.mount_devices, reverse=True):
-                if path == "" or path == "swap" or path == "/":
-                    continue
-                partition_dirs += [DEST_DIR + path]
-
-            install_dirs = ["/install"]
-            unmount_points = source_dirs + partition_dirs + install_dirs
-
-            logging.debug("Paths to unmount: {0}".format(unmount_points))
-            for p in unmount_points:
-                (fsname, fstype, writable) = misc.mount_info(p)
-                if fsname:
-                    logging.debug(_("Unmounting {0}".format(p)))
-                    try:
-                        subprocess.check_call(['umount', p])
-                    except subprocess.CalledProcessError:
-                        logging.debug("Can't unmount. Try -l to force it.")
-                        try:
-                            subprocess.check_call(["umount", "-l", p])
-                        except subprocess.CalledProcessError as err:
-                            logging.warning(_("Unable to umount {0}".format(p)))
-                            logging.warning(_("Command {0} has failed."
-                                              .format(err.cmd)))
-                            logging.warning(_("Output : {0}"
-                                              .format(err.output)))
+            # Everything mounted inside DEST_DIR is unmounted deepest first
+            logging.debug("Paths to unmount: {0}".format(source_dirs + [DEST_DIR]))
+            mount_table.unmount_trees(source_dirs + [DEST_DIR])
 
             # Installation finished successfully
             self.queue_event("finished", _("Installation finished successfully."))
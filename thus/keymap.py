@@ -42,6 +42,8 @@ class Keymap(GtkBaseBox):
         self.prepare_called = False
 
         self.filename = os.path.join(self.settings.get('data'), "kbdnames.gz")
+        # Keeps the names of every language it loads
+        self.kbd_names = keyboard_names.KeyboardNames(self.filename)
 
         self.layout_treeview = self.ui.get_object("keyboardlayout")
         self.variant_treeview = self.ui.get_object("keyboardvariant")
@@ -55,6 +57,9 @@ class Keymap(GtkBaseBox):
 
         self.create_treeviews()
 
+        # Have the keycodes of the layout we'll select in prepare ready
+        self.prefetch_country_layout()
+
     def translate_ui(self):
         """ Translates all ui elements """
         txt = _("Select your keyboard layout")
@@ -124,12 +129,11 @@ class Keymap(GtkBaseBox):
     def fill_layout_treeview(self):
         lang = self.settings.get("language_code")
 
-        keyboard_names._default_filename = self.filename
+        kbd_names = self.kbd_names
 
-        if not keyboard_names.has_language(lang):
+        if not kbd_names.has_language(lang):
             lang = "C"
 
-        kbd_names = keyboard_names.KeyboardNames(self.filename)
         kbd_names.load(lang)
 
         sorted_layouts = []
@@ -192,10 +196,11 @@ class Keymap(GtkBaseBox):
 
                 lang = self.settings.get("language_code")
 
-                if not keyboard_names.has_language(lang):
+                kbd_names = self.kbd_names
+
+                if not kbd_names.has_language(lang):
                     lang = "C"
 
-                kbd_names = keyboard_names.KeyboardNames(self.filename)
                 kbd_names.load(lang)
 
                 country_code = kbd_names.layout_by_human[self.keyboard_layout_human]
@@ -236,6 +241,49 @@ class Keymap(GtkBaseBox):
     def on_keyboardvariant_cursor_changed(self, widget):
         self.store_values()
         self.set_keyboard_widget()
+        self.prefetch_keycodes()
+
+    def prefetch_country_layout(self):
+        """ Loads in the background the keycodes of the layout of the country
+            chosen in the timezone page (USA's if there's none) """
+        lang = self.settings.get("language_code")
+        if not self.kbd_names.has_language(lang):
+            lang = "C"
+        self.kbd_names.load(lang)
+
+        country = self.fix_countries(self.settings.get("timezone_human_country"))
+        layout = self.kbd_names.layout_by_human.get(country, "us")
+        self.keyboard_widget.prefetch([(layout, "")])
+
+    def prefetch_keycodes(self):
+        """ Loads in the background the keycodes of the layouts and variants
+            next to the selected ones (the user will likely choose them next) """
+        if self.keyboard_layout is None:
+            return
+
+        # kbd_names has the current language loaded by store_values
+        kbd_names = self.kbd_names
+        layouts = []
+
+        variants = kbd_names.variant_by_human.get(self.keyboard_layout, {})
+        for variant_human in self.get_neighbour_values(self.variant_treeview):
+            if variant_human in variants:
+                layouts.append((self.keyboard_layout, variants[variant_human]))
+
+        for layout_human in self.get_neighbour_values(self.layout_treeview):
+            if layout_human in kbd_names.layout_by_human:
+                layouts.append((kbd_names.layout_by_human[layout_human], ""))
+
+        self.keyboard_widget.prefetch(layouts)
+
+    @staticmethod
+    def get_neighbour_values(treeview):
+        """ Returns the values of the rows above and below the selected one """
+        (model, tree_iter) = treeview.get_selection().get_selected()
+        if tree_iter is None:
+            return []
+        index = model.get_path(tree_iter).get_indices()[0]
+        return [model[i][0] for i in (index - 1, index + 1) if 0 <= i < len(model)]
 
     def store_values(self):
         if self.keyboard_layout_human is None:
@@ -253,7 +301,7 @@ class Keymap(GtkBaseBox):
 
         lang = self.settings.get("language_code")
 
-        kbd_names = keyboard_names.KeyboardNames(self.filename)
+        kbd_names = self.kbd_names
 
         if not kbd_names.has_language(lang):
             lang = "C"
@@ -30,11 +30,7 @@ import logging
 import sys
 import locale
 
-try:
-    import xml.etree.cElementTree as eTree
-except ImportError:
-    import xml.etree.ElementTree as eTree
-
+import misc.locale_index as locale_index
 from gtkbasebox import GtkBaseBox
 
 
@@ -49,6 +45,7 @@ class Location(GtkBaseBox):
         self.label_choose_country = self.ui.get_object("label_choose_country")
         self.label_help = self.ui.get_object("label_help")
 
+        self.locale_index = None
         self.locales = {}
         self.load_locales()
 
@@ -112,68 +109,26 @@ class Location(GtkBaseBox):
         self.forward_button.set_sensitive(True)
 
     def load_locales(self):
-        data_dir = self.settings.get('data')
-        xml_path = os.path.join(data_dir, "locale", "locales.xml")
-
-        self.locales = {}
-
         try:
-            tree = eTree.parse(xml_path)
+            self.locale_index = locale_index.get_index(self.settings.get('data'))
         except FileNotFoundError as file_error:
             logging.error(file_error)
             sys.exit(1)
-
-        root = tree.getroot()
-        locale_name = ""
-        language_name = ""
-        for child in root.iter("language"):
-            for item in child:
-                if item.tag == 'language_name':
-                    language_name = item.text
-                elif item.tag == 'locale_name':
-                    locale_name = item.text
-            if len(locale_name) > 0 and len(language_name) > 0:
-                self.locales[locale_name] = language_name
-
-        xml_path = os.path.join(data_dir, "locale", "iso3366-1.xml")
-
-        countries = {}
-
-        try:
-            tree = eTree.parse(xml_path)
-        except FileNotFoundError as file_error:
-            logging.error(file_error)
-            sys.exit(1)
-
-        root = tree.getroot()
-        for child in root:
-            code = child.attrib['value']
-            name = child.text
-            countries[code] = name
-
-        for locale_name in self.locales:
-            language_name = self.locales[locale_name]
-            for country_code in countries:
-                if country_code in language_name:
-                    self.locales[locale_name] = self.locales[locale_name] + ", " + countries[country_code]
+        self.locales = self.locale_index.areas
 
     def get_areas(self):
         areas = []
 
         if not self.show_all_locations:
             lang_code = self.settings.get("language_code")
-            for locale_name in self.locales:
-                if lang_code in locale_name:
-                    areas.append(self.locales[locale_name])
+            areas = self.locale_index.get_areas(lang_code)
             if len(areas) == 0:
                 # When we don't find any country we put all language codes.
                 # This happens with Esperanto and Asturianu at least.
-                for locale_name in self.locales:
-                    areas.append(self.locales[locale_name])
+                areas = self.locale_index.get_areas()
         else:
             # Put all language codes (forced by the checkbox)
-            for locale_name in self.locales:
-                areas.append(self.locales[locale_name])
+            areas = self.locale_index.get_areas()
 
         areas.sort()
 
@@ -26,34 +26,46 @@
 
 """ Main Thus Window """
 
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GLib
 
 import os
 import sys
+import gc
+import importlib
 import multiprocessing
 import logging
 
 import config
-import language
-import location
-import check
-import keymap
-import timezone
-import user_info
-import slides
+import gtkbasebox
 import misc.misc as misc
+import misc.log_queue as log_queue
+import misc.profiler as profiler
 import info
 import show_message as show
 
-from installation import ask as installation_ask
-from installation import automatic as installation_automatic
-from installation import alongside as installation_alongside
-from installation import advanced as installation_advanced
-
 # Constants (must be uppercase)
 MAIN_WINDOW_WIDTH = 800
 MAIN_WINDOW_HEIGHT = 526
 
+# Seconds from process start to the window being shown
+STARTUP_BUDGET = 2.0
+
+# Page name: (module, class). Page modules are imported the first time their
+# page is needed, so pyparted, WebKit, the timezone and keyboard helpers...
+# are not loaded before the window is shown
+PAGE_CLASSES = {
+    "language": ("language", "Language"),
+    "location": ("location", "Location"),
+    "check": ("check", "Check"),
+    "keymap": ("keymap", "Keymap"),
+    "timezone": ("timezone", "Timezone"),
+    "installation_ask": ("installation.ask", "InstallationAsk"),
+    "installation_automatic": ("installation.automatic", "InstallationAutomatic"),
+    "installation_alongside": ("installation.alongside", "InstallationAlongside"),
+    "installation_advanced": ("installation.advanced", "InstallationAdvanced"),
+    "user_info": ("user_info", "UserInfo"),
+    "slides": ("slides", "Slides")}
+
 
 class MainWindow(Gtk.ApplicationWindow):
     """ Thus main window """
@@ -110,9 +122,13 @@ class MainWindow(Gtk.ApplicationWindow):
         # For things we are not ready for users to test
         self.settings.set('z_hidden', cmd_line.z_hidden)
 
+        # Read all ui files from the (maybe slow) live media while we build
+        # the main window
+        gtkbasebox.preload_ui_definitions(self.ui_dir)
+
         self.ui = Gtk.Builder()
         path = os.path.join(self.ui_dir, "main_window.ui")
-        self.ui.add_from_file(path)
+        self.ui.add_from_string(gtkbasebox.get_ui_definition(path))
 
         self.add(self.ui.get_object("main"))
 
@@ -177,10 +193,12 @@ class MainWindow(Gtk.ApplicationWindow):
         # self.params['disable_tryit'] = cmd_line.disable_tryit
         self.params['testing'] = cmd_line.testing
 
-        # Just load the first two screens (the other ones will be loaded later)
-        # We do this so the user has not to wait for all the screens to be loaded
+        # Pages are created the first time they are needed (the next page is
+        # created in advance when GTK is idle), so the user has not to wait
+        # for all the screens to be loaded
         self.pages = dict()
-        self.pages["language"] = language.Language(self.params)
+        self.prewarm_id = None
+        self.get_page("language")
 
         self.connect('delete-event', self.on_exit_button_clicked)
         self.connect('key-release-event', self.check_escape)
@@ -200,7 +218,7 @@ class MainWindow(Gtk.ApplicationWindow):
         self.set_icon_from_file(icon_path)
 
         # Set the first page to show
-        self.current_page = self.pages["language"]
+        self.current_page = self.get_page("language")
         self.settings.set('timezone_start', True)
 
         self.main_box.add(self.current_page)
@@ -224,13 +242,14 @@ class MainWindow(Gtk.ApplicationWindow):
         # Show main window
         self.show_all()
 
-        self.current_page.prepare('forwards')
+        self.prepare_current_page('forwards')
 
         # Hide backwards button
         self.backwards_button.hide()
 
         self.progressbar.set_fraction(0)
-        self.progressbar_step = 0
+        # Language and slides pages don't count
+        self.progressbar_step = 1.0 / (len(PAGE_CLASSES) - 2)
 
         '''
         # Do not hide progress bar for minimal iso as it would break the widget alignment on language page.
@@ -244,47 +263,75 @@ class MainWindow(Gtk.ApplicationWindow):
 
         misc.gtk_refresh()
 
-    def load_pages(self):
-        # misc.set_cursor(Gdk.CursorType.WATCH)
-        self.pages["location"] = location.Location(self.params)
-        self.pages["check"] = check.Check(self.params)
-        self.pages["keymap"] = keymap.Keymap(self.params)
-        self.pages["timezone"] = timezone.Timezone(self.params)
-        self.pages["installation_ask"] = installation_ask.InstallationAsk(self.params)
-        self.pages["installation_automatic"] = installation_automatic.InstallationAutomatic(self.params)
-
-        if self.settings.get("enable_alongside"):
-            self.pages["installation_alongside"] = installation_alongside.InstallationAlongside(self.params)
+        # The window is on screen now
+        self.check_startup_time()
+
+        # Don't create the next page yet. Its ui strings would be loaded
+        # before the user chooses the installer language
+
+    @staticmethod
+    def check_startup_time():
+        """ Logs how long it took to show the window (warns if over budget) """
+        elapsed = profiler.get_process_uptime()
+        if elapsed is None:
+            return
+        if elapsed > STARTUP_BUDGET:
+            logging.warning("Window shown %.2f seconds after start (startup budget is %.1f seconds)",
+                            elapsed, STARTUP_BUDGET)
         else:
-            self.pages["installation_alongside"] = None
-
-        self.pages["installation_advanced"] = installation_advanced.InstallationAdvanced(self.params)
-        self.pages["user_info"] = user_info.UserInfo(self.params)
-        self.pages["slides"] = slides.Slides(self.params)
-        # misc.set_cursor(Gdk.CursorType.ARROW)
-
-        diff = 2
-
-        num_pages = len(self.pages) - diff
-
-        if num_pages > 0:
-            self.progressbar_step = 1.0 / num_pages
+            logging.debug("Window shown %.2f seconds after start", elapsed)
+
+    def get_page(self, name):
+        """ Returns page name, creating it if this is the first time it is needed """
+        if name not in self.pages:
+            if name == "installation_alongside" and not self.settings.get("enable_alongside"):
+                self.pages[name] = None
+            else:
+                with profiler.span(name, "page"):
+                    self.pages[name] = self.get_page_class(name)(self.params)
+        return self.pages[name]
+
+    @staticmethod
+    def get_page_class(name):
+        """ Imports the module of page name (if it's not already) and returns its class """
+        (module_name, class_name) = PAGE_CLASSES[name]
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def prepare_current_page(self, direction):
+        with profiler.span("prepare " + self.current_page.name, "page", direction=direction):
+            self.current_page.prepare(direction)
+
+    def prewarm_next_page(self):
+        """ Creates the page that will likely be shown next when GTK is idle """
+        if self.prewarm_id is None:
+            self.prewarm_id = GLib.idle_add(self.on_prewarm_next_page)
+
+    def on_prewarm_next_page(self):
+        self.prewarm_id = None
+        if self.current_page is not None:
+            next_page = self.current_page.get_next_page()
+            if next_page in PAGE_CLASSES and next_page not in self.pages:
+                self.get_page(next_page)
+        return False
 
     def del_pages(self):
         """ When we get to user_info page we can't go back
         therefore we can delete all previous pages for good """
-        # FIXME: As there are more references, this does nothing
-        if self.current_page == self.pages["user_info"]:
-            del self.pages["language"]
-            del self.pages["location"]
-            del self.pages["check"]
-            del self.pages["keymap"]
-            del self.pages["timezone"]
-            del self.pages["installation_ask"]
-            del self.pages["installation_automatic"]
-            if self.pages["installation_alongside"] is not None:
-                del self.pages["installation_alongside"]
-            del self.pages["installation_advanced"]
+        if self.current_page != self.pages.get("user_info"):
+            return
+
+        for name in list(self.pages.keys()):
+            if name in ("user_info", "slides"):
+                continue
+            page = self.pages.pop(name)
+            if page is not None:
+                # Let the page disconnect from objects that outlive it,
+                # then destroy it (breaks the references GTK keeps)
+                page.release()
+                page.destroy()
+
+        # Pages are full of reference cycles (builder <-> signal handlers)
+        gc.collect()
 
     def set_geometry(self):
         """ Sets Thus window geometry """
@@ -330,6 +377,7 @@ class MainWindow(Gtk.ApplicationWindow):
             misc.remove_temp_files()
             logging.info(_("Quiting installer..."))
             self.settings.set('stop_all_threads', True)
+            log_queue.shutdown()
             logging.shutdown()
             os._exit(0)
         except KeyboardInterrupt:
@@ -353,23 +401,19 @@ class MainWindow(Gtk.ApplicationWindow):
 
         if next_page is not None:
             # self.logo.hide()
-            if next_page not in self.pages.keys():
-                # Load all pages
-                self.load_pages()
-                self.progressbar_step = 1.0 / (len(self.pages) - 2)
-
-            stored = self.current_page.store_values()
+            with profiler.span("store_values " + self.current_page.name, "page"):
+                stored = self.current_page.store_values()
 
             if stored:
                 self.set_progressbar_step(self.progressbar_step)
                 self.main_box.remove(self.current_page)
 
-                self.current_page = self.pages[next_page]
+                self.current_page = self.get_page(next_page)
 
                 if self.current_page is not None:
                     if next_page == "user_info":
                         self.del_pages()
-                    self.current_page.prepare('forwards')
+                    self.prepare_current_page('forwards')
                     self.main_box.add(self.current_page)
                     if self.current_page.get_prev_page() is not None:
                         # There is a previous page, show back button
@@ -382,6 +426,8 @@ class MainWindow(Gtk.ApplicationWindow):
                             # Show logo in slides screen
                             self.logo.show_all()
 
+                    self.prewarm_next_page()
+
     def on_backwards_button_clicked(self, widget, data=None):
         """ Show previous screen """
         prev_page = self.current_page.get_prev_page()
@@ -394,10 +440,10 @@ class MainWindow(Gtk.ApplicationWindow):
 
             self.main_box.remove(self.current_page)
 
-            self.current_page = self.pages[prev_page]
+            self.current_page = self.get_page(prev_page)
 
             if self.current_page is not None:
-                self.current_page.prepare('backwards')
+                self.prepare_current_page('backwards')
                 self.main_box.add(self.current_page)
 
                 if self.current_page.get_prev_page() is None:
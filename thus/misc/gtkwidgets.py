@@ -270,9 +270,9 @@ class ResizeWidget(Gtk.Frame):
 
     def __init__(self, part_size, min_size, max_size):
         """
-            part_size: The size (MB) of the existing partition.
-            min_size: The min size (MB) that the existing partition can be resized to.
-            max_size: The max size (MB) that the existing partition can be resized to.
+            part_size: The size (bytes) of the existing partition.
+            min_size: The min size (bytes) that the existing partition can be resized to.
+            max_size: The max size (bytes) that the existing partition can be resized to.
         """
 
         assert min_size <= max_size <= part_size
@@ -359,10 +359,10 @@ class ResizeWidget(Gtk.Frame):
         total_width = s1 + s2
 
         percent = (float(s1) / float(total_width))
-        self.existing_part.set_size_in_mb(percent * self.part_size)
+        self.existing_part.set_size(percent * self.part_size)
 
         percent = (float(s2) / float(total_width))
-        self.new_part.set_size_in_mb(percent * self.part_size)
+        self.new_part.set_size(percent * self.part_size)
 
     def set_pref_size(self, size):
         s1 = self.existing_part.get_allocation().width
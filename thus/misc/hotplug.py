@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  hotplug.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Device, power and network monitor (kernel uevents and D-Bus signals) """
+
+import socket
+import logging
+import threading
+
+from gi.repository import GObject, GLib
+
+import misc.misc as misc
+
+NM = 'org.freedesktop.NetworkManager'
+NM_PATH = '/org/freedesktop/NetworkManager'
+UPOWER = 'org.freedesktop.UPower'
+UPOWER_PATH = '/org/freedesktop/UPower'
+DBUS_PROPERTIES = 'org.freedesktop.DBus.Properties'
+
+# linux/netlink.h
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group of the events sent by the kernel
+UEVENT_KERNEL_GROUP = 1
+
+# Kernel events arrive before udev has created the device nodes (and a disk
+# with partitions sends a burst of them), so they are handled after this delay
+SETTLE_DELAY_MS = 1000
+
+# Block devices that are not disks the user can install to
+IGNORED_BLOCK_DEVICES = ("loop", "ram", "zram", "dm-", "sr", "md", "nbd")
+
+
+def parse_uevent(data):
+    """ Parses a kernel uevent message ("action@devpath\\0KEY=VALUE\\0...") """
+    fields = data.split(b'\0')
+    if not fields or b'@' not in fields[0]:
+        return None
+    event = {}
+    for field in fields[1:]:
+        if b'=' in field:
+            key, value = field.split(b'=', 1)
+            event[key.decode(errors='replace')] = value.decode(errors='replace')
+    return event
+
+
+class SystemMonitor(GObject.GObject):
+    """ Tells listeners when a disk is plugged in or removed, when the power
+        source changes and when the network connection changes, so no one
+        has to poll for them. Signals are always emitted from the GTK main loop """
+
+    __gsignals__ = {
+        'disk-added': (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        'disk-removed': (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        'block-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        'power-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        'network-changed': (GObject.SignalFlags.RUN_FIRST, None, (bool,))
+    }
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+
+        self.started = False
+        self.uevent_socket = None
+        self.bus = None
+
+        # Disk events waiting for udev (action, device path)
+        self.pending_disks = []
+        self.pending_block = False
+        self.pending_power = False
+        self.settle_id = None
+
+        self.network_thread = None
+
+    def start(self):
+        """ Starts listening (it is safe to call it more than once) """
+        if self.started:
+            return
+        self.started = True
+        self.start_uevents()
+        self.start_dbus()
+
+    def start_uevents(self):
+        """ Listens to kernel uevents (block and power_supply subsystems) """
+        try:
+            self.uevent_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_KOBJECT_UEVENT)
+            # Port id 0 lets the kernel choose one
+            self.uevent_socket.bind((0, UEVENT_KERNEL_GROUP))
+        except (OSError, AttributeError) as err:
+            logging.warning(_("Can't listen to kernel device events: {0}").format(err))
+            self.uevent_socket = None
+            return
+        GLib.io_add_watch(self.uevent_socket.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.on_uevent)
+
+    def start_dbus(self):
+        """ Listens to NetworkManager and UPower signals """
+        try:
+            import dbus
+            import dbus.bus
+            from dbus.mainloop.glib import DBusGMainLoop
+            # Private connection, so the default main loop of dbus-python is left alone
+            self.bus = dbus.bus.BusConnection(dbus.bus.BUS_SYSTEM, mainloop=DBusGMainLoop())
+            self.bus.add_signal_receiver(
+                self.on_network_state_changed, 'StateChanged', NM, NM, NM_PATH)
+            self.bus.add_signal_receiver(
+                self.on_upower_properties_changed, 'PropertiesChanged', DBUS_PROPERTIES, UPOWER, UPOWER_PATH)
+        except Exception as err:
+            logging.warning(_("Can't listen to D-Bus signals: {0}").format(err))
+            self.bus = None
+
+    def on_uevent(self, fd, condition):
+        """ A kernel uevent has arrived """
+        try:
+            data = self.uevent_socket.recv(16384)
+        except OSError as err:
+            logging.warning(err)
+            return True
+
+        event = parse_uevent(data)
+        if event is None:
+            return True
+
+        subsystem = event.get('SUBSYSTEM')
+        action = event.get('ACTION')
+
+        if subsystem == "block" and action in ("add", "remove", "change"):
+            name = event.get('DEVNAME', "")
+            if event.get('DEVTYPE') == "disk" and action in ("add", "remove"):
+                if not name.startswith(IGNORED_BLOCK_DEVICES):
+                    self.pending_disks.append((action, "/dev/" + name))
+            self.pending_block = True
+            self.schedule_settle()
+        elif subsystem == "power_supply":
+            self.pending_power = True
+            self.schedule_settle()
+
+        return True
+
+    def schedule_settle(self):
+        """ Coalesces bursts of events into a single notification """
+        if self.settle_id is not None:
+            GLib.source_remove(self.settle_id)
+        self.settle_id = GLib.timeout_add(SETTLE_DELAY_MS, self.on_settled)
+
+    def on_settled(self):
+        """ Emits the signals of all events received since the last burst """
+        self.settle_id = None
+
+        for action, device in self.pending_disks:
+            logging.debug(_("Disk {0}: {1}").format(action, device))
+            if action == "add":
+                self.emit('disk-added', device)
+            else:
+                self.emit('disk-removed', device)
+        self.pending_disks = []
+
+        if self.pending_block:
+            self.pending_block = False
+            self.emit('block-changed')
+
+        if self.pending_power:
+            self.pending_power = False
+            self.emit('power-changed')
+
+        return False
+
+    def on_upower_properties_changed(self, interface, changed, invalidated):
+        """ UPower's OnBattery may have changed """
+        if 'OnBattery' in changed or 'OnBattery' in invalidated:
+            self.emit('power-changed')
+
+    def on_network_state_changed(self, state):
+        """ NetworkManager says the connection state has changed. NM can't be
+            trusted (in a VM it says we're connected when the host is not), so
+            we check the connection ourselves in a thread """
+        if self.network_thread is not None and self.network_thread.is_alive():
+            return
+        self.network_thread = threading.Thread(target=self.check_connection)
+        self.network_thread.start()
+
+    def check_connection(self):
+        """ Runs in a thread (has_connection can take a few seconds) """
+        connected = misc.has_connection()
+        GLib.idle_add(self.emit, 'network-changed', connected)
+
+
+GObject.type_register(SystemMonitor)
+
+# Shared by all pages
+_monitor = None
+
+
+def get_monitor():
+    """ Returns the monitor shared by all pages (started) """
+    global _monitor
+    if _monitor is None:
+        _monitor = SystemMonitor()
+        _monitor.start()
+    return _monitor
@@ -23,24 +23,98 @@
 from collections import defaultdict
 import gzip
 import io
+import mmap
+import os
+import struct
+import zlib
 
 # TODO: fix this as it's not clean to have a full path here
 # _default_filename = "/usr/lib/ubiquity/console-setup/kbdnames.gz"
 # _default_filename = "data/kbdnames.gz"
 _default_filename = '/usr/share/thus/data/kbdnames.gz'
 
+# Index generated by utils/generate_kbdnames_index.py
+_INDEX_MAGIC = b'KBDN'
+_INDEX_VERSION = 2
+_INDEX_HEADER = struct.Struct('>4sBH')
+_INDEX_ENTRY = struct.Struct('>16sII')
+
+
+def _index_filename(filename):
+    """Return the index filename of a kbdnames.gz file."""
+    return os.path.splitext(filename)[0] + ".idx"
+
+
+class _LanguageNames:
+    """Layout and variant names in one language."""
+
+    def __init__(self):
+        self.layout_by_id = {}
+        self.layout_by_human = {}
+        self.variant_by_id = defaultdict(dict)
+        self.variant_by_human = defaultdict(dict)
+
+    def add(self, element, name, value):
+        if element == "layout":
+            self.layout_by_id[name] = value
+            self.layout_by_human[value] = name
+        elif element == "variant":
+            variantname, variantdesc = value.split("*", 1)
+            self.variant_by_id[name][variantname] = variantdesc
+            self.variant_by_human[name][variantdesc] = variantname
+
 
 class KeyboardNames:
     def __init__(self, filename):
         self._current_lang = None
         self._filename = filename
-        self._clear()
+        # Names of each language already loaded
+        self._languages = {}
+        # Offset and size of each language in the (memory mapped) index
+        self._index = None
+        self._index_map = None
+        self._open_index()
+        self._select(_LanguageNames())
+
+    def _open_index(self):
+        try:
+            with open(_index_filename(self._filename), 'rb') as index_file:
+                index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # No index, kbdnames.gz will be read instead
+            return
 
-    def _clear(self):
-        self._layout_by_id = {}
-        self.layout_by_human = {}
-        self._variant_by_id = defaultdict(dict)
-        self.variant_by_human = defaultdict(dict)
+        index = {}
+        try:
+            magic, version, count = _INDEX_HEADER.unpack_from(index_map)
+            if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+                raise ValueError("Unknown keyboard names index format")
+            for number in range(count):
+                lang, offset, size = _INDEX_ENTRY.unpack_from(
+                    index_map, _INDEX_HEADER.size + number * _INDEX_ENTRY.size)
+                index[lang.rstrip(b'\0').decode('ascii')] = (offset, size)
+        except (ValueError, struct.error):
+            index_map.close()
+            return
+
+        self._index = index
+        self._index_map = index_map
+
+    def _select(self, names):
+        self._layout_by_id = names.layout_by_id
+        self.layout_by_human = names.layout_by_human
+        self._variant_by_id = names.variant_by_id
+        self.variant_by_human = names.variant_by_human
+
+    def _load_index(self, lang):
+        names = _LanguageNames()
+        if lang in self._index:
+            offset, size = self._index[lang]
+            block = zlib.decompress(self._index_map[offset:offset + size]).decode('utf-8')
+            for line in block.splitlines():
+                element, name, value = line.split("*", 2)
+                names.add(element, name, value)
+        return names
 
     def _load_file(self, lang, kbdnames):
         # TODO cjwatson 2012-07-19: Work around
@@ -49,37 +123,36 @@ class KeyboardNames:
         #   for line in kbdnames:
         #       line = line.rstrip("\n")
 
+        names = _LanguageNames()
         for line in kbdnames.read().splitlines():
             got_lang, element, name, value = line.split("*", 3)
-            if got_lang != lang:
-                continue
-
-            if element == "layout":
-                self._layout_by_id[name] = value
-                self.layout_by_human[value] = name
-            elif element == "variant":
-                variantname, variantdesc = value.split("*", 1)
-                self._variant_by_id[name][variantname] = variantdesc
-                self.variant_by_human[name][variantdesc] = variantname
+            if got_lang == lang:
+                names.add(element, name, value)
+        return names
 
     def load(self, lang):
         if lang == self._current_lang:
             return
 
-        # Saving memory is more important than parsing time in the
-        # relatively rare case of changing languages, so we only keep data
-        # around for a single language.
-        self._clear()
-
-        raw = gzip.open(self._filename)
-        try:
-            with io.TextIOWrapper(raw, encoding='utf-8') as kbdnames:
-                self._load_file(lang, kbdnames)
-        finally:
-            raw.close()
+        # Languages are kept once loaded (just a few hundred names each),
+        # so switching back and forth doesn't read the file again
+        if lang not in self._languages:
+            if self._index is not None:
+                self._languages[lang] = self._load_index(lang)
+            else:
+                raw = gzip.open(self._filename)
+                try:
+                    with io.TextIOWrapper(raw, encoding='utf-8') as kbdnames:
+                        self._languages[lang] = self._load_file(lang, kbdnames)
+                finally:
+                    raw.close()
+
+        self._select(self._languages[lang])
         self._current_lang = lang
 
     def has_language(self, lang):
+        if self._index is not None:
+            return lang in self._index
         self.load(lang)
         return bool(self._layout_by_id)
 
@@ -26,17 +26,9 @@
 
 from gi.repository import Gtk, GObject
 import cairo
-import subprocess
 import math
 
-
-def unicode_to_string(raw):
-    """ U+ , or +U+ ... to string """
-    if raw[0:2] == "U+":
-        return chr(int(raw[2:], 16))
-    elif raw[0:2] == "+U":
-        return chr(int(raw[3:], 16))
-    return ""
+import misc.keycodes as keycodes
 
 
 class KeyboardWidget(Gtk.DrawingArea):
@@ -87,6 +79,10 @@ class KeyboardWidget(Gtk.DrawingArea):
 
         self.kb = None
 
+        # Offscreen rendering of the keyboard and what it was rendered for
+        self.surface = None
+        self.surface_key = None
+
     def set_layout(self, layout):
         self.layout = layout
 
@@ -219,7 +215,26 @@ class KeyboardWidget(Gtk.DrawingArea):
         cr.stroke()
 
     def do_draw(self, cr):
-        """ The 'cr' variable is the current Cairo context """
+        """ The 'cr' variable is the current Cairo context.
+            The keyboard is only drawn again when the keycodes, font or size
+            change, otherwise the last rendering is painted """
+        if self.kb is None:
+            return
+
+        alloc = self.get_allocation()
+        key = (self.layout, self.variant, self.font, alloc.width, alloc.height)
+
+        if self.surface is None or self.surface_key != key:
+            self.surface = cr.get_target().create_similar(
+                cairo.CONTENT_COLOR_ALPHA, alloc.width, alloc.height)
+            self.draw_keyboard(cairo.Context(self.surface))
+            self.surface_key = key
+
+        cr.set_source_surface(self.surface, 0, 0)
+        cr.paint()
+
+    def draw_keyboard(self, cr):
+        """ Draws the keyboard keys and their characters """
         # alloc = self.get_allocation()
         # real_width = alloc.width
         # real_height = alloc.height
@@ -251,6 +266,10 @@ class KeyboardWidget(Gtk.DrawingArea):
         # Use this to show real widget size (useful when debugging this widget)
         # cr.rectangle(0, 0, real_width, real_height)
 
+        # Font faces are shared by all keys
+        regular_face = cairo.ToyFontFace(self.font, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+        shift_face = cairo.ToyFontFace(self.font, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+
         def draw_row(row, sx, sy, last_end=False):
             x = sx
             y = sy
@@ -271,7 +290,7 @@ class KeyboardWidget(Gtk.DrawingArea):
                 if len(self.codes) > 0:
                     # Draw lower character
                     cr.set_source_rgb(1.0, 1.0, 1.0)
-                    cr.select_font_face(self.font, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+                    cr.set_font_face(regular_face)
                     cr.set_font_size(10)
                     cr.move_to(px, py)
                     cr.show_text(self.regular_text(k))
@@ -281,7 +300,7 @@ class KeyboardWidget(Gtk.DrawingArea):
 
                     # Draw upper character
                     cr.set_source_rgb(0.82, 0.82, 0.82)
-                    cr.select_font_face(self.font, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+                    cr.set_font_face(shift_face)
                     cr.set_font_size(8)
                     cr.move_to(px, py)
                     cr.show_text(self.shift_text(k))
@@ -394,37 +413,15 @@ class KeyboardWidget(Gtk.DrawingArea):
         if self.layout is None:
             return
 
-        variant_param = ""
-        if self.variant:
-            variant_param = "-variant {0}".format(self.variant)
+        self.codes = keycodes.get_cache().get(self.layout, self.variant)
+        # The codes may differ for the same layout (a failed ckbcomp run
+        # isn't cached), so render the keyboard again
+        self.surface_key = None
 
-        cmd = "/usr/bin/ckbcomp -model pc106 -layout {0} {1} -compact".format(self.layout,
-                                                                                              variant_param)
-
-        pipe = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=None)
-        cfile = pipe.communicate()[0].decode("utf-8").split('\n')
-
-        # Clear current codes
-        del self.codes[:]
-
-        for line in cfile:
-            if line[:7] != "keycode":
-                continue
-
-            codes = line.split('=')[1].strip().split(' ')
-
-            plain = unicode_to_string(codes[0])
-            shift = unicode_to_string(codes[1])
-            ctrl = unicode_to_string(codes[2])
-            alt = unicode_to_string(codes[3])
-
-            if ctrl == plain:
-                ctrl = ""
-
-            if alt == plain:
-                alt = ""
-
-            self.codes.append((plain, shift, ctrl, alt))
+    @staticmethod
+    def prefetch(layouts):
+        """ Loads the keycodes of layouts (a list of (layout, variant)) in the background """
+        keycodes.get_cache().prefetch(layouts)
 
 
 GObject.type_register(KeyboardWidget)
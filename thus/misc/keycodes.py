@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  keycodes.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Keycode tables of keyboard layouts (from ckbcomp), cached in memory and
+    on disk and loaded in advance by a worker thread """
+
+import os
+import json
+import logging
+import threading
+import subprocess
+from collections import deque
+
+CKBCOMP = "/usr/bin/ckbcomp"
+MODEL = "pc106"
+CACHE_DIR = "/var/cache/thus/keycodes"
+
+
+def unicode_to_string(raw):
+    """ U+ , or +U+ ... to string """
+    if raw[0:2] == "U+":
+        return chr(int(raw[2:], 16))
+    elif raw[0:2] == "+U":
+        return chr(int(raw[3:], 16))
+    return ""
+
+
+def parse_ckbcomp(output):
+    """ Returns a (plain, shift, ctrl, alt) tuple for each keycode line """
+    codes = []
+    for line in output.split('\n'):
+        if line[:7] != "keycode":
+            continue
+
+        values = line.split('=')[1].strip().split(' ')
+
+        plain = unicode_to_string(values[0])
+        shift = unicode_to_string(values[1])
+        ctrl = unicode_to_string(values[2])
+        alt = unicode_to_string(values[3])
+
+        if ctrl == plain:
+            ctrl = ""
+
+        if alt == plain:
+            alt = ""
+
+        codes.append((plain, shift, ctrl, alt))
+    return codes
+
+
+def run_ckbcomp(model, layout, variant):
+    """ Runs ckbcomp and returns its keycode table """
+    cmd = [CKBCOMP, "-model", model, "-layout", layout]
+    if variant:
+        cmd.extend(["-variant", variant])
+    cmd.append("-compact")
+
+    try:
+        output = subprocess.check_output(cmd).decode("utf-8", "replace")
+    except (OSError, subprocess.CalledProcessError) as err:
+        logging.warning("Can't get the keycodes of layout %s (variant %s): %s", layout, variant, err)
+        return []
+    return parse_ckbcomp(output)
+
+
+class KeycodeCache(object):
+    """ Keycode tables keyed by (model, layout, variant). Tables are kept in
+        memory and stored in cache_dir, so the same layout never runs ckbcomp
+        twice (disk entries are discarded if ckbcomp changes) """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.tables = {}
+        self.lock = threading.Lock()
+        # Keys waiting for the worker thread
+        self.pending = deque()
+        self.worker = None
+
+        try:
+            self.ckbcomp_mtime = os.path.getmtime(CKBCOMP)
+        except OSError:
+            self.ckbcomp_mtime = 0
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, "{0}_{1}_{2}.json".format(*key))
+
+    def read(self, key):
+        """ Reads a table from disk (None if not cached) """
+        try:
+            with open(self.get_path(key)) as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if entry.get('ckbcomp_mtime') != self.ckbcomp_mtime:
+            return None
+        return [tuple(codes) for codes in entry.get('codes', [])]
+
+    def write(self, key, codes):
+        """ Stores a table on disk (atomically, a reader never sees half of it) """
+        path = self.get_path(key)
+        tmp_path = "{0}.{1}".format(path, threading.get_ident())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'w') as cache_file:
+                json.dump({'ckbcomp_mtime': self.ckbcomp_mtime, 'codes': codes}, cache_file)
+            os.replace(tmp_path, path)
+        except OSError as err:
+            logging.debug("Can't store keycodes in %s: %s", path, err)
+
+    def get(self, layout, variant="", model=MODEL):
+        """ Returns the keycode table of a layout """
+        key = (model, layout, variant or "")
+        with self.lock:
+            if key in self.tables:
+                return self.tables[key]
+
+        codes = self.read(key)
+        if codes is None:
+            codes = run_ckbcomp(*key)
+            if codes:
+                self.write(key, codes)
+
+        if codes:
+            # A failed ckbcomp run is tried again next time
+            with self.lock:
+                self.tables[key] = codes
+        return codes
+
+    def prefetch(self, layouts, model=MODEL):
+        """ Loads the tables of layouts, a list of (layout, variant), in a worker thread """
+        with self.lock:
+            # The last requested layouts are the most likely to be needed soon
+            for layout, variant in reversed(layouts):
+                key = (model, layout, variant or "")
+                if key in self.pending:
+                    self.pending.remove(key)
+                if key not in self.tables:
+                    self.pending.appendleft(key)
+
+            if self.pending and self.worker is None:
+                self.worker = threading.Thread(target=self.run_worker, daemon=True)
+                self.worker.start()
+
+    def run_worker(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.worker = None
+                    return
+                (model, layout, variant) = self.pending.popleft()
+            self.get(layout, variant, model)
+
+
+_cache = None
+
+
+def get_cache():
+    """ Returns the keycode cache shared by all keyboard widgets """
+    global _cache
+    if _cache is None:
+        _cache = KeycodeCache()
+    return _cache
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  locale_index.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Index of the locales we offer (locales.xml) with their language and
+    country names (iso3366-1.xml). It is built once per process """
+
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import xml.etree.cElementTree as eTree
+except ImportError:
+    import xml.etree.ElementTree as eTree
+
+
+def get_language_code(locale_name):
+    """ es_ES.UTF-8 -> es """
+    return locale_name.split(".")[0].split("@")[0].split("_")[0]
+
+
+class LocaleIndex(object):
+    """ Maps each locale to its area name ("Spanish (ES), Spain") and each
+        language code to its locales """
+
+    def __init__(self, locales_path, countries_path):
+        # locale name -> area name (in locales.xml order)
+        self.areas = OrderedDict()
+        # language code -> locale names
+        self.by_language = {}
+
+        for child in eTree.parse(locales_path).getroot().iter("language"):
+            language_name = child.findtext("language_name") or ""
+            locale_name = child.findtext("locale_name") or ""
+            if locale_name and language_name:
+                self.areas[locale_name] = language_name
+
+        countries = [(child.attrib['value'], child.text) for child in eTree.parse(countries_path).getroot()]
+
+        for locale_name, language_name in self.areas.items():
+            # Add the name of the countries whose code appears in the language name
+            names = [name for (code, name) in countries if code in language_name]
+            self.areas[locale_name] = ", ".join([language_name] + names)
+            self.by_language.setdefault(get_language_code(locale_name), []).append(locale_name)
+
+    def get_locales(self, lang_code):
+        """ Returns the locales of a language code (es, pt_BR...) """
+        locales = self.by_language.get(get_language_code(lang_code), [])
+        if "_" in lang_code:
+            # Only the locales of that variant of the language
+            locales = [name for name in locales if name.startswith(lang_code)]
+        return locales
+
+    def get_areas(self, lang_code=None):
+        """ Returns the area names of a language code (all of them if None) """
+        if lang_code is None:
+            return list(self.areas.values())
+        return [self.areas[name] for name in self.get_locales(lang_code)]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(data_dir):
+    """ Returns the locale index of the locale files in data_dir """
+    with _indexes_lock:
+        if data_dir not in _indexes:
+            _indexes[data_dir] = LocaleIndex(
+                os.path.join(data_dir, "locale", "locales.xml"),
+                os.path.join(data_dir, "locale", "iso3366-1.xml"))
+        return _indexes[data_dir]
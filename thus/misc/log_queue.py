@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  log_queue.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Logging through a queue, so logging never waits for the disk.
+
+    Loggers of every process (the installation process is forked from the
+    main one and inherits the root logger) only put records in a bounded
+    multiprocessing queue. A single thread of the main process writes them
+    to /tmp/thus.log (and stdout). If the writer can't keep up, records are
+    dropped (and counted) instead of blocking the caller. """
+
+import os
+import gzip
+import queue
+import shutil
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+
+LOG_PATH = "/tmp/thus.log"
+
+# Records waiting to be written (bounds the memory used by logging)
+QUEUE_SIZE = 10000
+
+# Seconds to wait for the writer in flush()
+FLUSH_TIMEOUT = 10
+
+_queue = None
+_listener = None
+_flushed = None
+# The process that writes the log
+_writer_pid = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ Puts records in the queue without ever blocking. Records that don't
+        fit are dropped and reported in the log once there is room again """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        if self.dropped > 0:
+            msg = "{0} log messages were dropped (the log writer was too slow)".format(self.dropped)
+            warning = logging.makeLogRecord({'name': record.name, 'module': 'log_queue',
+                                             'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                             'msg': msg})
+            try:
+                self.queue.put_nowait(warning)
+                self.dropped = 0
+            except queue.Full:
+                pass
+
+
+class LogWriter(logging.handlers.QueueListener):
+    """ Writes the records of all processes (the only writer of the log) """
+
+    def handle(self, record):
+        if getattr(record, 'flush_marker', False):
+            # Everything queued before the marker has been written
+            for handler in self.handlers:
+                handler.flush()
+            _flushed.set()
+            return
+        super().handle(record)
+
+    def stop(self, timeout=FLUSH_TIMEOUT):
+        """ Writes the records still queued and stops the writer thread.
+            Gives up after timeout seconds (the queue may be full), so
+            exiting never hangs here. Returns False if it has given up """
+        if self._thread is None:
+            return True
+        try:
+            self.queue.put(self._sentinel, timeout=timeout)
+        except queue.Full:
+            return False
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        self._thread = None
+        return True
+
+
+def setup(handlers, level):
+    """ Makes the root logger send its records through the queue to handlers
+        (written by a thread of this process) """
+    global _queue, _listener, _flushed, _writer_pid
+
+    logger = logging.getLogger()
+
+    _queue = multiprocessing.Queue(QUEUE_SIZE)
+    _flushed = multiprocessing.Event()
+    _listener = LogWriter(_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _writer_pid = os.getpid()
+    # Write what is still queued when Thus exits normally
+    atexit.register(shutdown)
+
+    queue_handler = DroppingQueueHandler(_queue)
+    queue_handler.setLevel(level)
+    logger.addHandler(queue_handler)
+
+
+def flush(timeout=FLUSH_TIMEOUT):
+    """ Waits until the records logged so far (by any process) are written.
+        Returns False if the writer doesn't answer in time """
+    if _queue is None:
+        return True
+    _flushed.clear()
+    marker = logging.makeLogRecord({'flush_marker': True})
+    try:
+        _queue.put(marker, timeout=timeout)
+    except queue.Full:
+        return False
+    return _flushed.wait(timeout)
+
+
+def shutdown():
+    """ Writes the pending records. Call it before os._exit() """
+    global _listener
+    if _queue is None:
+        return
+    if os.getpid() == _writer_pid:
+        if _listener is not None:
+            # Write everything still in the queue and stop
+            if _listener.stop():
+                for handler in _listener.handlers:
+                    handler.flush()
+            _listener = None
+            # Nobody reads the queue anymore, don't wait for it at exit
+            _queue.cancel_join_thread()
+    else:
+        # Installation process: send the records still buffered here
+        flush()
+
+
+def archive(dest_path, compress=False):
+    """ Copies the log to dest_path (gzip compressed if compress) """
+    flush()
+    if compress:
+        dest_path += ".gz"
+        with open(LOG_PATH, 'rb') as log_file, gzip.open(dest_path, 'wb') as archive_file:
+            shutil.copyfileobj(log_file, archive_file)
+    else:
+        shutil.copy(LOG_PATH, dest_path)
+    return dest_path
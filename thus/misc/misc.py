@@ -30,11 +30,11 @@ import syslog
 import socket
 import locale
 import logging
-import dbus
 import urllib
 from socket import timeout
 
 import misc.osextras as osextras
+import misc.partition_index as partition_index
 
 NM = 'org.freedesktop.NetworkManager'
 NM_STATE_CONNECTED_GLOBAL = 70
@@ -828,6 +828,8 @@ def set_indicator_keymaps(lang):
 
 
 def get_prop(obj, iface, prop):
+    # dbus is only needed here, don't load it with this module
+    import dbus
     try:
         return obj.Get(iface, prop, dbus_interface=dbus.PROPERTIES_IFACE)
     except (dbus.DBusException, dbus.exceptions.DBusException) as err:
@@ -838,12 +840,14 @@ def get_prop(obj, iface, prop):
 
 
 def is_wireless_enabled():
+    import dbus
     bus = dbus.SystemBus()
     manager = bus.get_object(NM, '/org/freedesktop/NetworkManager')
     return get_prop(manager, NM, 'WirelessEnabled')
 
 
 def get_nm_state():
+    import dbus
     try:
         bus = dbus.SystemBus()
         manager = bus.get_object(NM, '/org/freedesktop/NetworkManager')
@@ -870,6 +874,8 @@ def has_connection():
 
 
 def add_connection_watch(func):
+    import dbus
+
     def connection_cb(state):
         func(state == NM_STATE_CONNECTED_GLOBAL)
 
@@ -1014,60 +1020,18 @@ def set_cursor(cursor_type):
 
 def partition_exists(partition):
     """ Check if a partition already exists """
-    if "/dev/" in partition:
-        partition = partition[len("/dev/"):]
-
-    exists = False
-    with open("/proc/partitions") as partitions:
-        if partition in partitions.read():
-            exists = True
-    return exists
+    return partition_index.get_index().exists(partition)
 
 
 def is_partition_extended(partition):
     """ Check if a partition is of extended type """
-
-    if "/dev/mapper" in partition:
-        return False
-
-    if "/dev/" in partition:
-        partition = partition[len("/dev/"):]
-
-    num = partition[len("sdX"):]
-    if len(num) == 0:
-        return False
-
-    try:
-        num = int(num)
-    except ValueError as err:
-        logging.warning(err)
-        return False
-
-    if num > 4:
-        # logical partition
-        return False
-
-    with open("/proc/partitions") as partitions:
-        lines = partitions.readlines()
-    for line in lines:
-        if "major" not in line:
-            info = line.split()
-            if len(info) > 0 and info[2] == '1' and info[3] == partition:
-                return True
-    return False
+    return partition_index.get_index().is_extended(partition)
 
 
 def get_partitions():
-    partitions_list = []
-    with open("/proc/partitions") as partitions:
-        lines = partitions.readlines()
-    for line in lines:
-        if "major" not in line:
-            info = line.split()
-            if len(info) > 0:
-                if len(info[3]) > len("sdX") and "loop" not in info[3]:
-                    partitions_list.append("/dev/" + info[3])
-    return partitions_list
+    """ Returns all partitions (except those of loop devices) """
+    partitions = partition_index.get_index().get_partitions()
+    return [partition for partition in partitions if "loop" not in partition]
 
 
 class InstallError(Exception):
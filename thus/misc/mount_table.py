@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  mount_table.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Mount table (from /proc/self/mountinfo) and unmount / swapoff helpers
+    that call the kernel directly instead of spawning umount and swapoff """
+
+import os
+import re
+import errno
+import ctypes
+import ctypes.util
+import logging
+
+MOUNTINFO = "/proc/self/mountinfo"
+SWAPS = "/proc/swaps"
+
+# umount2 flags (sys/mount.h)
+MNT_DETACH = 2
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+
+def unescape(field):
+    """ The kernel escapes spaces, tabs, newlines and backslashes as octal sequences """
+    return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), field)
+
+
+class MountEntry(object):
+    """ One line of /proc/self/mountinfo (see proc(5)) """
+
+    def __init__(self, line):
+        fields = line.split()
+        # Optional fields end with a single "-"
+        separator = fields.index("-")
+
+        self.mount_id = int(fields[0])
+        self.parent_id = int(fields[1])
+        self.major_minor = fields[2]
+        self.root = unescape(fields[3])
+        self.mount_point = unescape(fields[4])
+        self.options = fields[5]
+        self.fs_type = fields[separator + 1]
+        self.source = unescape(fields[separator + 2])
+        self.children = []
+
+    def is_under(self, path):
+        """ True if this mount point is path or is inside it """
+        path = path.rstrip("/") or "/"
+        return (self.mount_point == path or path == "/" or
+                self.mount_point.startswith(path + "/"))
+
+
+class MountTable(object):
+    """ Tree of all mounts seen by this process """
+
+    def __init__(self, mountinfo=MOUNTINFO):
+        self.entries = []
+        self.by_id = {}
+
+        with open(mountinfo) as mountinfo_file:
+            for line in mountinfo_file:
+                if line.strip():
+                    entry = MountEntry(line)
+                    self.entries.append(entry)
+                    self.by_id[entry.mount_id] = entry
+
+        for entry in self.entries:
+            parent = self.by_id.get(entry.parent_id)
+            if parent is not None and parent is not entry:
+                parent.children.append(entry)
+
+    def get_mounted_devices(self):
+        """ Returns a dict with the first mount point of each mounted block device """
+        mounted = {}
+        for entry in self.entries:
+            if entry.source.startswith("/dev/"):
+                device = os.path.realpath(entry.source)
+                if device not in mounted:
+                    mounted[device] = entry.mount_point
+        return mounted
+
+    def get_unmount_order(self, path):
+        """ Returns all mount points under path (path included), deepest first.
+            Mounts stacked on the same directory are listed top first """
+        def is_top(entry):
+            parent = self.by_id.get(entry.parent_id)
+            return parent is None or parent is entry or not parent.is_under(path)
+
+        roots = [entry for entry in self.entries if entry.is_under(path) and is_top(entry)]
+
+        order = []
+        # Iterative post-order walk (children before their parent)
+        for root in roots:
+            stack = [(root, False)]
+            while stack:
+                entry, visited = stack.pop()
+                if visited:
+                    order.append(entry.mount_point)
+                else:
+                    stack.append((entry, True))
+                    for child in entry.children:
+                        stack.append((child, False))
+        return order
+
+
+def umount(path, lazy=True):
+    """ Unmounts path with umount2. If it is busy and lazy is True, it is
+        detached (as umount -l does). Returns True on success """
+    path_bytes = os.fsencode(path)
+    if _libc.umount2(path_bytes, 0) == 0:
+        return True
+
+    err = ctypes.get_errno()
+    if err == errno.EBUSY and lazy:
+        logging.debug("Can't unmount %s. Detaching it (lazy unmount).", path)
+        if _libc.umount2(path_bytes, MNT_DETACH) == 0:
+            return True
+        err = ctypes.get_errno()
+
+    if err in (errno.EINVAL, errno.ENOENT):
+        # Not mounted (anymore)
+        return True
+
+    logging.warning(_("Unable to umount {0}: {1}").format(path, os.strerror(err)))
+    return False
+
+
+def unmount_trees(paths):
+    """ Unmounts everything mounted under each path in paths (deepest first).
+        The mount table is read only once. Returns True if all went well """
+    table = MountTable()
+    all_ok = True
+    for path in paths:
+        for mount_point in table.get_unmount_order(path):
+            logging.debug(_("Unmounting {0}".format(mount_point)))
+            all_ok = umount(mount_point) and all_ok
+    return all_ok
+
+
+def unmount_tree(path):
+    """ Unmounts path and everything mounted under it """
+    return unmount_trees([path])
+
+
+def get_active_swaps():
+    """ Returns the devices (or files) listed in /proc/swaps """
+    swaps = []
+    try:
+        with open(SWAPS) as swaps_file:
+            # Skip header
+            next(swaps_file, None)
+            for line in swaps_file:
+                fields = line.split()
+                if fields:
+                    swaps.append(unescape(fields[0]))
+    except OSError as err:
+        logging.warning(_("Can't read {0}: {1}").format(SWAPS, err))
+    return swaps
+
+
+def swapoff_all(exclude=("/dev/zram",)):
+    """ Disables all active swaps in one pass (except those whose
+        name starts with any of the exclude prefixes) """
+    all_ok = True
+    for name in get_active_swaps():
+        if name.startswith(tuple(exclude)):
+            continue
+        if _libc.swapoff(os.fsencode(name)) != 0:
+            err = ctypes.get_errno()
+            logging.warning(_("Can't disable swap in {0}: {1}").format(name, os.strerror(err)))
+            all_ok = False
+        else:
+            logging.debug(_("Swap in {0} disabled").format(name))
+    return all_ok
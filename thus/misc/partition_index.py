@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  partition_index.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Index of block devices and partitions built from sysfs """
+
+import os
+import threading
+
+SYS_BLOCK = "/sys/class/block"
+
+# Incremented by the kernel with every uevent (a partition table change sends some)
+UEVENT_SEQNUM = "/sys/kernel/uevent_seqnum"
+
+
+def read_sysfs_int(path, default=0):
+    """ Reads an integer value from sysfs """
+    try:
+        with open(path) as sysfs_file:
+            return int(sysfs_file.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def device_to_name(device):
+    """ /dev/sda1 -> sda1, /dev/cciss/c0d0p1 -> cciss!c0d0p1 (as named in sysfs) """
+    if device.startswith("/dev/"):
+        device = device[len("/dev/"):]
+    return device.replace("/", "!")
+
+
+def name_to_device(name):
+    """ sda1 -> /dev/sda1, cciss!c0d0p1 -> /dev/cciss/c0d0p1 """
+    return "/dev/" + name.replace("!", "/")
+
+
+def get_partition_path(disk, number):
+    """ Returns the device path of partition number in disk. Disks whose
+        name ends with a digit (nvme0n1, mmcblk0, loop0) use a 'p' separator """
+    if disk[-1].isdigit():
+        return "{0}p{1}".format(disk, number)
+    return "{0}{1}".format(disk, number)
+
+
+class PartitionInfo(object):
+    """ A partition as seen by the kernel. start and size are in 512-byte sectors """
+
+    def __init__(self, name, disk, number, start, size, extended):
+        self.name = name
+        self.path = name_to_device(name)
+        self.disk = disk
+        self.number = number
+        self.start = start
+        self.size = size
+        self.extended = extended
+
+
+class PartitionIndex(object):
+    """ Block devices and partitions found in /sys/class/block.
+        The index is rebuilt only when the kernel has sent new uevents
+        (or when invalidate is called), so queries are just dict lookups """
+
+    def __init__(self, sys_block=SYS_BLOCK):
+        self.sys_block = sys_block
+        self.devices = set()
+        self.partitions = {}
+        self.seqnum = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """ Forces a rebuild on the next query """
+        with self.lock:
+            self.seqnum = None
+
+    def refresh(self):
+        """ Rebuilds the index if block devices may have changed """
+        seqnum = read_sysfs_int(UEVENT_SEQNUM, -1)
+        with self.lock:
+            if self.seqnum is not None and seqnum == self.seqnum and seqnum != -1:
+                return
+            self.seqnum = seqnum
+            self.build()
+
+    def build(self):
+        """ Reads all block devices from sysfs """
+        self.devices = set()
+        self.partitions = {}
+
+        try:
+            names = os.listdir(self.sys_block)
+        except OSError:
+            names = []
+
+        for name in names:
+            self.devices.add(name)
+            path = os.path.join(self.sys_block, name)
+            number = read_sysfs_int(os.path.join(path, "partition"), 0)
+            if number <= 0:
+                continue
+
+            # A partition directory lives inside its disk directory
+            disk_name = os.path.basename(os.path.dirname(os.path.realpath(path)))
+            start = read_sysfs_int(os.path.join(path, "start"))
+            size = read_sysfs_int(os.path.join(path, "size"))
+
+            # The kernel exposes msdos extended partitions as a tiny device
+            # (1KiB, or one logical sector if bigger) that only holds the EBR
+            sector_size = read_sysfs_int(os.path.join(self.sys_block, disk_name, "queue/logical_block_size"), 512)
+            extended = number <= 4 and 0 < size <= max(2, sector_size // 512)
+
+            self.partitions[name] = PartitionInfo(
+                name, name_to_device(disk_name), number, start, size, extended)
+
+    def exists(self, device):
+        """ True if device (disk or partition) is known by the kernel """
+        self.refresh()
+        return device_to_name(device) in self.devices
+
+    def get_partition(self, device):
+        """ Returns the PartitionInfo of device (None if it is not a partition) """
+        self.refresh()
+        return self.partitions.get(device_to_name(device))
+
+    def is_extended(self, device):
+        """ True if device is an msdos extended partition """
+        partition = self.get_partition(device)
+        return partition is not None and partition.extended
+
+    def get_partitions(self):
+        """ Returns the paths of all partitions, ordered by disk and number """
+        self.refresh()
+        partitions = sorted(self.partitions.values(), key=lambda part: (part.disk, part.number))
+        return [part.path for part in partitions]
+
+
+# Shared by the whole process
+_index = PartitionIndex()
+
+
+def get_index():
+    """ Returns the process wide partition index """
+    return _index
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  profiler.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Profiling mode (thus --profile).
+
+    Records module imports, page construction and prepare() times and the
+    install phases in /tmp/thus-trace.json (Chrome trace format, open it in
+    chrome://tracing or https://ui.perfetto.dev). Each install phase is also
+    run under cProfile and dumped to /tmp/thus-profile-<phase>.prof (read it
+    with python -m pstats).
+
+    Events are appended to the trace one line at a time as they happen, so
+    the report is complete even if Thus exits with os._exit() and the
+    installation process (forked from the main one) can write to it too.
+    The trace format allows the final ']' to be missing. Only the standard
+    library is used here, so it can be imported before anything else. """
+
+import os
+import sys
+import json
+import time
+import builtins
+import threading
+import contextlib
+
+TRACE_PATH = "/tmp/thus-trace.json"
+PROFILE_PATH = "/tmp/thus-profile-{0}.prof"
+
+# File descriptor of the trace (None when profiling is off)
+_trace_fd = None
+_original_import = None
+
+
+def is_enabled():
+    return _trace_fd is not None
+
+
+def start(trace_path=TRACE_PATH):
+    """ Starts profiling. Call it as soon as possible to measure all imports """
+    global _trace_fd, _original_import
+    if _trace_fd is not None:
+        return
+    try:
+        _trace_fd = os.open(trace_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+    except OSError as err:
+        print("Can't open {0} : {1}".format(trace_path, err))
+        return
+    os.write(_trace_fd, b"[\n")
+
+    _original_import = builtins.__import__
+    builtins.__import__ = _timed_import
+
+
+def add_event(name, category, start_time, duration, args=None):
+    """ Appends a complete event (times in seconds, from time.perf_counter) """
+    if _trace_fd is None:
+        return
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': int(start_time * 1000000),
+        'dur': int(duration * 1000000),
+        'pid': os.getpid(),
+        'tid': threading.get_ident()}
+    if args:
+        event['args'] = args
+    line = json.dumps(event, default=str) + ",\n"
+    try:
+        # A single write with O_APPEND, lines from several threads or
+        # processes don't get mixed
+        os.write(_trace_fd, line.encode('utf-8'))
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    """ Records how long the block inside the with statement takes """
+    if _trace_fd is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_event(name, category, start_time, time.perf_counter() - start_time, args)
+
+
+def run_phase(name, function, *args, **kwargs):
+    """ Runs an install phase, recording it in the trace and dumping its
+        cProfile statistics to PROFILE_PATH """
+    if _trace_fd is None:
+        return function(*args, **kwargs)
+
+    import cProfile
+
+    profile = cProfile.Profile()
+    path = PROFILE_PATH.format(name)
+    with span(name, "install", profile=path):
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            try:
+                profile.dump_stats(path)
+            except OSError as err:
+                print("Can't write {0} : {1}".format(path, err))
+
+
+def get_process_uptime():
+    """ Returns the seconds since this process was started (including the
+        interpreter startup), None if /proc can't be read """
+    try:
+        with open("/proc/self/stat") as stat_file:
+            # Skip pid and (command name), which may contain spaces
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        # starttime is the 22nd field, in clock ticks since boot
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """ builtins.__import__ replacement that records modules loaded for the
+        first time (imports done inside them show up nested) """
+    if level != 0 or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    start_time = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        add_event(name, "import", start_time, time.perf_counter() - start_time)
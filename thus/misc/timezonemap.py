@@ -32,6 +32,7 @@ import os
 import math
 import sys
 import logging
+from collections import OrderedDict
 
 import gi
 gi.require_version('PangoCairo', '1.0')
@@ -39,11 +40,7 @@ gi.require_version('PangoCairo', '1.0')
 from gi.repository import GObject, GLib, Gdk, Gtk, GdkPixbuf, Pango, PangoCairo
 
 import misc.tz as tz
-
-try:
-    import xml.etree.cElementTree as elementTree
-except ImportError:
-    import xml.etree.ElementTree as elementTree
+import misc.tz_resolver as tz_resolver
 
 PIN_HOT_POINT_X = 8
 PIN_HOT_POINT_Y = 15
@@ -52,7 +49,6 @@ LOCATION_CHANGED = 0
 G_PI_4 = 0.78539816339744830961566084581987572104929234984378
 
 TIMEZONEMAP_IMAGES_PATH = "/usr/share/thus/data/images/timezonemap"
-OLSEN_MAP_TIMEZONES_PATH = "/usr/share/thus/data/locale/timezones.xml"
 
 BUBBLE_TEXT_FONT = "Sans 9"
 
@@ -97,6 +93,158 @@ color_codes = [
     (12.75, 254, 74, 100, 248),
     (13.0, 255, 85, 153, 250)]
 
+# Offset of each color of the color map, (red, green, blue, alpha) -> offset
+color_offsets = {(red, green, blue, alpha): offset for (offset, red, green, blue, alpha) in color_codes}
+
+# Sorted offsets that have a highlight image
+highlight_offsets = sorted(set(offset for (offset, red, green, blue, alpha) in color_codes))
+
+# Number of scaled highlight images kept in memory
+HIGHLIGHT_CACHE_SIZE = 8
+
+# Size (in pixels) of the cells of the location grid
+LOCATION_GRID_CELL_SIZE = 16
+
+
+class LocationGrid(object):
+    """ Uniform grid of the locations projected to map coordinates, so the
+        nearest location to a point can be found by looking only at the cells
+        around it. It is only valid for the map size it was built with """
+
+    def __init__(self, locations, width, height, project, cell_size=LOCATION_GRID_CELL_SIZE):
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.cells = {}
+
+        for location in locations:
+            x, y = project(location, width, height)
+            cell = self.cells.setdefault(self.get_cell(x, y), [])
+            cell.append((x, y, location))
+
+        if self.cells:
+            columns = [column for (column, row) in self.cells]
+            rows = [row for (column, row) in self.cells]
+            self.bounds = (min(columns), max(columns), min(rows), max(rows))
+        else:
+            self.bounds = None
+
+    def get_cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def get_ring(self, column, row, radius):
+        """ Yields the cells at radius cells from (column, row) """
+        if radius == 0:
+            yield column, row
+            return
+        for delta in range(-radius, radius + 1):
+            yield column + delta, row - radius
+            yield column + delta, row + radius
+        for delta in range(-radius + 1, radius):
+            yield column - radius, row + delta
+            yield column + radius, row + delta
+
+    def get_nearest(self, x, y):
+        """ Returns the location nearest to (x, y) (None if there are none) """
+        if self.bounds is None:
+            return None
+
+        column, row = self.get_cell(x, y)
+        (min_column, max_column, min_row, max_row) = self.bounds
+        max_radius = max(column - min_column, max_column - column, row - min_row, max_row - row)
+
+        nearest = None
+        small_dist = -1
+
+        for radius in range(max_radius + 1):
+            for cell in self.get_ring(column, row, radius):
+                for (pointx, pointy, location) in self.cells.get(cell, []):
+                    dx = pointx - x
+                    dy = pointy - y
+                    dist = dx * dx + dy * dy
+                    if small_dist == -1 or dist < small_dist:
+                        nearest = location
+                        small_dist = dist
+            # Locations in outer rings are at least radius cells away
+            reach = radius * self.cell_size
+            if nearest is not None and small_dist <= reach * reach:
+                break
+
+        return nearest
+
+
+class HighlightCache(object):
+    """ Keeps the last used highlight images, already scaled to the map size,
+        so redraws don't have to load and scale them again. The neighbours of
+        the last requested offset are loaded when the main loop is idle """
+
+    def __init__(self, max_size=HIGHLIGHT_CACHE_SIZE):
+        self.max_size = max_size
+        # (offset, sensitive, width, height) -> pixbuf (None if it can't be loaded)
+        self.items = OrderedDict()
+        self.prefetch_queue = []
+        self.prefetch_id = None
+
+    def get(self, offset, sensitive, width, height):
+        """ Returns the scaled highlight pixbuf of offset """
+        key = (offset, sensitive, width, height)
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        highlight = self.load(*key)
+        self.add(key, highlight)
+        return highlight
+
+    def add(self, key, highlight):
+        self.items[key] = highlight
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    @staticmethod
+    def load(offset, sensitive, width, height):
+        """ Loads a highlight image from disk and scales it """
+        if sensitive:
+            filename = "timezone_%g.png" % offset
+        else:
+            filename = "timezone_%g_dim.png" % offset
+
+        path = os.path.join(TIMEZONEMAP_IMAGES_PATH, filename)
+        try:
+            orig_highlight = GdkPixbuf.Pixbuf.new_from_file(path)
+        except GLib.Error as err:
+            logging.warning("Can't load %s image file: %s", path, err)
+            return None
+
+        return orig_highlight.scale_simple(width, height, GdkPixbuf.InterpType.BILINEAR)
+
+    def prefetch(self, offset, sensitive, width, height):
+        """ Loads the highlights of the offsets next to offset in the background """
+        if offset not in highlight_offsets:
+            return
+        index = highlight_offsets.index(offset)
+        for neighbour in highlight_offsets[max(0, index - 1):index + 2]:
+            key = (neighbour, sensitive, width, height)
+            if key not in self.items and key not in self.prefetch_queue:
+                self.prefetch_queue.append(key)
+        if self.prefetch_queue and self.prefetch_id is None:
+            self.prefetch_id = GLib.idle_add(self.on_prefetch)
+
+    def on_prefetch(self):
+        """ Loads one queued highlight (called when the main loop is idle) """
+        if self.prefetch_queue:
+            key = self.prefetch_queue.pop(0)
+            if key not in self.items:
+                self.add(key, self.load(*key))
+        if self.prefetch_queue:
+            return True
+        self.prefetch_id = None
+        return False
+
+    def clear(self):
+        """ Forgets all highlights (the map size has changed) """
+        self.items.clear()
+        self.prefetch_queue = []
+
 
 class TimezoneMap(Gtk.Widget):
     __gtype_name__ = 'TimezoneMap'
@@ -110,7 +258,9 @@ class TimezoneMap(Gtk.Widget):
 
         self._background = None
         self._color_map = None
-        self._olsen_map = None
+        self._color_map_pixels = None
+        self._location_grid = None
+        self._highlights = HighlightCache()
 
         self._selected_offset = 0.0
         self._show_offset = False
@@ -119,9 +269,6 @@ class TimezoneMap(Gtk.Widget):
 
         self._bubble_text = ""
 
-        self.olsen_map_timezones = []
-        self.load_olsen_map_timezones()
-
         try:
             self._orig_background = GdkPixbuf.Pixbuf.new_from_file(
                 os.path.join(TIMEZONEMAP_IMAGES_PATH, "bg.png"))
@@ -132,9 +279,6 @@ class TimezoneMap(Gtk.Widget):
             self._orig_color_map = GdkPixbuf.Pixbuf.new_from_file(
                 os.path.join(TIMEZONEMAP_IMAGES_PATH, "cc.png"))
 
-            self._olsen_map = GdkPixbuf.Pixbuf.new_from_file(
-                os.path.join(TIMEZONEMAP_IMAGES_PATH, "olsen_map.png"))
-
             self._pin = GdkPixbuf.Pixbuf.new_from_file(
                 os.path.join(TIMEZONEMAP_IMAGES_PATH, "pin.png"))
         except Exception as err:
@@ -143,17 +287,6 @@ class TimezoneMap(Gtk.Widget):
 
         self.tzdb = tz.Database()
 
-    def load_olsen_map_timezones(self):
-        try:
-            tree = elementTree.parse(OLSEN_MAP_TIMEZONES_PATH)
-            self.olsen_map_timezones = []
-            root = tree.getroot()
-            for tz_name in root.iter("timezone_name"):
-                self.olsen_map_timezones.append(tz_name.text)
-        except FileNotFoundError as err:
-            logging.error(err)
-            print(err)
-
     def do_get_preferred_width(self):
         """ Retrieves a widget’s initial minimum and natural width. """
         width = self._orig_background.get_width()
@@ -179,8 +312,12 @@ class TimezoneMap(Gtk.Widget):
     def do_size_allocate(self, allocation):
         """ The do_size_allocate is called by when the actual size is known
          and the widget is told how much space could actually be allocated """
+        old_allocation = self.get_allocation()
         self.set_allocation(allocation)
 
+        if old_allocation.width != allocation.width or old_allocation.height != allocation.height:
+            self._highlights.clear()
+
         if self._background is not None:
             del self._background
             self._background = None
@@ -205,8 +342,11 @@ class TimezoneMap(Gtk.Widget):
             allocation.height,
             GdkPixbuf.InterpType.BILINEAR)
 
-        # self._visible_map_pixels = self._color_map.get_pixels()
-        # self._visible_map_rowstride = self._color_map.get_rowstride()
+        # get_pixels returns a copy, so get it once per size
+        self._color_map_pixels = self._color_map.get_pixels()
+
+        # Locations are projected again only if the size has changed
+        self.get_location_grid()
 
         if self.get_realized():
             self.get_window().move_resize(
@@ -313,30 +453,18 @@ class TimezoneMap(Gtk.Widget):
         # Paint highlight
         offset = self._selected_offset
 
-        if self.is_sensitive():
-            filename = "timezone_%g.png" % offset
-        else:
-            filename = "timezone_%g_dim.png" % offset
+        sensitive = self.is_sensitive()
+        highlight = self._highlights.get(offset, sensitive, alloc.width, alloc.height)
 
-        path = os.path.join(TIMEZONEMAP_IMAGES_PATH, filename)
-        try:
-            orig_highlight = GdkPixbuf.Pixbuf.new_from_file(path)
-        except Exception as err:
-            print("Can't load {0} image file".format(path))
-            print(err)
-            return
+        # The user will likely click near the current zone
+        self._highlights.prefetch(offset, sensitive, alloc.width, alloc.height)
 
-        highlight = orig_highlight.scale_simple(
-            alloc.width,
-            alloc.height,
-            GdkPixbuf.InterpType.BILINEAR)
+        if highlight is None:
+            return
 
         Gdk.cairo_set_source_pixbuf(cr, highlight, 0, 0)
         cr.paint()
 
-        del highlight
-        del orig_highlight
-
         if self._tz_location:
             longitude = self._tz_location.get_property('longitude')
             latitude = self._tz_location.get_property('latitude')
@@ -384,49 +512,30 @@ class TimezoneMap(Gtk.Widget):
             self._selected_offset = 0.0
 
     def get_loc_for_xy(self, x, y):
-        rowstride = self._color_map.get_rowstride()
-        pixels = self._color_map.get_pixels()
-
-        my_red = pixels[int(rowstride * y + x * 4)]
-        my_green = pixels[int(rowstride * y + x * 4) + 1]
-        my_blue = pixels[int(rowstride * y + x * 4) + 2]
-        my_alpha = pixels[int(rowstride * y + x * 4) + 3]
-
-        for color_code in color_codes:
-            (offset, red, green, blue, alpha) = color_code
-            if red == my_red and green == my_green and blue == my_blue and alpha == my_alpha:
-                self._selected_offset = offset
-                break
+        if self._color_map is not None:
+            rowstride = self._color_map.get_rowstride()
+            n_channels = self._color_map.get_n_channels()
+            pos = rowstride * int(y) + int(x) * n_channels
+            color = tuple(self._color_map_pixels[pos:pos + 4]) if pos >= 0 else None
+            if color in color_offsets:
+                self._selected_offset = color_offsets[color]
 
         self.queue_draw()
 
-        # Work out the co-ordinates
-        allocation = self.get_allocation()
-        width = allocation.width
-        height = allocation.height
-
-        nearest_tz_location = None
-
-        # Impossible distance
-        small_dist = -1
-
-        for tz_location in self.tzdb.get_locations():
-            longitude = tz_location.get_property('longitude')
-            latitude = tz_location.get_property('latitude')
+        return self.get_location_grid().get_nearest(x, y)
 
-            pointx = self.convert_longitude_to_x(longitude, width)
-            pointy = self.convert_latitude_to_y(latitude, height)
-
-            dx = pointx - x
-            dy = pointy - y
-
-            dist = dx * dx + dy * dy
-
-            if small_dist == -1 or dist < small_dist:
-                nearest_tz_location = tz_location
-                small_dist = dist
-
-        return nearest_tz_location
+    def get_location_grid(self):
+        """ Returns the location grid of the current size (building it if needed) """
+        allocation = self.get_allocation()
+        grid = self._location_grid
+        if grid is None or grid.width != allocation.width or grid.height != allocation.height:
+            grid = LocationGrid(
+                self.tzdb.get_locations(),
+                allocation.width,
+                allocation.height,
+                self.project_location)
+            self._location_grid = grid
+        return grid
 
     def do_button_press_event(self, event):
         """ The button press event virtual method """
@@ -476,31 +585,26 @@ class TimezoneMap(Gtk.Widget):
         return self._tz_location
 
     def get_timezone_at_coords(self, latitude, longitude):
-        x = int(2048.0 / 360.0 * (180.0 + longitude))
-        y = int(1024.0 / 180.0 * (90.0 - latitude))
-
-        olsen_map_channels = self._olsen_map.get_n_channels()
-        olsen_map_rowstride = self._olsen_map.get_rowstride()
-        olsen_map_pixels = self._olsen_map.get_pixels()
-
-        zone = -1
-        offset = olsen_map_rowstride * y + x * olsen_map_channels
+        zone = tz_resolver.get_timezone_at_coords(latitude, longitude)
+        if zone is not None:
+            return zone
 
-        if offset < len(olsen_map_pixels):
-            color0 = olsen_map_pixels[offset]
-            color1 = olsen_map_pixels[offset + 1]
-            zone = ((color0 & 248) << 1) + ((color1 >> 4) & 15)
+        # Timezone map not available, use the nearest location
+        alloc = self.get_allocation()
+        x = self.convert_longitude_to_x(longitude, alloc.width)
+        y = self.convert_latitude_to_y(latitude, alloc.height)
+        location = self.get_loc_for_xy(x, y)
+        if location is None:
+            return None
+        return location.get_property('zone')
 
-        if 0 <= zone < len(self.olsen_map_timezones):
-            city = self.olsen_map_timezones[zone]
-            return city
-        else:
-            alloc = self.get_allocation()
-            x = self.convert_longitude_to_x(longitude, alloc.width)
-            y = self.convert_latitude_to_y(latitude, alloc.height)
-            location = self.get_loc_for_xy(x, y)
-            zone = location.get_property('zone')
-            return zone
+    @staticmethod
+    def project_location(tz_location, width, height):
+        """ Returns the map coordinates of a location """
+        longitude = tz_location.get_property('longitude')
+        latitude = tz_location.get_property('latitude')
+        return (TimezoneMap.convert_longitude_to_x(longitude, width),
+                TimezoneMap.convert_latitude_to_y(latitude, height))
 
     @staticmethod
     def convert_longitude_to_x(longitude, map_width):
@@ -25,133 +25,97 @@ from __future__ import print_function
 
 import os
 import datetime
-import time
-import xml.dom.minidom
+import calendar
+import xml.etree.ElementTree as ElementTree
 import hashlib
 import sys
 import logging
 
 from gi.repository import GObject
 
-TZ_DATA_FILE = '/usr/share/zoneinfo/zone.tab'
+import misc.tzfile as tzfile
+
+TZ_DIR = '/usr/share/zoneinfo'
+TZ_DATA_FILE = os.path.join(TZ_DIR, 'zone.tab')
 ISO_3166_FILE = '/usr/share/xml/iso-codes/iso_3166.xml'
 
 
-def _seconds_since_epoch(dt):
-    # TODO cjwatson 2006-02-23: %s escape is not portable
-    return int(dt.replace(tzinfo=None).strftime('%s'))
+def _local_seconds(dt):
+    """ Seconds since the epoch of dt's wall clock time (as if it was UTC) """
+    return calendar.timegm(dt.replace(tzinfo=None).timetuple())
+
+
+_UTC = tzfile.TTInfo(0, False, "UTC")
 
 
 class SystemTzInfo(datetime.tzinfo):
+    """ tzinfo backed by the zone's TZif file. The file is read (once per zone)
+        with tzfile, so we don't have to switch the TZ environment variable
+        and call tzset for each query """
+
     def __init__(self, tz=None):
         self.tz = tz
+        self._zone_file = False
 
-    def _select_tz(self):
-        tzbackup = None
-        if 'TZ' in os.environ:
-            tzbackup = os.environ['TZ']
-        if self.tz is not None:
-            os.environ['TZ'] = self.tz
-        time.tzset()
-        return tzbackup
-
-    def _restore_tz(self, tzbackup):
-        if tzbackup is None:
-            if 'TZ' in os.environ:
-                del os.environ['TZ']
-        else:
-            os.environ['TZ'] = tzbackup
-        time.tzset()
+    @property
+    def zone_file(self):
+        if self._zone_file is False:
+            self._zone_file = tzfile.load(self.tz, TZ_DIR) if self.tz else None
+        return self._zone_file
+
+    def _find(self, dt):
+        """ Returns the local time type in effect at dt (wall clock time) """
+        if self.zone_file is None:
+            return _UTC
+        return self.zone_file.find_local(_local_seconds(dt))
 
     def utcoffset(self, dt):
-        tzbackup = self._select_tz()
-        try:
-            if time.daylight == 0:
-                # no DST information
-                dstminutes = -time.timezone / 60
-            else:
-                localtime = time.localtime(_seconds_since_epoch(dt))
-                if localtime.tm_isdst != 1:
-                    # not in DST
-                    dstminutes = -time.timezone / 60
-                else:
-                    # in DST
-                    dstminutes = -time.altzone / 60
-            return datetime.timedelta(minutes=int(dstminutes))
-        finally:
-            self._restore_tz(tzbackup)
+        return datetime.timedelta(seconds=self._find(dt).offset)
+
+    def fromutc(self, dt):
+        if self.zone_file is None:
+            return dt
+        ttinfo = self.zone_file.find(_local_seconds(dt))
+        return dt + datetime.timedelta(seconds=ttinfo.offset)
 
     def get_daylight(self):
-        tzbackup = self._select_tz()
-        daylight = time.daylight
-        self._restore_tz(tzbackup)
-        return daylight
+        return 1 if self.zone_file is not None and self.zone_file.has_dst else 0
 
     def is_dst(self, dt):
-        tzbackup = self._select_tz()
-        localtime = time.localtime(_seconds_since_epoch(dt))
-        isdst = localtime.tm_isdst
-        self._restore_tz(tzbackup)
-        return isdst
-
-    def rawutcoffset(self, unused_dt):
-        tzbackup = self._select_tz()
-        try:
-            dstminutes = -time.timezone / 60
-            return datetime.timedelta(minutes=int(dstminutes))
-        finally:
-            self._restore_tz(tzbackup)
+        return 1 if self._find(dt).isdst else 0
+
+    def rawutcoffset(self, dt):
+        return datetime.timedelta(seconds=self._find(dt).std_offset)
 
     def dst(self, dt):
-        tzbackup = self._select_tz()
-        try:
-            if time.daylight == 0:
-                # no DST information, so assume no DST; None would be more
-                # accurate but causes awkwardness in fromutc()
-                return datetime.timedelta(0)
-            else:
-                localtime = time.localtime(_seconds_since_epoch(dt))
-                if localtime.tm_isdst != 1:
-                    # not in DST
-                    return datetime.timedelta(0)
-                else:
-                    dstminutes = (time.timezone - time.altzone) / 60
-                    return datetime.timedelta(minutes=int(dstminutes))
-        finally:
-            self._restore_tz(tzbackup)
+        ttinfo = self._find(dt)
+        if not ttinfo.isdst:
+            return datetime.timedelta(0)
+        return datetime.timedelta(seconds=ttinfo.offset - ttinfo.std_offset)
 
     def tzname(self, unused_dt):
         return self.tz
 
     def tzname_letters(self, dt):
-        tzbackup = self._select_tz()
-        try:
-            localtime = time.localtime(_seconds_since_epoch(dt))
-            return time.strftime('%Z', localtime)
-        finally:
-            self._restore_tz(tzbackup)
+        return self._find(dt).abbr
 
 
 class Iso3166(object):
     def __init__(self):
         self.names = {}
-        document = xml.dom.minidom.parse(ISO_3166_FILE)
-        entries = document.getElementsByTagName('iso_3166_entries')[0]
-        self.handle_entries(entries)
-
-    def handle_entries(self, entries):
-        for entry in entries.getElementsByTagName('iso_3166_entry'):
-            self.handle_entry(entry)
+        try:
+            # iterparse is much faster than building a whole DOM
+            for unused_event, entry in ElementTree.iterparse(ISO_3166_FILE):
+                if entry.tag == 'iso_3166_entry':
+                    self.handle_entry(entry)
+                    entry.clear()
+        except (IOError, ElementTree.ParseError) as err:
+            logging.warning(err)
 
     def handle_entry(self, entry):
-        if (entry.hasAttribute('alpha_2_code') and
-                (entry.hasAttribute('common_name') or
-                 entry.hasAttribute('name'))):
-            alpha_2_code = entry.getAttribute('alpha_2_code')
-            if entry.hasAttribute('common_name'):
-                name = entry.getAttribute('common_name')
-            else:
-                name = entry.getAttribute('name')
+        alpha_2_code = entry.get('alpha_2_code')
+        name = entry.get('common_name') or entry.get('name')
+        if alpha_2_code and name:
             self.names[alpha_2_code] = name
 
 
@@ -172,6 +136,66 @@ def _parse_position(position, wholedigits):
         return whole - fraction / pow(10.0, len(fractionstr))
 
 
+def _parse_zonetab_line(zonetab_line):
+    """ Returns (country, zone, latitude, longitude, comment) from a zone.tab line """
+    bits = zonetab_line.rstrip().split('\t', 3)
+    latlong = bits[1]
+    latlongsplit = latlong.find('-', 1)
+
+    if latlongsplit == -1:
+        latlongsplit = latlong.find('+', 1)
+
+    if latlongsplit != -1:
+        latitude = latlong[:latlongsplit]
+        longitude = latlong[latlongsplit:]
+    else:
+        latitude = latlong
+        longitude = '+0'
+
+    if len(bits) > 3:
+        comment = bits[3]
+    else:
+        comment = None
+
+    return bits[0], bits[2], _parse_position(latitude, 2), _parse_position(longitude, 3), comment
+
+
+def _build_index():
+    """ Reads zone.tab and the iso 3166 country names just once. Returns a list
+        of (country, zone, latitude, longitude, human_country, comment) tuples """
+    iso3166 = Iso3166()
+    index = []
+    with open(TZ_DATA_FILE) as tzdata:
+        for line in tzdata:
+            if line.startswith('#') or not line.strip():
+                continue
+            country, zone, latitude, longitude, comment = _parse_zonetab_line(line)
+            human_country = iso3166.names.get(country, country)
+            index.append((country, zone, latitude, longitude, human_country, comment))
+    return index
+
+
+def _get_zone_md5sum(zone):
+    """ md5sum of a timezone file (None if it can't be read) """
+    try:
+        zone_path = os.path.join(TZ_DIR, zone)
+        with open(zone_path, 'rb') as tz_file:
+            return hashlib.md5(tz_file.read()).digest()
+    except IOError:
+        return None
+
+
+def _get_today():
+    try:
+        return datetime.datetime.today()
+    except (ValueError, OverflowError):
+        # Some versions of Python have problems with clocks set before
+        # the epoch (http://python.org/sf/1646728). Assuming that the
+        # time is set to the epoch will at least let us avoid crashing,
+        # although the UTC offset and zone letters may be wrong.
+        return datetime.datetime.fromtimestamp(0)
+
+
 class Location(object):
     # TODO: Change GObject.G_MAXFLOAT to GLib.MAXFLOAT (Gtk 3.16)
     __gtype_name__ = "Location"
@@ -193,58 +217,53 @@ class Location(object):
     def get_raw_utc_offset(self):
         return self.raw_utc_offset
 
-    def __init__(self, zonetab_line, iso3166):
-        bits = zonetab_line.rstrip().split('\t', 3)
-        latlong = bits[1]
-        latlongsplit = latlong.find('-', 1)
-
-        if latlongsplit == -1:
-            latlongsplit = latlong.find('+', 1)
-
-        if latlongsplit != -1:
-            latitude = latlong[:latlongsplit]
-            longitude = latlong[latlongsplit:]
-        else:
-            latitude = latlong
-            longitude = '+0'
-
-        self.country = bits[0]
-        if self.country in iso3166.names:
-            self.human_country = iso3166.names[self.country]
-        else:
-            self.human_country = self.country
-        self.zone = bits[2]
+    def __init__(self, country, zone, latitude, longitude, human_country, comment=None):
+        self.country = country
+        self.human_country = human_country
+        self.zone = zone
         self.human_zone = self.zone.replace('_', ' ').split('/')[-1]
-        if len(bits) > 3:
-            self.comment = bits[3]
-        else:
-            self.comment = None
-
-        self.latitude = _parse_position(latitude, 2)
-        self.longitude = _parse_position(longitude, 3)
-
-        # Grab md5sum of the timezone file for later comparison
-        try:
-            zone_path = os.path.join('/usr/share/zoneinfo', self.zone)
-            with open(zone_path, 'rb') as tz_file:
-                self.md5sum = hashlib.md5(tz_file.read()).digest()
-        except IOError:
-            self.md5sum = None
-
-        try:
-            today = datetime.datetime.today()
-        except (ValueError, OverflowError):
-            # Some versions of Python have problems with clocks set before
-            # the epoch (http://python.org/sf/1646728). Assuming that the
-            # time is set to the epoch will at least let us avoid crashing,
-            # although the UTC offset and zone letters may be wrong.
-            today = datetime.datetime.fromtimestamp(0)
-
-        self.info = SystemTzInfo(self.zone)
-        self.utc_offset = self.info.utcoffset(today)
-        self.raw_utc_offset = self.info.rawutcoffset(today)
-        self.zone_letters = self.info.tzname_letters(today)
-        self.isdst = self.info.is_dst(today)
+        self.comment = comment
+        self.latitude = latitude
+        self.longitude = longitude
+
+        # Offsets, DST and md5sum are only computed when asked for
+        self._info = None
+        self._today = {}
+        self._md5sum = False
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = SystemTzInfo(self.zone)
+        return self._info
+
+    @property
+    def md5sum(self):
+        """ md5sum of the timezone file (for comparison with other zone names) """
+        if self._md5sum is False:
+            self._md5sum = _get_zone_md5sum(self.zone)
+        return self._md5sum
+
+    def _get_today_value(self, name, method):
+        if name not in self._today:
+            self._today[name] = method(_get_today())
+        return self._today[name]
+
+    @property
+    def utc_offset(self):
+        return self._get_today_value('utc_offset', self.info.utcoffset)
+
+    @property
+    def raw_utc_offset(self):
+        return self._get_today_value('raw_utc_offset', self.info.rawutcoffset)
+
+    @property
+    def zone_letters(self):
+        return self._get_today_value('zone_letters', self.info.tzname_letters)
+
+    @property
+    def isdst(self):
+        return self._get_today_value('isdst', self.info.is_dst)
 
     def get_property(self, prop):
         return getattr(self, prop)
@@ -255,13 +274,7 @@ class Location(object):
 
 class _Database(object):
     def __init__(self):
-        self.locations = []
-        iso3166 = Iso3166()
-        with open(TZ_DATA_FILE) as tzdata:
-            for line in tzdata:
-                if line.startswith('#'):
-                    continue
-                self.locations.append(Location(line, iso3166))
+        self.locations = [Location(*entry) for entry in _build_index()]
 
         # Build mappings from timezone->location and country->locations
         self.cc_to_locs = {}
@@ -281,17 +294,26 @@ class _Database(object):
             # Sometimes we'll encounter timezones that aren't really
             # city-zones, like "US/Eastern" or "Mexico/General".  So first,
             # we check if the timezone is known.  If it isn't, we search for
-            # one with the same md5sum and make a reference to it
+            # one that is the same file (a link) or has the same md5sum
+            # and make a reference to it
             try:
-                zone_path = os.path.join('/usr/share/zoneinfo', tz)
-                with open(zone_path, 'rb') as tz_file:
-                    md5sum = hashlib.md5(tz_file.read()).digest()
-
+                zone_stat = os.stat(os.path.join(TZ_DIR, tz))
                 for loc in self.locations:
-                    if md5sum == loc.md5sum:
+                    try:
+                        loc_stat = os.stat(os.path.join(TZ_DIR, loc.zone))
+                    except OSError:
+                        continue
+                    if (loc_stat.st_dev, loc_stat.st_ino) == (zone_stat.st_dev, zone_stat.st_ino):
                         self.tz_to_loc[tz] = loc
                         return loc
-            except IOError:
+
+                md5sum = _get_zone_md5sum(tz)
+                if md5sum is not None:
+                    for loc in self.locations:
+                        if md5sum == loc.md5sum:
+                            self.tz_to_loc[tz] = loc
+                            return loc
+            except OSError:
                 pass
 
             # If not found, oh well, just warn and move on.
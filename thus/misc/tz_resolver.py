@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  tz_resolver.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" Latitude / longitude to timezone name, without GTK.
+
+    Uses timezone_map.bin, a raster of zone indexes generated from the Olsen
+    map by utils/generate_timezone_map.py (sea pixels already have the zone
+    of the nearest coast) """
+
+import sys
+import array
+import struct
+import zlib
+import logging
+import threading
+
+TIMEZONE_MAP_PATH = "/usr/share/thus/data/locale/timezone_map.bin"
+
+MAGIC = b'TZMP'
+VERSION = 1
+NO_ZONE = 0xFFFF
+
+_HEADER = struct.Struct('>4sBHHHI')
+
+
+class TimezoneResolver(object):
+    """ Answers which zone a coordinate belongs to (a single array lookup) """
+
+    def __init__(self, path=TIMEZONE_MAP_PATH):
+        with open(path, 'rb') as map_file:
+            data = map_file.read()
+
+        (magic, version, self.width, self.height, zone_count, names_size) = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{0} is not a timezone map (version {1})".format(path, VERSION))
+
+        pos = _HEADER.size
+        self.zones = data[pos:pos + names_size].decode('utf-8').split("\n")
+        if len(self.zones) != zone_count:
+            raise ValueError("{0} is corrupted".format(path))
+
+        self.raster = array.array('H', zlib.decompress(data[pos + names_size:]))
+        if sys.byteorder == 'little':
+            # Stored big endian
+            self.raster.byteswap()
+        if len(self.raster) != self.width * self.height:
+            raise ValueError("{0} is corrupted".format(path))
+
+    def get_zone(self, latitude, longitude):
+        """ Returns the zone name at latitude, longitude (None if unknown) """
+        x = int(self.width / 360.0 * (180.0 + longitude))
+        y = int(self.height / 180.0 * (90.0 - latitude))
+        x = min(max(x, 0), self.width - 1)
+        y = min(max(y, 0), self.height - 1)
+
+        zone = self.raster[y * self.width + x]
+        if zone == NO_ZONE or zone >= len(self.zones):
+            return None
+        return self.zones[zone]
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """ Returns the shared resolver (None if the map can't be loaded) """
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            try:
+                _resolver = TimezoneResolver()
+            except (IOError, ValueError, struct.error, zlib.error) as err:
+                logging.warning("Can't load timezone map %s: %s", TIMEZONE_MAP_PATH, err)
+                # Don't try again
+                _resolver = False
+    return _resolver or None
+
+
+def get_timezone_at_coords(latitude, longitude):
+    """ Returns the zone name at latitude, longitude (None if unknown) """
+    resolver = get_resolver()
+    if resolver is None:
+        return None
+    return resolver.get_zone(latitude, longitude)
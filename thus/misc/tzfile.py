@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  tzfile.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" TZif (zoneinfo) file reader. See tzfile(5) and RFC 8536.
+
+    Transition tables are read once per zone and cached. Times after the
+    last transition are answered with the POSIX TZ rule stored in the file
+    footer (version 2 and newer files), as slim zoneinfo files rely on it. """
+
+import os
+import re
+import struct
+import bisect
+import calendar
+import logging
+import threading
+
+TZ_DIR = '/usr/share/zoneinfo'
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Cumulative days before each month (non leap year)
+_DAYS_BEFORE_MONTH = [0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334]
+
+
+class TTInfo(object):
+    """ Local time type: UTC offset (seconds), DST flag and abbreviation.
+        std_offset is the standard time offset in effect with this type """
+
+    def __init__(self, offset, isdst, abbr, std_offset=None):
+        self.offset = offset
+        self.isdst = isdst
+        self.abbr = abbr
+        self.std_offset = offset if std_offset is None else std_offset
+
+
+def _parse_posix_offset(text):
+    """ [+-]hh[:mm[:ss]] to seconds """
+    sign = -1 if text.startswith('-') else 1
+    parts = [int(part) for part in text.lstrip('+-').split(':')]
+    parts += [0] * (3 - len(parts))
+    return sign * (parts[0] * 3600 + parts[1] * 60 + parts[2])
+
+
+_POSIX_TZ = re.compile(
+    r'^(?P<std><[^>]+>|[A-Za-z]+)(?P<stdoff>[+-]?\d+(?::\d+){0,2})'
+    r'(?:(?P<dst><[^>]+>|[A-Za-z]+)(?P<dstoff>[+-]?\d+(?::\d+){0,2})?'
+    r'(?:,(?P<start>[^,]+),(?P<end>[^,]+))?)?$')
+
+
+class PosixRule(object):
+    """ A POSIX TZ string such as "CET-1CEST,M3.5.0,M10.5.0/3" """
+
+    def __init__(self, tz_string):
+        match = _POSIX_TZ.match(tz_string)
+        if match is None:
+            raise ValueError("Unsupported TZ string {0}".format(tz_string))
+
+        # POSIX offsets are west of Greenwich, ours are east
+        std_offset = -_parse_posix_offset(match.group('stdoff'))
+        self.std = TTInfo(std_offset, False, match.group('std').strip('<>'))
+
+        self.dst = None
+        self.start = None
+        self.end = None
+        if match.group('dst'):
+            if match.group('dstoff'):
+                dst_offset = -_parse_posix_offset(match.group('dstoff'))
+            else:
+                dst_offset = std_offset + 3600
+            self.dst = TTInfo(dst_offset, True, match.group('dst').strip('<>'), std_offset)
+            # US rules are the default ones
+            self.start = self._parse_date(match.group('start') or "M3.2.0")
+            self.end = self._parse_date(match.group('end') or "M11.1.0")
+
+    @staticmethod
+    def _parse_date(text):
+        """ Returns (kind, values, seconds after midnight) """
+        if '/' in text:
+            text, time_text = text.split('/', 1)
+            seconds = _parse_posix_offset(time_text)
+        else:
+            seconds = 2 * 3600
+        if text.startswith('M'):
+            return 'M', tuple(int(value) for value in text[1:].split('.')), seconds
+        if text.startswith('J'):
+            return 'J', (int(text[1:]),), seconds
+        return 'N', (int(text),), seconds
+
+    @staticmethod
+    def _day_of_year(year, date):
+        """ Zero based day of the year of a rule date """
+        kind, values, unused_seconds = date
+        leap = calendar.isleap(year)
+        if kind == 'J':
+            # 1..365, February 29th is never counted
+            day = values[0] - 1
+            if leap and values[0] >= 60:
+                day += 1
+            return day
+        if kind == 'N':
+            return values[0]
+
+        month, week, weekday = values
+        first_day = _DAYS_BEFORE_MONTH[month - 1] + (1 if leap and month > 2 else 0)
+        days_in_month = calendar.monthrange(year, month)[1]
+        # calendar.weekday: Monday is 0. POSIX: Sunday is 0
+        first_weekday = (calendar.weekday(year, month, 1) + 1) % 7
+        day = (weekday - first_weekday) % 7 + (week - 1) * 7
+        while day >= days_in_month:
+            day -= 7
+        return first_day + day
+
+    def _transition(self, year, date, offset):
+        """ UTC timestamp of a rule date (given in local time with offset) """
+        year_start = calendar.timegm((year, 1, 1, 0, 0, 0))
+        return year_start + self._day_of_year(year, date) * SECONDS_PER_DAY + date[2] - offset
+
+    def find(self, timestamp):
+        """ Returns the TTInfo in effect at UTC timestamp """
+        if self.dst is None:
+            return self.std
+
+        year = _year_of(timestamp + self.std.offset)
+        start = self._transition(year, self.start, self.std.offset)
+        end = self._transition(year, self.end, self.dst.offset)
+        if start < end:
+            in_dst = start <= timestamp < end
+        else:
+            # Southern hemisphere
+            in_dst = not (end <= timestamp < start)
+        return self.dst if in_dst else self.std
+
+
+def _year_of(timestamp):
+    """ Year of a UTC timestamp (valid for any timestamp, unlike time.gmtime) """
+    days = timestamp // SECONDS_PER_DAY
+    # Start with an estimate and fix it
+    year = 1970 + int(days // 365.2425)
+    while calendar.timegm((year, 1, 1, 0, 0, 0)) > timestamp:
+        year -= 1
+    while calendar.timegm((year + 1, 1, 1, 0, 0, 0)) <= timestamp:
+        year += 1
+    return year
+
+
+class TZFile(object):
+    """ Transitions and local time types of a zone """
+
+    def __init__(self, transitions, types, initial, rule=None, has_dst=False):
+        # transitions is a sorted list of UTC timestamps, types the TTInfo of each one
+        self.transitions = transitions
+        self.types = types
+        # Time type used before the first transition
+        self.initial = initial
+        # Time types after the last transition
+        self.rule = rule
+        # Whether the zone observes DST nowadays (as told by the rule, if there's one)
+        self.has_dst = rule.dst is not None if rule is not None else has_dst
+
+    def find(self, timestamp):
+        """ Returns the TTInfo in effect at UTC timestamp (binary search) """
+        if not self.transitions:
+            return self.rule.find(timestamp) if self.rule is not None else self.initial
+        if timestamp < self.transitions[0]:
+            return self.initial
+        if timestamp >= self.transitions[-1] and self.rule is not None:
+            return self.rule.find(timestamp)
+        index = bisect.bisect_right(self.transitions, timestamp) - 1
+        return self.types[index]
+
+    def find_local(self, local_timestamp):
+        """ Returns the TTInfo in effect at a local (wall clock) timestamp.
+            As with fold=0 (PEP 495), ambiguous times (clocks set back) and
+            skipped ones (clocks set forward) get the type in effect before
+            the change """
+        # UTC offsets are under a day, so the type in effect a day before
+        # and a day after are the ones around any change near local_timestamp
+        before = self.find(local_timestamp - SECONDS_PER_DAY)
+        after = self.find(local_timestamp + SECONDS_PER_DAY)
+        for ttinfo in (before, after):
+            if self.find(local_timestamp - ttinfo.offset).offset == ttinfo.offset:
+                return ttinfo
+        # Skipped time
+        return before
+
+
+def _read_block(data, pos, time_size):
+    """ Reads a TZif header and its data block.
+        Returns a TZFile (without footer rule) and the end position """
+    if data[pos:pos + 4] != b'TZif':
+        raise ValueError("Not a TZif file")
+    (isutcnt, isstdcnt, leapcnt, timecnt, typecnt, charcnt) = struct.unpack('>6l', data[pos + 20:pos + 44])
+    pos += 44
+
+    time_format = '>{0}{1}'.format(timecnt, 'q' if time_size == 8 else 'l')
+    transitions = list(struct.unpack(time_format, data[pos:pos + timecnt * time_size]))
+    pos += timecnt * time_size
+    indices = data[pos:pos + timecnt]
+    pos += timecnt
+
+    raw_types = []
+    for unused_index in range(typecnt):
+        raw_types.append(struct.unpack('>lBB', data[pos:pos + 6]))
+        pos += 6
+
+    chars = data[pos:pos + charcnt]
+    pos += charcnt
+    pos += leapcnt * (time_size + 4) + isstdcnt + isutcnt
+
+    def abbreviation(index):
+        end = chars.find(b'\0', index)
+        return chars[index:end if end != -1 else None].decode('ascii', 'replace')
+
+    # Remember the standard offset in effect at each transition (for dst())
+    std_offset = next((offset for (offset, isdst, unused) in raw_types if not isdst), 0)
+
+    types = []
+    for index in indices:
+        (offset, isdst, abbr_index) = raw_types[index]
+        if not isdst:
+            std_offset = offset
+        types.append(TTInfo(offset, bool(isdst), abbreviation(abbr_index), std_offset))
+
+    if raw_types:
+        (offset, isdst, abbr_index) = raw_types[0]
+        initial = TTInfo(offset, bool(isdst), abbreviation(abbr_index))
+    else:
+        initial = TTInfo(0, False, "UTC")
+
+    has_dst = any(isdst for (unused, isdst, unused_index) in raw_types)
+
+    return TZFile(transitions, types, initial, has_dst=has_dst), pos
+
+
+def parse(data):
+    """ Parses the contents of a TZif file """
+    version = data[4:5]
+    tzfile, pos = _read_block(data, 0, 4)
+
+    if version >= b'2':
+        # Skip the 32 bit block and read the 64 bit one (and the footer)
+        tzfile, pos = _read_block(data, pos, 8)
+        footer = data[pos:].strip(b'\n').split(b'\n')[0].decode('ascii', 'replace')
+        if footer:
+            try:
+                tzfile.rule = PosixRule(footer)
+                tzfile.has_dst = tzfile.rule.dst is not None
+            except ValueError as err:
+                logging.warning(err)
+
+    return tzfile
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load(zone, tz_dir=TZ_DIR):
+    """ Returns the (cached) TZFile of a zone, or None if it can't be read """
+    with _cache_lock:
+        if zone in _cache:
+            return _cache[zone]
+
+    tzfile = None
+    path = os.path.join(tz_dir, zone)
+    try:
+        with open(path, 'rb') as zone_file:
+            tzfile = parse(zone_file.read())
+    except (IOError, ValueError, struct.error) as err:
+        logging.warning("Can't read timezone file %s: %s", path, err)
+
+    with _cache_lock:
+        _cache[zone] = tzfile
+    return tzfile
@@ -71,59 +71,83 @@ PED_PARTITION_LEGACY_BOOT = 15
 
 DEVICE_BLACKLIST = ["^mtd", r'^mmcblk.+boot', r'^mmcblk.+rpmb', "^zram"]
 
+def get_live_media_info():
+    """ Returns df output for the live media mount point (its device must be skipped) """
+    myhomepath = '/bootmnt'
+    if os.path.exists(myhomepath):
+        return subprocess.check_output(["df", "-P", myhomepath]).decode()
+    return ""
+
+
+def probe_device(dev, myhome):
+    """ Returns a (disk, result) tuple for a parted device, or None if it has to be skipped """
+    if dev.path in myhome:
+        return None
+
+    # I left all of the below here but commented out to see some use cases
+    # isbusy = in use/mounted.  Needs to flag if 'yes' to prompt user to umount
+    # isbusy = dev.busy
+    # path gives /dev/sda or something similar
+    # myname = dev.path
+    # Hard drives measure themselves assuming kilo=1000, mega=1mil, etc
+    # limiter = 1000
+    # Some disk size calculations
+    # byte_size = dev.length * dev.sectorSize
+    # megabyte_size = byte_size / (limiter * limiter)
+    # gigabyte_size = megabyte_size / limiter
+    # print(byte_size)
+    # print(dev.length)
+    # Must create disk object to drill down
+
+    # Skip all blacklisted devices
+    dev_name = dev.path[5:]
+    if any(re.search(expr, dev_name) for expr in DEVICE_BLACKLIST):
+        return None
+
+    # Skip cd drive and special devices like LUKS and LVM
+    if dev.path.startswith("/dev/sr") or dev.path.startswith("/dev/mapper"):
+        return None
+
+    disk_obj = None
+    try:
+        disk_obj = parted.Disk(dev)
+        result = OK
+    except parted.DiskLabelException:
+        # logging.warning(_('Unrecognised disk label in device {0}.'.format(dev.path)))
+        result = UNRECOGNISED_DISK_LABEL
+    except Exception as general_error:
+        logging.error(general_error)
+        msg = _("Exception: {0}.\nFor more information take a look at /tmp/thus.log").format(general_error)
+        show.error(None, msg)
+        result = UNKNOWN_ERROR
+    return disk_obj, result
+
+
 @misc.raise_privileges
 def get_devices():
     device_list = parted.getAllDevices()
     disk_dic = {}
 
-    myhomepath = '/bootmnt'
-    if os.path.exists(myhomepath):
-        myhome = subprocess.check_output(["df", "-P", myhomepath]).decode()
-    else:
-        myhome = ""
+    myhome = get_live_media_info()
 
     for dev in device_list:
-        if dev.path in myhome:
-            continue
+        probed = probe_device(dev, myhome)
+        if probed is not None:
+            disk_dic[dev.path] = probed
 
-        # I left all of the below here but commented out to see some use cases
-        # isbusy = in use/mounted.  Needs to flag if 'yes' to prompt user to umount
-        # isbusy = dev.busy
-        # path gives /dev/sda or something similar
-        # myname = dev.path
-        # Hard drives measure themselves assuming kilo=1000, mega=1mil, etc
-        # limiter = 1000
-        # Some disk size calculations
-        # byte_size = dev.length * dev.sectorSize
-        # megabyte_size = byte_size / (limiter * limiter)
-        # gigabyte_size = megabyte_size / limiter
-        # print(byte_size)
-        # print(dev.length)
-        # Must create disk object to drill down
-
-        # Skip all blacklisted devices
-        dev_name = dev.path[5:]
-        if any(re.search(expr, dev_name) for expr in DEVICE_BLACKLIST):
-            continue
+    return disk_dic
 
-        # Skip cd drive and special devices like LUKS and LVM
-        disk_obj = None
-        if not dev.path.startswith("/dev/sr") and not dev.path.startswith("/dev/mapper"):
-            try:
-                disk_obj = parted.Disk(dev)
-                result = OK
-            except parted.DiskLabelException:
-                # logging.warning(_('Unrecognised disk label in device {0}.'.format(dev.path)))
-                result = UNRECOGNISED_DISK_LABEL
-            except Exception as general_error:
-                logging.error(general_error)
-                msg = _("Exception: {0}.\nFor more information take a look at /tmp/thus.log").format(general_error)
-                show.error(None, msg)
-                result = UNKNOWN_ERROR
-            finally:
-                disk_dic[dev.path] = (disk_obj, result)
 
-    return disk_dic
+@misc.raise_privileges
+def get_device(dev_path):
+    """ Probes just one device (a newly plugged disk, for instance).
+        Returns a (disk, result) tuple or None if the device has to be skipped """
+    try:
+        dev = parted.getDevice(dev_path)
+    except Exception as general_error:
+        logging.warning(general_error)
+        return None
+    return probe_device(dev, get_live_media_info())
 
 
 def make_new_disk(dev_path, new_type):
@@ -32,6 +32,13 @@ LOCALE_DIR = "/usr/share/locale"
 
 import os
 import sys
+
+import misc.profiler as profiler
+
+if "--profile" in sys.argv:
+    # Started before argparse, so the imports below are measured too
+    profiler.start()
+
 import logging
 import gettext
 import locale
@@ -41,6 +48,7 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, GObject
 
 import misc.misc as misc
+import misc.log_queue as log_queue
 import info
 import updater
 
@@ -68,7 +76,8 @@ class ThusApp(Gtk.Application):
             sys.exit(1)
 
         # window = main_window.MainWindow(self, cmd_line)
-        main_window.MainWindow(self, cmd_line)
+        with profiler.span("MainWindow", "page"):
+            main_window.MainWindow(self, cmd_line)
 
         # Some tutorials show that this line is needed, some don't
         # It seems to work ok without
@@ -107,12 +116,14 @@ def setup_logging():
         '[%(asctime)s] [%(module)s] %(levelname)s: %(message)s',
         "%Y-%m-%d %H:%M:%S")
 
+    handlers = []
+
     # Create file handler
     try:
-        file_handler = logging.FileHandler('/tmp/thus.log', mode='w')
+        file_handler = logging.FileHandler(log_queue.LOG_PATH, mode='w')
         file_handler.setLevel(log_level)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     except PermissionError as permission_error:
         print("Can't open /tmp/thus.log : ", permission_error)
 
@@ -121,7 +132,14 @@ def setup_logging():
         stream_handler = logging.StreamHandler()
         stream_handler.setLevel(log_level)
         stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
+        handlers.append(stream_handler)
+
+    # Our loggers (and the installation process ones) only queue their
+    # messages, a thread writes them using these handlers
+    log_queue.setup(handlers, log_level)
+
+    if cmd_line.profile:
+        logging.info("Profiling. Timings are written to %s", profiler.TRACE_PATH)
 
 
 def check_gtk_version():
@@ -205,6 +223,10 @@ def parse_options():
         "-p", "--packagelist",
         help=_("Install the packages referenced by a local xml instead of the default ones"),
         nargs='?')'''
+    parser.add_argument(
+        "--profile",
+        help=_("Write import, page and install phase timings to {0}").format(profiler.TRACE_PATH),
+        action="store_true")
     parser.add_argument(
         "-t", "--testing",
         help=_("Do not perform any changes (useful for developers)"),
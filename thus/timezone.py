@@ -39,6 +39,7 @@ import logging
 import hashlib
 
 import misc.tz as tz
+import misc.tz_resolver as tz_resolver
 import misc.misc as misc
 import misc.timezonemap as timezonemap
 # from mirrorlist import GenerateMirrorListThread
@@ -215,7 +216,10 @@ class Timezone(GtkBaseBox):
             coords = self.autodetected_coords
             latitude = float(coords[0])
             longitude = float(coords[1])
-            timezone = self.tzmap.get_timezone_at_coords(latitude, longitude)
+            # The thread has already looked it up (if the timezone map was available)
+            timezone = coords[2]
+            if timezone is None:
+                timezone = self.tzmap.get_timezone_at_coords(latitude, longitude)
             self.set_timezone(timezone)
             self.forward_button.set_sensitive(True)
 
@@ -338,7 +342,11 @@ class AutoTimezoneThread(threading.Thread):
             msg = _("Timezone (latitude {0}, longitude {1}) detected.")
             msg = msg.format(coords[0], coords[1])
             logging.debug(msg)
-            self.coords_queue.put(coords)
+            try:
+                zone = tz_resolver.get_timezone_at_coords(float(coords[0]), float(coords[1]))
+            except ValueError:
+                zone = None
+            self.coords_queue.put([coords[0], coords[1], zone])
 
 # When testing, no _() is available
 try:
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  generate_kbdnames_index.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" This script generates data/kbdnames.idx (used by thus/misc/keyboard_names.py)
+    from data/kbdnames.gz. Run it from Thus' root directory after updating
+    kbdnames.gz.
+
+    The index stores the lines of each language together, without the
+    language field and zlib compressed, and a table with the offset and size
+    of each language block, so the installer only reads (and decompresses)
+    the block of the language it needs. """
+
+import gzip
+import zlib
+import struct
+from collections import OrderedDict
+
+KBDNAMES_PATH = "data/kbdnames.gz"
+OUTPUT_PATH = "data/kbdnames.idx"
+
+MAGIC = b'KBDN'
+VERSION = 2
+LANG_SIZE = 16
+
+
+def main():
+    blocks = OrderedDict()
+    with gzip.open(KBDNAMES_PATH, 'rt', encoding='utf-8') as kbdnames:
+        for line in kbdnames:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            lang, rest = line.split("*", 1)
+            blocks.setdefault(lang, []).append(rest)
+
+    header = struct.pack('>4sBH', MAGIC, VERSION, len(blocks))
+    table_size = len(blocks) * (LANG_SIZE + 8)
+    offset = len(header) + table_size
+
+    table = []
+    data = []
+    for lang, lines in blocks.items():
+        block = zlib.compress(("\n".join(lines) + "\n").encode('utf-8'), 9)
+        table.append(struct.pack('>{0}sII'.format(LANG_SIZE), lang.encode('ascii'), offset, len(block)))
+        data.append(block)
+        offset += len(block)
+
+    with open(OUTPUT_PATH, 'wb') as output:
+        output.write(header)
+        output.write(b''.join(table))
+        output.write(b''.join(data))
+
+    print("{0} written ({1} languages)".format(OUTPUT_PATH, len(blocks)))
+
+
+if __name__ == '__main__':
+    main()
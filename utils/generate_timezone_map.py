@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  generate_timezone_map.py
+#
+#  Copyright © 2013-2015 Antergos (http://antergos.com/)
+#  Copyright © 2013-2015 Manjaro (http://manjaro.org)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+""" This script generates data/locale/timezone_map.bin (used by
+    thus/misc/tz_resolver.py) from the Olsen map image and its zone list.
+
+    Each pixel of olsen_map.png encodes a zone index in its red and green
+    channels. Sea and unknown areas get the zone of the nearest land pixel,
+    so every coordinate resolves to a zone. Run it from Thus' root directory
+    after changing any of the source files. """
+
+import struct
+import zlib
+from collections import deque
+import xml.etree.ElementTree as ElementTree
+
+OLSEN_MAP_PATH = "data/images/timezonemap/olsen_map.png"
+TIMEZONES_PATH = "data/locale/timezones.xml"
+OUTPUT_PATH = "data/locale/timezone_map.bin"
+
+MAGIC = b'TZMP'
+VERSION = 1
+NO_ZONE = 0xFFFF
+
+
+def read_png_rgb(path):
+    """ Decodes a non interlaced 8 bit RGB PNG. Returns width, height and rows """
+    with open(path, 'rb') as png_file:
+        data = png_file.read()
+
+    pos = 8
+    compressed = []
+    while pos < len(data):
+        (length, chunk_type) = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if chunk_type == b'IHDR':
+            (width, height, depth, color_type, unused, unused, interlace) = struct.unpack('>IIBBBBB', chunk)
+            if depth != 8 or color_type != 2 or interlace != 0:
+                raise ValueError("{0} is not a non interlaced 8 bit RGB image".format(path))
+        elif chunk_type == b'IDAT':
+            compressed.append(chunk)
+
+    raw = zlib.decompress(b''.join(compressed))
+    bpp = 3
+    stride = width * bpp
+    rows = []
+    previous = bytearray(stride)
+    pos = 0
+    for unused in range(height):
+        filter_type = raw[pos]
+        line = bytearray(raw[pos + 1:pos + 1 + stride])
+        pos += 1 + stride
+        for i in range(stride):
+            left = line[i - bpp] if i >= bpp else 0
+            up = previous[i]
+            up_left = previous[i - bpp] if i >= bpp else 0
+            if filter_type == 1:
+                line[i] = (line[i] + left) & 255
+            elif filter_type == 2:
+                line[i] = (line[i] + up) & 255
+            elif filter_type == 3:
+                line[i] = (line[i] + ((left + up) >> 1)) & 255
+            elif filter_type == 4:
+                estimate = left + up - up_left
+                distances = (abs(estimate - left), abs(estimate - up), abs(estimate - up_left))
+                if distances[0] <= distances[1] and distances[0] <= distances[2]:
+                    predictor = left
+                elif distances[1] <= distances[2]:
+                    predictor = up
+                else:
+                    predictor = up_left
+                line[i] = (line[i] + predictor) & 255
+        rows.append(line)
+        previous = line
+    return width, height, rows
+
+
+def get_zone_raster(width, height, rows, zone_count):
+    """ Decodes the zone of each pixel (NO_ZONE for sea and unknown areas) """
+    raster = [NO_ZONE] * (width * height)
+    for y, row in enumerate(rows):
+        for x in range(width):
+            red, green, blue = row[x * 3:x * 3 + 3]
+            # Sea is painted blue
+            if blue != 0:
+                continue
+            zone = ((red & 248) << 1) + ((green >> 4) & 15)
+            if zone < zone_count:
+                raster[y * width + x] = zone
+    return raster
+
+
+def fill_raster(width, height, raster):
+    """ Gives each empty pixel the zone of the nearest pixel that has one
+        (breadth first search from all zone pixels, longitude wraps around) """
+    pending = deque(index for index, zone in enumerate(raster) if zone != NO_ZONE)
+    while pending:
+        index = pending.popleft()
+        y, x = divmod(index, width)
+        neighbours = [y * width + (x - 1) % width, y * width + (x + 1) % width]
+        if y > 0:
+            neighbours.append(index - width)
+        if y < height - 1:
+            neighbours.append(index + width)
+        for neighbour in neighbours:
+            if raster[neighbour] == NO_ZONE:
+                raster[neighbour] = raster[index]
+                pending.append(neighbour)
+
+
+def main():
+    zones = [node.text for node in ElementTree.parse(TIMEZONES_PATH).getroot().iter("timezone_name")]
+    width, height, rows = read_png_rgb(OLSEN_MAP_PATH)
+    raster = get_zone_raster(width, height, rows, len(zones))
+    fill_raster(width, height, raster)
+
+    names = "\n".join(zones).encode('utf-8')
+    pixels = zlib.compress(struct.pack('>{0}H'.format(len(raster)), *raster), 9)
+
+    with open(OUTPUT_PATH, 'wb') as output:
+        output.write(struct.pack('>4sBHHHI', MAGIC, VERSION, width, height, len(zones), len(names)))
+        output.write(names)
+        output.write(pixels)
+
+    print("{0} written ({1} zones, {2}x{3} pixels)".format(OUTPUT_PATH, len(zones), width, height))
+
+
+if __name__ == '__main__':
+    main()